@@ -1,147 +1,311 @@
 # coding=utf-8
 
 import numpy as np
-from .utils import utils
-import numba
+from .utils import operators
+from .utils import kernels
+from .utils import trace
+from .utils import adaptive_dumping
+from .utils import acceleration as accelerating
+from .utils import active_set as active_sets
+from .utils import denoisers
+from .utils import regularization_path
 
 
-class AMPSolver(object):
+class AMPSolver(regularization_path.RegularizationPath):
     """ approximate message passing solver for the Standard Linear Model (SLM) """
 
-    def __init__(self, A, y, regularization_strength, dumping_coefficient):
+    def __init__(self, A, y, regularization_strength, dumping_coefficient, dtype=np.float64, acceleration=None,
+                 active_set=True, denoiser=None):
         """constructor
 
         Args:
-            A: observation matrix of shape (M, N)
-            y: observed value of shape (M, )
+            A: observation matrix of shape (M, N) (numpy array, np.memmap, scipy.sparse matrix, path of a .npy file
+               or utils.operators.LinearOperator)
+            y: observed value of shape (M, ) or (M, B) for B observations sharing A
             regularization_strength: regularization parameter
-            dumping_coefficient: dumping coefficient
+            dumping_coefficient: dumping coefficient or utils.adaptive_dumping.AdaptiveDumping
+            dtype: data type of the observation matrix, the matrix products and the vector messages
+                   (np.float32 halves the memory traffic, the convergence check is accumulated in np.float64)
+            acceleration: utils.acceleration.AndersonAcceleration of the solve loop (plain iteration if None)
+            active_set: whether the forward products are taken over the active columns of the denoised estimate
+                        (see utils.active_set, used only for a dense numpy observation matrix and a sparse denoiser)
+            denoiser: name of a denoiser of utils.denoisers or utils.denoisers.Denoiser (soft thresholding if None)
         """
-        self.A = A.copy()
-        self.A2 = self.A * self.A  # A squared
+        self.dtype = np.dtype(dtype)
+        self.A = operators.aslinearoperator(A, dtype=self.dtype)
+        self.A2 = self.A.squared()  # A squared
 
-        self.y = y.copy()
-        self.M, self.N = A.shape
+        self.y = np.array(y, dtype=self.dtype)
+        self.M, self.N = self.A.shape
+        # components of the signal over which the convergence norm is taken
+        # (more than N for a solver on the columns kept by screening, see utils.regularization_path)
+        self.n_components = self.N
 
-        self.z = np.random.normal(0.0, 1.0, self.M)
-        self.V = np.random.uniform(0.5, 1.0, self.M)
-        self.R = np.random.normal(0.0, 1.0, self.N)
-        self.T = np.random.uniform(0.5, 1.0, self.N)
+        batch_shape = self.y.shape[1:]  # () for a single observation, (B, ) for multiple observations
 
-        self.r = np.zeros(self.N)  # estimator
-        self.chi = np.ones(self.N)  # variance
+        self.z = np.random.normal(0.0, 1.0, (self.M,) + batch_shape).astype(self.dtype)
+        self.V = np.random.uniform(0.5, 1.0, (self.M,) + batch_shape).astype(self.dtype)
+        self.R = np.random.normal(0.0, 1.0, (self.N,) + batch_shape).astype(self.dtype)
+        self.T = np.random.uniform(0.5, 1.0, (self.N,) + batch_shape).astype(self.dtype)
+
+        self.r = np.zeros((self.N,) + batch_shape, dtype=self.dtype)  # estimator
+        self.chi = np.ones((self.N,) + batch_shape, dtype=self.dtype)  # variance
+        self.converged = np.zeros(batch_shape, dtype=bool)  # convergence flag of each observation
 
         self.l = regularization_strength  # regularization parameter
         self.d = dumping_coefficient  # dumping coefficient
+        self.acceleration = acceleration
+        self.denoiser = denoisers.get(denoiser)
+        self.active_set = None  # forward products over the active columns
+        if active_set and self.denoiser.sparse and isinstance(self.A, operators.DenseOperator):
+            self.active_set = active_sets.ActiveSetProducts(self.A)
 
-    @numba.jit(parallel=True)
-    def solve(self, max_iteration=50, tolerance=1e-5, message=False):
+    def solve(self, max_iteration=50, tolerance=1e-5, message=False, trace_every=1,
+              min_iteration=regularization_path.MIN_ITERATION):
         """AMP solver
 
         Args:
             max_iteration: maximum number of iterations to be used
             tolerance: stopping criterion
             message: convergence info
+            trace_every: sampling rate of the traces of self.result (only the last iteration if 0)
+            min_iteration: number of iterations before which the solve does not stop
+                           (the estimate of a large l may stay at zero for the first iterations)
 
         Returns:
-            estimated signal
+            estimated signal of shape (N, ) or (N, B)
+            (the iteration count, the convergence flags and the traces of abs_diff, the estimate norm
+            and the means of V and T over the components are stored in self.result)
         """
+        y = kernels.as_columns(self.y)
+        l = kernels.as_column_scalars(self.l, y.shape[1])
+        self.result = trace.SolveResult(max_iteration, self.y.shape[1:], ("V", "T"), trace_every)
         convergence_flag = False
+        adaptive_dumping.reset(self.d)
+        accelerating.reset(self.acceleration)
+        if self.active_set is not None:
+            self.active_set.reset()
         for iteration_index in range(max_iteration):
-            # self.V, self.z, self.R, self.T = self.__update_V(), self.__update_z(), self.__update_R(), self.__update_T()
-            self.V, self.z = self.__update_V(), self.__update_z()
-
-            self.R, self.T = self.__update_R(), self.__update_T()
-
-            new_r, new_chi = self.__update_r(), self.__update_chi()
-            old_r = self.r.copy()
-            self.r = utils.update_dumping(self.r, new_r, self.d)
-            self.chi = utils.update_dumping(self.chi, new_chi, self.d)
+            V, z, R, T, r, chi, squared_diff = self.__update(y, l, kernels.as_columns(self.V),
+                                                             kernels.as_columns(self.z),
+                                                             kernels.as_columns(self.r),
+                                                             kernels.as_columns(self.chi))
+            self.V, self.z = V.reshape(self.y.shape), z.reshape(self.y.shape)
+            self.R, self.T = R.reshape(self.r.shape), T.reshape(self.r.shape)
+            self.r, self.chi = r.reshape(self.r.shape), chi.reshape(self.r.shape)
 
-            abs_diff = np.linalg.norm(old_r - self.r) / np.sqrt(self.N)
-            if abs_diff < tolerance:
+            abs_diff = np.sqrt(squared_diff / self.n_components).reshape(self.y.shape[1:])
+            adaptive_dumping.update(self.d, abs_diff, V=np.mean(self.V, axis=0))
+            if self.result.due(iteration_index):
+                self.__record(iteration_index, abs_diff)
+            if np.all(abs_diff < tolerance) and iteration_index + 1 >= min_iteration:
                 convergence_flag = True
                 if message:
                     print("requirement satisfied")
                     print("abs_diff: ", abs_diff)
-                    print("abs_estimate: ", np.linalg.norm(self.r))
+                    print("abs_estimate: ", np.linalg.norm(self.r, axis=0))
                     print("iteration number = ", iteration_index + 1)
                     print()
                 break
-        if convergence_flag:
-            pass
-            # print("converged")
-            # print("abs_diff=", abs_diff)
-            # print("estimate norm=", np.linalg.norm(self.r))
-            # if np.linalg.norm(self.r) !=0.0 :
-            #     print("relative diff= ", abs_diff / np.linalg.norm(self.r))
-            # print("iteration num=", iteration_index + 1)
-            # print()
-        else:
+            accelerating.step(self.acceleration, self, ("V", "z", "r", "chi"), positive=("V", "chi"))
+        self.__record(iteration_index, abs_diff)
+        if message and not convergence_flag:
+            estimate_norm = np.linalg.norm(self.r, axis=0)
             print("does not converged.")
             print("abs_diff=", abs_diff)
-            print("estimate norm=", np.linalg.norm(self.r))
-            if np.linalg.norm(self.r) !=0.0 :
-                print("relative diff= ", abs_diff / np.linalg.norm(self.r))
+            print("estimate norm=", estimate_norm)
+            if np.all(estimate_norm != 0.0):
+                print("relative diff= ", abs_diff / estimate_norm)
             print("iteration num=", iteration_index + 1)
             print()
 
-    @numba.jit(parallel=True)
-    def __update_V(self):
-        """ update V
+        self.converged = abs_diff < tolerance
+        self.result.finish(iteration_index, abs_diff, self.converged, self.r)
+        return self.r
+
+    def loo_error(self):
+        """approximate leave-one-out cross-validation error of the current fixed point
+
+        at the fixed point the residual of each row predicted by the estimate without that row is
+        the Onsager corrected residual (1 + V) (y - A r) with V = A2 @ chi and chi = T * derivative of the denoiser,
+        so that the error is obtained without refitting. it is meaningful only when the solver has converged.
 
         Returns:
-            new V
+            mean squared leave-one-out residual of shape () or (B, )
         """
-        return self.A2 @ self.chi
+        return self.__loo_error(self.r, self.R, self.T, self.l)
+
+    def __loo_error(self, r, R, T, l):
+        """approximate leave-one-out error of estimates
 
-    @numba.jit(parallel=True)
-    def __update_z(self):
-        """ update z
+        Args:
+            r: estimates of shape (N, ...)
+            R: R of the estimates of shape (N, ...)
+            T: T of the estimates of shape (N, ...)
+            l: regularization parameters broadcast to the shape (...)
 
         Returns:
-            new z
+            mean squared leave-one-out residual of shape (...)
         """
-        return self.y - self.A @ self.r + (self.V / (1.0 + self.V)) * self.z
+        shape = (self.M,) + r.shape[1:]
+        residual = self.y.reshape(self.y.shape + (1,) * (r.ndim - self.y.ndim)) - (
+            self.A @ r.reshape(self.N, -1)).reshape(shape)
+        # chi of the fixed point, which does not depend on the dumping of the chi messages
+        _, derivative = self.denoiser(R, l, T)
+        chi = (T * derivative).astype(self.dtype)
+        V = (self.A2 @ chi.reshape(self.N, -1)).reshape(shape)
+        return np.mean(np.square((1.0 + V) * residual), axis=0, dtype=np.float64)
 
-    @numba.jit(parallel=True)
-    def __update_R(self):
-        """ update R
+    def __record(self, iteration_index, abs_diff):
+        """record an iteration in self.result
 
-        Returns:
-            new R
+        Args:
+            iteration_index: index of the iteration
+            abs_diff: abs_diff of the iteration
         """
-        v1 = self.A.T @ (self.z / (1.0 + self.V))
-        v2 = self.A2.T @ (1.0 / (1.0 + self.V))
-        return self.r + v1 / v2
+        self.result.record(iteration_index, abs_diff=abs_diff, estimate_norm=np.linalg.norm(self.r, axis=0),
+                           V=np.mean(self.V, axis=0, dtype=np.float64), T=np.mean(self.T, axis=0, dtype=np.float64))
 
-    @numba.jit(parallel=True)
-    def __update_T(self):
-        """ update T
+    def _finish_path(self, l_path, r_path, R_path, T_path):
+        """store the approximate leave-one-out error of each column of the path in self.path_loo_error
+
+        the error (see loo_error) is computed for all the columns at once from one product of A and A2.
+
+        Args:
+            l_path: regularization parameters of shape (K, )
+            r_path: estimates of shape (N, ..., K)
+            R_path: R of the estimates of shape (N, ..., K)
+            T_path: T of the estimates of shape (N, ..., K)
+        """
+        self.path_loo_error = self.__loo_error(r_path, R_path, T_path, l_path)
+
+    def _iterate_columns(self, y, l, V, z, r, chi, max_iteration, tolerance, message, min_iteration=1):
+        """ AMP iteration for a block of regularization parameters
+
+        V, z, r and chi are updated in place and each column is frozen as soon as it converges.
+
+        Args:
+            y: observed values of shape (M, K)
+            l: regularization parameters of shape (K, )
+            V: V of shape (M, K)
+            z: z of shape (M, K)
+            r: estimator of shape (N, K)
+            chi: variance of shape (N, K)
+            max_iteration: maximum number of iterations to be used
+            tolerance: stopping criterion
+            message: convergence info
+            min_iteration: number of iterations before which no column is frozen
 
         Returns:
-            new T
+            R, T and convergence flags of the columns
         """
-        v = self.A2.T @ (1.0 / (1.0 + self.V))
-        return 1.0 / v
+        K = l.shape[0]
+        R = np.zeros((self.N, K), dtype=self.dtype)
+        T = np.zeros((self.N, K), dtype=self.dtype)
+        converged = np.zeros(K, dtype=bool)
+        active = np.arange(K)  # columns which have not converged yet
+
+        # messages of the active columns, sliced again only when a column is frozen,
+        # so that the products of the active set (utils.active_set) see the messages dumped by the iteration
+        y_a, l_a, V_a, z_a, r_a, chi_a = y[:, active], l[active], V[:, active], z[:, active], r[:, active], \
+            chi[:, active]
+
+        adaptive_dumping.reset(self.d)
+        if self.active_set is not None:
+            self.active_set.reset()
+        for iteration_index in range(max_iteration):
+            V_a, z_a, R_a, T_a, r_a, chi_a, squared_diff = self.__update(y_a, l_a, V_a, z_a, r_a, chi_a)
+            abs_diff = np.sqrt(squared_diff / self.n_components)
+            adaptive_dumping.update(self.d, abs_diff, V=np.mean(V_a, axis=0))
+
+            V[:, active], z[:, active], R[:, active], T[:, active] = V_a, z_a, R_a, T_a
+            r[:, active], chi[:, active] = r_a, chi_a
+
+            satisfied = (abs_diff < tolerance) & (iteration_index + 1 >= min_iteration)
+            converged[active[satisfied]] = True
+            if np.any(satisfied):
+                keep = ~satisfied
+                active = active[keep]
+                y_a, l_a, V_a, z_a, r_a, chi_a = y_a[:, keep], l_a[keep], V_a[:, keep], z_a[:, keep], r_a[:, keep], \
+                    chi_a[:, keep]
+            if active.size == 0:
+                if message:
+                    print("requirement satisfied")
+                    print("iteration number = ", iteration_index + 1)
+                    print()
+                break
+
+        return R, T, converged
+
+    def __update(self, y, l, V, z, r, chi):
+        """ one AMP iteration on columns
 
-    @numba.jit(parallel=True)
-    def __update_r(self):
-        """ update r
+        the element-wise steps between the matrix products are done by the fused kernels of utils.kernels,
+        and A2.T @ (1 / (1 + V)) is computed once for R and T.
+        for a streaming operator (see utils.operators.MemmapOperator) the four products are done
+        in one pass over the row blocks of A.
+        with the active set, A2 @ chi and A @ r are taken over the active columns of the previous iteration.
+
+        Args:
+            y: observed values of shape (M, K)
+            l: regularization parameters of shape (K, )
+            V: V of the previous iteration of shape (M, K), which enters the Onsager term of z
+            z: z of shape (M, K)
+            r: estimator of shape (N, K)
+            chi: variance of shape (N, K)
 
         Returns:
-            new r
+            new V, z, R, T, r, chi and squared norm of the change of r of shape (K, )
         """
-        return (self.R - self.l * self.T * np.sign(self.R)) * np.heaviside(np.abs(self.R) - self.l * self.T, 0.5)
+        if self.A.streaming:
+            new_V, new_z, v1, v2 = self.__stream_products(y, V, z, r, chi)
+        else:
+            if self.active_set is not None:
+                new_V = self.active_set.matvec(chi, squared=True)
+                Ar = self.active_set.matvec(r)
+            else:
+                new_V = self.A2 @ chi
+                Ar = self.A @ r
+            new_z, w, zw = np.empty_like(z), np.empty_like(z), np.empty_like(z)
+            kernels.amp_update_z(y, Ar, V, new_V, z, new_z, w, zw)
+
+            v1 = self.A.T @ zw
+            v2 = self.A2.T @ w
+        R, T, new_r, new_chi = np.empty_like(r), np.empty_like(r), np.empty_like(r), np.empty_like(r)
+        support = np.empty(self.N, dtype=bool)
+        d = adaptive_dumping.coefficient(self.d, "r")
+        squared_diff = self.denoiser.kernel(kernels.amp_update_r)(v1, v2, r, chi, l, d, R, T, new_r, new_chi,
+                                                                  support, self.denoiser.parameters)
+        if self.active_set is not None:
+            self.active_set.dumped(new_r, new_chi, r, chi, support, d)
+        return new_V, new_z, R, T, new_r, new_chi, squared_diff
+
+    def __stream_products(self, y, V, z, r, chi):
+        """ products of one AMP iteration in one pass over the row blocks of A
 
-    @numba.jit(parallel=True)
-    def __update_chi(self):
-        """ update chi
+        the rows of new V, A r and z depend only on the same rows of A, so that each block contributes
+        its rows of z and its terms of A.T @ zw and A2.T @ w as soon as it is read.
+        the squared block is computed on the fly.
+
+        Args:
+            y: observed values of shape (M, K)
+            V: V of the previous iteration of shape (M, K)
+            z: z of shape (M, K)
+            r: estimator of shape (N, K)
+            chi: variance of shape (N, K)
 
         Returns:
-            new chi
+            new V, new z, A.T @ zw and A2.T @ w
         """
-        return self.T * np.heaviside(np.abs(self.R) - self.l * self.T, 0.5)
+        new_V, new_z, w, zw = np.empty_like(z), np.empty_like(z), np.empty_like(z), np.empty_like(z)
+        v1, v2 = np.zeros_like(r), np.zeros_like(r)
+        for rows, block in self.A.blocks():
+            squared_block = np.square(block)
+            new_V[rows] = squared_block @ chi
+            kernels.amp_update_z(y[rows], block @ r, V[rows], new_V[rows], z[rows], new_z[rows], w[rows], zw[rows])
+            v1 += block.T @ zw[rows]
+            v2 += squared_block.T @ w[rows]
+        return new_V, new_z, v1, v2
 
     def show_me(self):
         """ debug method """
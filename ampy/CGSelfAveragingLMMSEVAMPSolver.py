@@ -0,0 +1,280 @@
+# coding=utf-8
+
+import numpy  as np
+from .utils import utils
+from .utils import operators
+from .utils import iterative
+from .utils import kernels
+from .utils import trace
+from .utils import adaptive_dumping
+from .utils import acceleration as accelerating
+from .utils import denoisers
+
+# ratio of the relative tolerance of the conjugate gradient to the tolerance of the solve if it is not given
+CG_TOLERANCE_RATIO = 0.1
+
+
+class CGSelfAveragingLMMSEVAMPSolver(object):
+    """ matrix-free self averaging vector approximate message passing solver (LMMSE form)
+        in this version, the LMMSE estimation is solved by conjugate gradient with the products of A and A.T only,
+        and alpha_2 is estimated from Hutchinson probes solved in the same block of columns.
+        the probes are fixed, so that the iteration is a deterministic map whose fixed point differs from that of
+        the exact alpha_2 by the error of the probes (about 2e-6 in x_hat_1 with 32 probes at (1000, 2000)),
+        and the conjugate gradient must be more accurate than the tolerance of the solve,
+        or abs_diff stalls at about its tolerance (cg_tolerance=None ties it to the tolerance of the solve).
+    """
+
+    def __init__(self, A, y, regularization_strength, dumping_coefficient, dtype=np.float64, n_probes=32,
+                 cg_tolerance=None, cg_max_iteration=None, acceleration=None, denoiser=None):
+        """constructor
+
+        Args:
+            A: observation matrix of shape (M, N) (numpy array, np.memmap, scipy.sparse matrix, path of a .npy file
+               or utils.operators.LinearOperator)
+            y: observed value of shape (M, ) or (M, B) for B observations sharing A
+            regularization_strength: regularization parameter
+            dumping_coefficient: dumping coefficient or utils.adaptive_dumping.AdaptiveDumping
+            dtype: data type of the observation matrix, the matrix products and the vector messages
+                   (np.float32 halves the memory traffic, the convergence check is accumulated in np.float64)
+            n_probes: number of Rademacher probes of the estimate of alpha_2
+            cg_tolerance: relative tolerance of the conjugate gradient
+                          (CG_TOLERANCE_RATIO times the tolerance of solve if None)
+            cg_max_iteration: maximum number of conjugate gradient iterations per LMMSE estimation (N if None)
+            acceleration: utils.acceleration.AndersonAcceleration of the solve loop (plain iteration if None)
+            denoiser: name of a denoiser of utils.denoisers or utils.denoisers.Denoiser (soft thresholding if None)
+        """
+        self.dtype = np.dtype(dtype)
+        self.l = regularization_strength
+        self.dumping = dumping_coefficient
+        self.acceleration = acceleration
+        self.denoiser = denoisers.get(denoiser)
+
+        self.A = operators.aslinearoperator(A, dtype=self.dtype)
+        self.y = np.array(y, dtype=self.dtype)
+        self.y_tilde = self.A.T @ self.y
+
+        self.M, self.N = self.A.shape
+        batch_shape = self.y.shape[1:]  # () for a single observation, (B, ) for multiple observations
+
+        # de-noising part
+        self.x_hat_1 = np.random.normal(0.0, 1.0, (self.N,) + batch_shape).astype(self.dtype)
+        self.alpha_1 = np.ones(batch_shape)
+        self.eta_1 = np.ones(batch_shape)
+        self.gamma_2 = np.ones(batch_shape)
+        self.r_2 = np.random.normal(0.0, 1.0, (self.N,) + batch_shape).astype(self.dtype)
+
+        # Linear Minimum Mean Square Error (LMMSE) Estimator part
+        self.x_hat_2 = np.random.normal(0.0, 1.0, (self.N,) + batch_shape).astype(self.dtype)
+        self.alpha_2 = np.ones(batch_shape)
+        self.eta_2 = np.ones(batch_shape)
+        self.gamma_1 = np.ones(batch_shape)
+        self.r_1 = np.random.normal(0.0, 1.0, (self.N,) + batch_shape).astype(self.dtype)
+
+        self.converged = np.zeros(batch_shape, dtype=bool)  # convergence flag of each observation
+
+        # fixed probes, so that the LMMSE estimation is a deterministic function of the messages
+        self.n_probes = n_probes
+        self.cg_tolerance = cg_tolerance
+        self.cg_max_iteration = cg_max_iteration
+        self.probes = iterative.rademacher((self.N, n_probes), dtype=self.dtype)
+        self.A_probes = self.A @ self.probes
+        self.probe_solutions = np.zeros((self.N,) + batch_shape + (n_probes,), dtype=self.dtype)  # warm start
+        self.column_norms = self.A.squared().T @ np.ones(self.M, dtype=self.dtype)  # diagonal of A.T @ A
+        self.cg_iterations = 0  # number of conjugate gradient iterations of the last LMMSE estimation
+        self.__cg_tolerance = cg_tolerance  # relative tolerance of the conjugate gradient of the running solve
+
+    def solve(self, max_iteration=50, tolerance=1e-5, message=False, trace_every=1):
+        """VAMP solver
+
+        Args:
+            max_iteration: maximum number of iterations to be used
+            tolerance: stopping criterion
+            message: convergence info
+            trace_every: sampling rate of the traces of self.result (only the last iteration if 0)
+
+        Returns:
+            estimated signal of shape (N, ) or (N, B)
+            (the iteration count, the convergence flags and the traces of abs_diff, the estimate norm,
+            alpha_1, alpha_2, gamma_1, gamma_2 and the conjugate gradient iterations are stored in self.result)
+        """
+        convergence_flag = False
+        abs_diff = 9999
+        iteration_index = 9999
+        self.result = trace.SolveResult(max_iteration, self.y.shape[1:],
+                                        ("alpha_1", "alpha_2", "gamma_1", "gamma_2", "cg_iterations"), trace_every)
+
+        self.__cg_tolerance = CG_TOLERANCE_RATIO * tolerance if self.cg_tolerance is None else self.cg_tolerance
+        adaptive_dumping.reset(self.dumping)
+        accelerating.reset(self.acceleration)
+        for iteration_index in range(max_iteration):
+            # denonising
+            self.x_hat_1, self.alpha_1, squared_diff = self.__update_x_hat_1()
+            new_eta_1 = self.__update_eta_1()
+            self.eta_1 = np.clip(
+                utils.update_dumping(old_x=self.eta_1, new_x=new_eta_1,
+                                     dumping_coefficient=adaptive_dumping.coefficient(self.dumping, "eta_1")),
+                a_min=1e-9,
+                a_max=1e9)
+
+            new_gamma_2 = self.__update_gamma_2()
+            self.gamma_2 = np.clip(new_gamma_2, a_min=1e-9, a_max=1e9)
+            new_r_2 = self.__update_r_2()
+            self.r_2 = new_r_2
+
+            # LMMSE estimation
+            self.x_hat_2, self.alpha_2 = self.__update_x_hat_2()
+            new_eta_2 = self.__update_eta_2()
+            self.eta_2 = new_eta_2
+
+            new_gamma_1 = self.__update_gamma_1()
+            self.gamma_1 = np.clip(new_gamma_1, a_min=1e-9, a_max=1e9)
+            new_r_1 = self.__update_r_1()
+            self.r_1 = new_r_1
+
+            abs_diff = np.sqrt(squared_diff / self.N).reshape(self.y.shape[1:])
+            adaptive_dumping.update(self.dumping, abs_diff, gamma_1=self.gamma_1, gamma_2=self.gamma_2)
+            if self.result.due(iteration_index):
+                self.__record(iteration_index, abs_diff)
+            if np.all(abs_diff < tolerance):
+                convergence_flag = True
+                if message:
+                    print("requirement satisfied")
+                    print("abs_diff: ", abs_diff)
+                    print("abs_estimate: ", np.linalg.norm(self.x_hat_1, axis=0))
+                    print("iteration number = ", iteration_index)
+                    print("cg iterations = ", self.cg_iterations)
+                    print()
+                break
+            accelerating.step(self.acceleration, self, ("x_hat_1", "eta_1", "gamma_1", "r_1"),
+                              positive=("eta_1", "gamma_1"))
+
+        self.__record(iteration_index, abs_diff)
+        if message and not convergence_flag:
+            estimate_norm = np.linalg.norm(self.x_hat_1, axis=0)
+            print("does not converged.")
+            print("abs_diff=", abs_diff)
+            print("estimate norm=", estimate_norm)
+            if np.all(estimate_norm != 0.0):
+                print("relative diff= ", abs_diff / estimate_norm)
+            print("iteration num=", iteration_index + 1)
+            print()
+
+        self.converged = abs_diff < tolerance
+        self.result.finish(iteration_index, abs_diff, self.converged, self.x_hat_1)
+        return self.x_hat_1
+
+    def __record(self, iteration_index, abs_diff):
+        """record an iteration in self.result
+
+        Args:
+            iteration_index: index of the iteration
+            abs_diff: abs_diff of the iteration
+        """
+        self.result.record(iteration_index, abs_diff=abs_diff, estimate_norm=np.linalg.norm(self.x_hat_1, axis=0),
+                           alpha_1=self.alpha_1, alpha_2=self.alpha_2, gamma_1=self.gamma_1, gamma_2=self.gamma_2,
+                           cg_iterations=self.cg_iterations)
+
+    def __update_x_hat_1(self):
+        """ update x_hat_1 with dumping and alpha_1 in one pass
+
+        Returns:
+            new x_hat_1, new alpha_1 and squared norm of the change of x_hat_1
+        """
+        d = adaptive_dumping.coefficient(self.dumping, "x_hat_1")
+        x_hat_1, alpha_1, squared_diff = kernels.vamp_denoise(self.denoiser, self.r_1, self.l, self.gamma_1,
+                                                              self.x_hat_1, d)
+        return x_hat_1, alpha_1.reshape(self.alpha_1.shape), squared_diff
+
+    def __update_eta_1(self):
+        """update eta_1
+
+        Returns:
+            new eta_1
+        """
+        return self.gamma_1 / self.alpha_1
+
+    def __update_gamma_2(self):
+        """update gamma_2
+
+        Returns:
+            new gamma_2
+        """
+        return self.eta_1 - self.gamma_1
+
+    def __update_r_2(self):
+        """update r_2
+
+        Returns:
+            new r_2
+        """
+        return kernels.combine(self.eta_1 / self.gamma_2, self.x_hat_1, self.gamma_1 / self.gamma_2, self.r_1)
+
+    def __update_x_hat_2(self):
+        """update x_hat_2 and alpha_2 by conjugate gradient
+
+        with K = A.T @ A + gamma_2 I, x_hat_2 = K^{-1} (A.T @ y + gamma_2 r_2) and alpha_2 = gamma_2 tr(K^{-1}) / N.
+        the right hand side and the probes z of all the observations are solved as one block of columns,
+        warm-started from the previous x_hat_2 and the previous probe solutions v = K^{-1} z.
+        1 - alpha_2 = tr(A.T @ A K^{-1}) / N is estimated by the mean of (A z) . (A v) / N,
+        whose error is relative to 1 - alpha_2, since gamma_1 = gamma_2 (1 - alpha_2) / alpha_2.
+        where this estimate exceeds 1 / 2, gamma_2 times the mean of z . v / N is used instead.
+
+        Returns:
+            new x_hat_2 and new alpha_2
+        """
+        batch_shape = self.y.shape[1:]
+        gamma_2 = np.asarray(self.gamma_2, dtype=self.dtype)
+        b = self.y_tilde + gamma_2 * self.r_2
+        rhs = np.concatenate([b[..., np.newaxis],
+                              np.broadcast_to(self.probes.reshape((self.N,) + (1,) * len(batch_shape) + (-1,)),
+                                              self.probe_solutions.shape)], axis=-1)
+        x0 = np.concatenate([self.x_hat_2[..., np.newaxis], self.probe_solutions], axis=-1)
+        g = np.broadcast_to(gamma_2[..., np.newaxis], rhs.shape[1:]).reshape(-1)
+        preconditioner = 1.0 / (g + self.column_norms[:, np.newaxis])
+
+        def matvec(x):
+            return g * x + self.A.T @ (self.A @ x)
+
+        solution, self.cg_iterations = iterative.conjugate_gradient(
+            matvec, rhs.reshape(self.N, -1), x0=x0.reshape(self.N, -1), preconditioner=preconditioner,
+            tolerance=self.__cg_tolerance, max_iteration=self.cg_max_iteration)
+        solution = solution.reshape(rhs.shape)
+        self.probe_solutions = np.ascontiguousarray(solution[..., 1:])
+
+        # A v of shape (M, ..., n_probes) paired with the fixed A z of shape (M, n_probes)
+        A_solutions = (self.A @ self.probe_solutions.reshape(self.N, -1)).reshape(
+            (self.M,) + self.probe_solutions.shape[1:])
+        A_probes = self.A_probes.reshape((self.M,) + (1,) * len(batch_shape) + (-1,))
+        complement = np.sum(A_probes * A_solutions, axis=0, dtype=np.float64).mean(axis=-1) / self.N
+        probes = self.probes.reshape((self.N,) + (1,) * len(batch_shape) + (-1,))
+        direct = self.gamma_2 * np.sum(probes * self.probe_solutions, axis=0, dtype=np.float64).mean(axis=-1) / self.N
+        alpha_2 = np.where(complement < 0.5, 1.0 - complement, direct)
+        return np.ascontiguousarray(solution[..., 0]), alpha_2.reshape(batch_shape)
+
+    def __update_eta_2(self):
+        """update eta_2
+
+        Returns:
+            new eta_2
+        """
+        return self.gamma_2 / self.alpha_2
+
+    def __update_gamma_1(self):
+        """update gamma_1
+
+        Returns:
+            new gamma_1
+        """
+        return self.eta_2 - self.gamma_2
+
+    def __update_r_1(self):
+        """update r_1
+
+        Returns:
+            new r_1
+        """
+        return kernels.combine(self.eta_2 / self.gamma_1, self.x_hat_2, self.gamma_2 / self.gamma_1, self.r_2)
+
+    def show_me(self):
+        """debug method"""
+        pass
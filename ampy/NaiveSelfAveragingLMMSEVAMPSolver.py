@@ -2,7 +2,13 @@
 
 import numpy  as np
 from .utils import utils
-import numba
+from .utils import operators
+from .utils import kernels
+from .utils import trace
+from .utils import adaptive_dumping
+from .utils import acceleration as accelerating
+from .utils import denoisers
+from .utils import cache as caching
 
 
 class NaiveSelfAveragingLMMSEVAMPSolver(object):
@@ -10,65 +16,93 @@ class NaiveSelfAveragingLMMSEVAMPSolver(object):
         in this version, inverse calculation of N x N matrix is used.
     """
 
-    def __init__(self, A, y, regularization_strength, dumping_coefficient):
+    def __init__(self, A, y, regularization_strength, dumping_coefficient, dtype=np.float64, cache=None,
+                 cache_key=None, acceleration=None, denoiser=None):
         """constructor
 
         Args:
-            A: observation matrix of shape (M, N)
-            y: observed value of shape (M, )
+            A: observation matrix of shape (M, N) (numpy array, np.memmap, scipy.sparse matrix, path of a .npy file
+               or utils.operators.LinearOperator)
+            y: observed value of shape (M, ) or (M, B) for B observations sharing A
             regularization_strength: regularization parameter
-            dumping_coefficient: dumping coefficient
+            dumping_coefficient: dumping coefficient or utils.adaptive_dumping.AdaptiveDumping
+            dtype: data type of the observation matrix, the matrix products and the vector messages
+                   (np.float32 halves the memory traffic, the convergence check is accumulated in np.float64)
+            cache: utils.cache.DecompositionCache in which A.T @ A and A.T @ y are looked up and stored
+                   (not cached if None)
+            cache_key: str identifying A in the cache (the content of A is hashed if None)
+            acceleration: utils.acceleration.AndersonAcceleration of the solve loop (plain iteration if None)
+            denoiser: name of a denoiser of utils.denoisers or utils.denoisers.Denoiser (soft thresholding if None)
         """
+        self.dtype = np.dtype(dtype)
         self.l = regularization_strength
         self.d = dumping_coefficient
+        self.acceleration = acceleration
+        self.denoiser = denoisers.get(denoiser)
+
+        self.y = np.array(y, dtype=self.dtype)
+        self.A = operators.aslinearoperator(A, dtype=self.dtype)
+        if cache is not None and cache_key is None:
+            cache_key = caching.fingerprint(self.A)
+        if self.A.row_orthogonal:
+            # A @ A.T = s^2 I, so that the inverse of A.T @ A + gamma_2 I is known in closed form
+            self.J = None
+            self.s2 = self.A.singular_values()[0] ** 2
+        else:
+            self.J = caching.cached(cache, cache_key, "gram", lambda: {"J": self.A.gram()}, dtype=self.dtype.str)["J"]
+        self.y_tilde = caching.cached(cache, cache_key, "At_y", lambda: {"y_tilde": self.A.T @ self.y},
+                                      y=self.y, dtype=self.dtype.str)["y_tilde"]
 
-        self.A = A.copy()
-        self.y = y.copy()
-
-        self.M, self.N = A.shape
+        self.M, self.N = self.A.shape
+        batch_shape = self.y.shape[1:]  # () for a single observation, (B, ) for multiple observations
 
         # de-noising part
-        self.x_hat_1 = np.random.normal(0.0, 1.0, self.N)
-        self.alpha_1 = 1.0
-        self.eta_1 = 1.0
-        self.gamma_2 = 1.0
-        self.r_2 = np.random.normal(0.0, 1.0, self.N)
+        self.x_hat_1 = np.random.normal(0.0, 1.0, (self.N,) + batch_shape).astype(self.dtype)
+        self.alpha_1 = np.ones(batch_shape)
+        self.eta_1 = np.ones(batch_shape)
+        self.gamma_2 = np.ones(batch_shape)
+        self.r_2 = np.random.normal(0.0, 1.0, (self.N,) + batch_shape).astype(self.dtype)
 
         # Linear Minimum Mean Square Error (LMMSE) Estimator part
-        self.x_hat_2 = np.random.normal(0.0, 1.0, self.N)
-        self.alpha_2 = 1.0
-        self.eta_2 = 1.0
-        self.gamma_1 = 1.0
-        self.r_1 = np.random.normal(0.0, 1.0, self.N)
-
-    @numba.jit(parallel=True)
-    def solve(self, max_iteration=50, tolerance=1e-5, message=False):
+        self.x_hat_2 = np.random.normal(0.0, 1.0, (self.N,) + batch_shape).astype(self.dtype)
+        self.alpha_2 = np.ones(batch_shape)
+        self.eta_2 = np.ones(batch_shape)
+        self.gamma_1 = np.ones(batch_shape)
+        self.r_1 = np.random.normal(0.0, 1.0, (self.N,) + batch_shape).astype(self.dtype)
+
+        self.converged = np.zeros(batch_shape, dtype=bool)  # convergence flag of each observation
+
+    def solve(self, max_iteration=50, tolerance=1e-5, message=False, trace_every=1):
         """VAMP solver
 
         Args:
             max_iteration: maximum number of iterations to be used
             tolerance: stopping criterion
             message: convergence info
+            trace_every: sampling rate of the traces of self.result (only the last iteration if 0)
 
         Returns:
-            estimated signal
+            estimated signal of shape (N, ) or (N, B)
+            (the iteration count, the convergence flags and the traces of abs_diff, the estimate norm,
+            alpha_1, alpha_2, gamma_1 and gamma_2 are stored in self.result)
         """
         convergence_flag = False
         abs_diff = 9999
         iteration_index = 9999
+        self.result = trace.SolveResult(max_iteration, self.y.shape[1:], ("alpha_1", "alpha_2", "gamma_1", "gamma_2"),
+                                        trace_every)
 
+        adaptive_dumping.reset(self.d)
+        accelerating.reset(self.acceleration)
         for iteration_index in range(max_iteration):
-            old_x_hat_1 = self.x_hat_1.copy()
-
             # denonising
-            new_x_hat_1 = self.__update_x_hat_1()
-            new_alpha_1 = self.__update_alpha_1()
-            self.x_hat_1 = utils.update_dumping(old_x=self.x_hat_1, new_x=new_x_hat_1, dumping_coefficient=self.d)
-            self.alpha_1 = new_alpha_1
+            self.x_hat_1, self.alpha_1, squared_diff = self.__update_x_hat_1()
             new_eta_1 = self.__update_eta_1()
-            self.eta_1 = np.clip(utils.update_dumping(old_x=self.eta_1, new_x=new_eta_1, dumping_coefficient=self.d),
-                                 a_min=1e-9,
-                                 a_max=1e9)
+            self.eta_1 = np.clip(
+                utils.update_dumping(old_x=self.eta_1, new_x=new_eta_1,
+                                     dumping_coefficient=adaptive_dumping.coefficient(self.d, "eta_1")),
+                a_min=1e-9,
+                a_max=1e9)
 
             new_gamma_2 = self.__update_gamma_2()
             self.gamma_2 = np.clip(new_gamma_2, a_min=1e-9, a_max=1e9)
@@ -88,58 +122,58 @@ class NaiveSelfAveragingLMMSEVAMPSolver(object):
             new_r_1 = self.__update_r_1()
             self.r_1 = new_r_1
 
-            abs_diff = np.linalg.norm(old_x_hat_1 - self.x_hat_1) / np.sqrt(self.N)
-            if abs_diff < tolerance:
+            abs_diff = np.sqrt(squared_diff / self.N).reshape(self.y.shape[1:])
+            adaptive_dumping.update(self.d, abs_diff, gamma_1=self.gamma_1, gamma_2=self.gamma_2)
+            if self.result.due(iteration_index):
+                self.__record(iteration_index, abs_diff)
+            if np.all(abs_diff < tolerance):
                 convergence_flag = True
                 if message:
                     print("requirement satisfied")
                     print("abs_diff: ", abs_diff)
-                    print("abs_estimate: ", np.linalg.norm(self.x_hat_1))
+                    print("abs_estimate: ", np.linalg.norm(self.x_hat_1, axis=0))
                     print("iteration number = ", iteration_index)
                     print()
                 break
-        if convergence_flag:
-            pass
-            print("converged")
-            print("abs_diff=", abs_diff)
-            print("estimate norm=", np.linalg.norm(self.x_hat_1))
-            if np.linalg.norm(self.x_hat_1) != 0.0:
-                print("relative diff= ", abs_diff / np.linalg.norm(self.x_hat_1))
-            print("iteration num=", iteration_index)
-            print()
-        else:
+            accelerating.step(self.acceleration, self, ("x_hat_1", "eta_1", "gamma_1", "r_1"),
+                              positive=("eta_1", "gamma_1"))
+
+        self.__record(iteration_index, abs_diff)
+        if message and not convergence_flag:
+            estimate_norm = np.linalg.norm(self.x_hat_1, axis=0)
             print("does not converged.")
             print("abs_diff=", abs_diff)
-            print("estimate norm=", np.linalg.norm(self.x_hat_1))
-            if np.linalg.norm(self.x_hat_1) != 0.0:
-                print("relative diff= ", abs_diff / np.linalg.norm(self.x_hat_1))
+            print("estimate norm=", estimate_norm)
+            if np.all(estimate_norm != 0.0):
+                print("relative diff= ", abs_diff / estimate_norm)
             print("iteration num=", iteration_index + 1)
             print()
 
+        self.converged = abs_diff < tolerance
+        self.result.finish(iteration_index, abs_diff, self.converged, self.x_hat_1)
         return self.x_hat_1
 
-    @numba.jit(parallel=True)
-    def __update_x_hat_1(self):
-        """ update x_hat_1
+    def __record(self, iteration_index, abs_diff):
+        """record an iteration in self.result
 
-        Returns:
-            new x_hat_1
+        Args:
+            iteration_index: index of the iteration
+            abs_diff: abs_diff of the iteration
         """
-        v1 = (self.r_1 - self.l / self.gamma_1 * np.sign(self.r_1))
-        v2 = np.heaviside(np.abs(self.r_1) - self.l / self.gamma_1, 0.5)
-        return v1 * v2
+        self.result.record(iteration_index, abs_diff=abs_diff, estimate_norm=np.linalg.norm(self.x_hat_1, axis=0),
+                           alpha_1=self.alpha_1, alpha_2=self.alpha_2, gamma_1=self.gamma_1, gamma_2=self.gamma_2)
 
-    @numba.jit(parallel=True)
-    def __update_alpha_1(self):
-        """update alpha_1
+    def __update_x_hat_1(self):
+        """ update x_hat_1 with dumping and alpha_1 in one pass
 
         Returns:
-            new alpha_1
+            new x_hat_1, new alpha_1 and squared norm of the change of x_hat_1
         """
-        v1 = np.heaviside(np.abs(self.r_1) - self.l / self.gamma_1, 0.5)
-        return np.mean(v1)
+        d = adaptive_dumping.coefficient(self.d, "x_hat_1")
+        x_hat_1, alpha_1, squared_diff = kernels.vamp_denoise(self.denoiser, self.r_1, self.l, self.gamma_1,
+                                                              self.x_hat_1, d)
+        return x_hat_1, alpha_1.reshape(self.alpha_1.shape), squared_diff
 
-    @numba.jit(parallel=True)
     def __update_eta_1(self):
         """update eta_1
 
@@ -148,7 +182,6 @@ class NaiveSelfAveragingLMMSEVAMPSolver(object):
         """
         return self.gamma_1 / self.alpha_1
 
-    @numba.jit(parallel=True)
     def __update_gamma_2(self):
         """update gamma_2
 
@@ -157,37 +190,49 @@ class NaiveSelfAveragingLMMSEVAMPSolver(object):
         """
         return self.eta_1 - self.gamma_1
 
-    @numba.jit(parallel=True)
     def __update_r_2(self):
         """update r_2
 
         Returns:
             new r_2
         """
-        return (self.eta_1 * self.x_hat_1 - self.gamma_1 * self.r_1) / self.gamma_2
+        return kernels.combine(self.eta_1 / self.gamma_2, self.x_hat_1, self.gamma_1 / self.gamma_2, self.r_1)
 
-    @numba.jit(parallel=True)
     def __update_x_hat_2(self):
         """update x_hat_2
 
         Returns:
             new x_hat_2
         """
-        a = self.A.T @ self.A + self.gamma_2 * np.eye(self.N)
-        b = self.A.T @ self.y + self.gamma_2 * self.r_2
-        return np.linalg.solve(a, b)
+        if self.J is None:
+            c = np.asarray(1.0 / (self.s2 + self.gamma_2), dtype=self.dtype)
+            return self.r_2 + self.A.T @ (self.y - self.A @ self.r_2) * c
+
+        # the N x N systems are solved in double precision, since A.T @ A + gamma_2 I is singular
+        # in single precision for the small gamma_2 of a rank deficient A
+        b = self.y_tilde + np.asarray(self.gamma_2, dtype=self.dtype) * self.r_2
+        x_hat_2 = np.empty_like(b)
+        for index in np.ndindex(np.shape(self.gamma_2)):
+            a = self.J + self.gamma_2[index] * np.eye(self.N)
+            x_hat_2[(slice(None),) + index] = np.linalg.solve(a, b[(slice(None),) + index])
+        return x_hat_2
 
-    @numba.jit(parallel=True)
     def __update_alpha_2(self):
         """update alpha_2
 
         Returns:
             new alpha_2
         """
-        a = self.A.T @ self.A + self.gamma_2 * np.eye(self.N)
-        return self.gamma_2 * np.trace(np.linalg.inv(a)) / self.N
+        if self.J is None:
+            # M eigenvalues of A.T @ A are s^2 and the others are zero
+            return (self.M * self.gamma_2 / (self.s2 + self.gamma_2) + self.N - self.M) / self.N
+
+        alpha_2 = np.empty(np.shape(self.gamma_2))
+        for index in np.ndindex(alpha_2.shape):
+            a = self.J + self.gamma_2[index] * np.eye(self.N)
+            alpha_2[index] = self.gamma_2[index] * np.trace(np.linalg.inv(a)) / self.N
+        return alpha_2
 
-    @numba.jit(parallel=True)
     def __update_eta_2(self):
         """update eta_2
 
@@ -196,7 +241,6 @@ class NaiveSelfAveragingLMMSEVAMPSolver(object):
         """
         return self.gamma_2 / self.alpha_2
 
-    @numba.jit(parallel=True)
     def __update_gamma_1(self):
         """update gamma_1
 
@@ -205,14 +249,13 @@ class NaiveSelfAveragingLMMSEVAMPSolver(object):
         """
         return self.eta_2 - self.gamma_2
 
-    @numba.jit(parallel=True)
     def __update_r_1(self):
         """update r_1
 
         Returns:
             new r_1
         """
-        return (self.eta_2 * self.x_hat_2 - self.gamma_2 * self.r_2) / self.gamma_1
+        return kernels.combine(self.eta_2 / self.gamma_1, self.x_hat_2, self.gamma_2 / self.gamma_1, self.r_2)
 
     def show_me(self):
         """debug method"""
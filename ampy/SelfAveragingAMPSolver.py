@@ -1,140 +1,235 @@
 # coding=utf-8
 import numpy as np
-from .utils import utils
-import numba
+from .utils import operators
+from .utils import kernels
+from .utils import trace
+from .utils import adaptive_dumping
+from .utils import acceleration as accelerating
+from .utils import active_set as active_sets
+from .utils import denoisers
+from .utils import regularization_path
 
 
-class SelfAveragingAMPSolver(object):
+class SelfAveragingAMPSolver(regularization_path.RegularizationPath):
     """ self averaging approximate message passing solver for the Standard Linear Model (SLM) """
 
-    def __init__(self, A, y, regularization_strength, dumping_coefficient):
+    def __init__(self, A, y, regularization_strength, dumping_coefficient, dtype=np.float64, acceleration=None,
+                 active_set=True, denoiser=None):
         """constructor
 
         Args:
-            A: observation matrix of shape (M, N)
-            y: observed value of shape (M, )
+            A: observation matrix of shape (M, N) (numpy array, np.memmap, scipy.sparse matrix, path of a .npy file
+               or utils.operators.LinearOperator)
+            y: observed value of shape (M, ) or (M, B) for B observations sharing A
             regularization_strength: regularization parameter
-            dumping_coefficient: dumping coefficient
+            dumping_coefficient: dumping coefficient or utils.adaptive_dumping.AdaptiveDumping
+            dtype: data type of the observation matrix, the matrix products and the vector messages
+                   (np.float32 halves the memory traffic, the convergence check is accumulated in np.float64)
+            acceleration: utils.acceleration.AndersonAcceleration of the solve loop (plain iteration if None)
+            active_set: whether the forward products are taken over the active columns of the denoised estimate
+                        (see utils.active_set, used only for a dense numpy observation matrix and a sparse denoiser)
+            denoiser: name of a denoiser of utils.denoisers or utils.denoisers.Denoiser (soft thresholding if None)
         """
-        self.A = A.copy()
-        self.y = y.copy()
-        self.M, self.N = A.shape
-        self.alpha = self.M / self.N
+        self.dtype = np.dtype(dtype)
+        self.A = operators.aslinearoperator(A, dtype=self.dtype)
+        self.y = np.array(y, dtype=self.dtype)
+        self.M, self.N = self.A.shape
+        # components of the signal over which V and the convergence norm are taken
+        # (more than N for a solver on the columns kept by screening, see utils.regularization_path)
+        self.n_components = self.N
 
-        self.V = 1.0
-        self.z = np.random.normal(0.0, 1.0, self.M)
-        self.R = np.zeros(self.N)
-        self.T = 1.0
+        batch_shape = self.y.shape[1:]  # () for a single observation, (B, ) for multiple observations
 
-        self.r = np.zeros(self.N)  # estimator
-        self.chi = np.ones(self.N)  # variance
+        self.V = np.ones(batch_shape)
+        self.z = np.random.normal(0.0, 1.0, (self.M,) + batch_shape).astype(self.dtype)
+        self.R = np.zeros((self.N,) + batch_shape, dtype=self.dtype)
+        self.T = np.ones(batch_shape)
+
+        self.r = np.zeros((self.N,) + batch_shape, dtype=self.dtype)  # estimator
+        self.chi = np.ones((self.N,) + batch_shape, dtype=self.dtype)  # variance
+        self.converged = np.zeros(batch_shape, dtype=bool)  # convergence flag of each observation
 
         self.l = regularization_strength  # regularization parameter
         self.d = dumping_coefficient  # dumping coefficient
-
-    @numba.jit(parallel=True)
-    def solve(self, max_iteration=50, tolerance=1e-5, message=False):
+        self.acceleration = acceleration
+        self.denoiser = denoisers.get(denoiser)
+        self.active_set = None  # forward products over the active columns
+        if active_set and self.denoiser.sparse and isinstance(self.A, operators.DenseOperator):
+            self.active_set = active_sets.ActiveSetProducts(self.A)
+
+    @property
+    def alpha(self):
+        """measurement ratio M / N of the whole signal"""
+        return self.M / self.n_components
+
+    def solve(self, max_iteration=50, tolerance=1e-5, message=False, trace_every=1,
+              min_iteration=regularization_path.MIN_ITERATION):
         """Self averaging AMP solver
 
         Args:
             max_iteration:
             tolerance:
             message:
+            trace_every: sampling rate of the traces of self.result (only the last iteration if 0)
+            min_iteration: number of iterations before which the solve does not stop
+                           (the estimate of a large l may stay at zero for the first iterations)
 
         Returns:
-
+            estimated signal of shape (N, ) or (N, B)
+            (the iteration count, the convergence flags and the traces of abs_diff, the estimate norm
+            and V and T are stored in self.result)
         """
+        y = kernels.as_columns(self.y)
+        l = kernels.as_column_scalars(self.l, y.shape[1])
+        self.result = trace.SolveResult(max_iteration, self.y.shape[1:], ("V", "T"), trace_every)
         converged = False
 
+        adaptive_dumping.reset(self.d)
+        accelerating.reset(self.acceleration)
+        if self.active_set is not None:
+            self.active_set.reset()
         for iteration_index in range(max_iteration):
-            # self.V, self.z, self.R, self.T = self.__update_V(), self.__update_z(), self.__update_R(), self.__update_T()
-            self.V, self.z = self.__update_V(), self.__update_z()
-
-            self.R, self.T = self.__update_R(), self.__update_T()
-
-            new_r, new_chi = self.__update_r(), self.__update_chi()
-            old_r = self.r.copy()
-            self.r = utils.update_dumping(self.r, new_r, self.d)
-            self.chi = utils.update_dumping(self.chi, new_chi, self.d)
-
-            abs_diff = np.linalg.norm(old_r - self.r) / np.sqrt(self.N)
-
-            if abs_diff < tolerance:
+            V, z, R, T, r, chi, squared_diff = self.__update(y, l, np.reshape(self.V, -1),
+                                                             kernels.as_columns(self.z),
+                                                             kernels.as_columns(self.r),
+                                                             kernels.as_columns(self.chi))
+            self.V, self.T = V.reshape(self.V.shape), T.reshape(self.T.shape)
+            self.z, self.R = z.reshape(self.z.shape), R.reshape(self.R.shape)
+            self.r, self.chi = r.reshape(self.r.shape), chi.reshape(self.chi.shape)
+
+            abs_diff = np.sqrt(squared_diff / self.n_components).reshape(self.y.shape[1:])
+            adaptive_dumping.update(self.d, abs_diff, V=self.V)
+            if self.result.due(iteration_index):
+                self.__record(iteration_index, abs_diff)
+
+            if np.all(abs_diff < tolerance) and iteration_index + 1 >= min_iteration:
                 converged = True
                 if message:
                     print("requirement satisfied")
                     print("abs_diff=", abs_diff)
-                    print("abs_estimate=", np.linalg.norm(self.r))
+                    print("abs_estimate=", np.linalg.norm(self.r, axis=0))
                     print("iteration number=", iteration_index + 1)
                 break
+            accelerating.step(self.acceleration, self, ("V", "z", "r", "chi"), positive=("V", "chi"))
 
-        if converged:
-            pass
-            # print("converged")
-            # print("abs_diff=", abs_diff)
-            # print("estimate norm=", np.linalg.norm(self.r))
-            # if np.linalg.norm(self.r) != 0.0:
-            #     print("relative diff= ", abs_diff / np.linalg.norm(self.r))
-            # print("iteration num=", iteration_index + 1)
-        else:
+        self.__record(iteration_index, abs_diff)
+        if message and not converged:
+            estimate_norm = np.linalg.norm(self.r, axis=0)
             print("does not converged.")
             print("abs_diff=", abs_diff)
-            print("estimate norm=", np.linalg.norm(self.r))
-            if np.linalg.norm(self.r) != 0.0:
-                print("relative diff= ", abs_diff / np.linalg.norm(self.r))
+            print("estimate norm=", estimate_norm)
+            if np.all(estimate_norm != 0.0):
+                print("relative diff= ", abs_diff / estimate_norm)
             print("iteration num=", iteration_index + 1)
             print()
 
-    @numba.jit(parallel=True)
-    def __update_V(self):
-        """update V
-
-        Returns:
-            new V
-        """
-        return self.chi.mean()
+        self.converged = abs_diff < tolerance
+        self.result.finish(iteration_index, abs_diff, self.converged, self.r)
+        return self.r
 
-    @numba.jit(parallel=True)
-    def __update_z(self):
-        """update z
+    def __record(self, iteration_index, abs_diff):
+        """record an iteration in self.result
 
-        Returns:
-            new z
+        Args:
+            iteration_index: index of the iteration
+            abs_diff: abs_diff of the iteration
         """
-        return self.y - self.A @ self.r + self.z * self.V / (1.0 + self.V)
+        self.result.record(iteration_index, abs_diff=abs_diff, estimate_norm=np.linalg.norm(self.r, axis=0),
+                           V=self.V, T=self.T)
 
-    @numba.jit(parallel=True)
-    def __update_R(self):
-        """update R
+    def _iterate_columns(self, y, l, V, z, r, chi, max_iteration, tolerance, message, min_iteration=1):
+        """self averaging AMP iteration for a block of regularization parameters
 
-        Returns:
-            new R
-        """
-        return self.r + self.A.T @ self.z / self.alpha
+        V, z, r and chi are updated in place and each column is frozen as soon as it converges.
 
-    @numba.jit(parallel=True)
-    def __update_T(self):
-        """update T
+        Args:
+            y: observed values of shape (M, K)
+            l: regularization parameters of shape (K, )
+            V: V of shape (K, )
+            z: z of shape (M, K)
+            r: estimator of shape (N, K)
+            chi: variance of shape (N, K)
+            max_iteration: maximum number of iterations to be used
+            tolerance: stopping criterion
+            message: convergence info
+            min_iteration: number of iterations before which no column is frozen
 
         Returns:
-            new T
+            R, T of shape (K, ) and convergence flags of the columns
         """
-        return (1.0 + self.V) / self.alpha
+        K = l.shape[0]
+        R = np.zeros((self.N, K), dtype=self.dtype)
+        T = np.zeros(K)
+        converged = np.zeros(K, dtype=bool)
+        active = np.arange(K)  # columns which have not converged yet
+
+        # messages of the active columns, sliced again only when a column is frozen,
+        # so that the products of the active set (utils.active_set) see the messages dumped by the iteration
+        y_a, l_a, V_a, z_a, r_a, chi_a = y[:, active], l[active], V[active], z[:, active], r[:, active], chi[:, active]
+
+        adaptive_dumping.reset(self.d)
+        if self.active_set is not None:
+            self.active_set.reset()
+        for iteration_index in range(max_iteration):
+            V_a, z_a, R_a, T_a, r_a, chi_a, squared_diff = self.__update(y_a, l_a, V_a, z_a, r_a, chi_a)
+            abs_diff = np.sqrt(squared_diff / self.n_components)
+            adaptive_dumping.update(self.d, abs_diff, V=V_a)
+
+            V[active], z[:, active], R[:, active], T[active] = V_a, z_a, R_a, T_a
+            r[:, active], chi[:, active] = r_a, chi_a
+
+            satisfied = (abs_diff < tolerance) & (iteration_index + 1 >= min_iteration)
+            converged[active[satisfied]] = True
+            if np.any(satisfied):
+                keep = ~satisfied
+                active = active[keep]
+                y_a, l_a, V_a, z_a, r_a, chi_a = y_a[:, keep], l_a[keep], V_a[keep], z_a[:, keep], r_a[:, keep], \
+                    chi_a[:, keep]
+            if active.size == 0:
+                if message:
+                    print("requirement satisfied")
+                    print("iteration number=", iteration_index + 1)
+                break
 
-    @numba.jit(parallel=True)
-    def __update_r(self):
-        """update r
+        return R, T, converged
 
-        Returns:
-            new r
-        """
-        return (self.R - self.l * self.T * np.sign(self.R)) * np.heaviside(np.abs(self.R) - self.l * self.T, 0.5)
+    def __update(self, y, l, V, z, r, chi):
+        """one self averaging AMP iteration on columns
 
-    @numba.jit(parallel=True)
-    def __update_chi(self):
-        """update chi
+        the element-wise steps between the matrix products are done by the fused kernels of utils.kernels.
+        for a streaming operator (see utils.operators.MemmapOperator) A @ r and A.T @ z are done
+        in one pass over the row blocks of A.
+        with the active set, A @ r is taken over the active columns of the previous iteration.
+
+        Args:
+            y: observed values of shape (M, K)
+            l: regularization parameters of shape (K, )
+            V: V of the previous iteration of shape (K, ), which enters the Onsager term of z
+            z: z of shape (M, K)
+            r: estimator of shape (N, K)
+            chi: variance of shape (N, K)
 
         Returns:
-            new chi
+            new V of shape (K, ), z, R, T of shape (K, ), r, chi and squared norm of the change of r of shape (K, )
         """
-        return self.T * np.heaviside(np.abs(self.R) - self.l * self.T, 0.5)
+        new_V = chi.sum(axis=0, dtype=np.float64) / self.n_components
+        new_z = np.empty_like(z)
+        if self.A.streaming:
+            # the rows of z depend only on the same rows of A
+            Atz = np.zeros_like(r)
+            for rows, block in self.A.blocks():
+                kernels.sa_amp_update_z(y[rows], block @ r, V, z[rows], new_z[rows])
+                Atz += block.T @ new_z[rows]
+        else:
+            Ar = self.A @ r if self.active_set is None else self.active_set.matvec(r)
+            kernels.sa_amp_update_z(y, Ar, V, z, new_z)
+            Atz = self.A.T @ new_z
+        T = (1.0 + new_V) / self.alpha
+        R, new_r, new_chi = np.empty_like(r), np.empty_like(r), np.empty_like(r)
+        support = np.empty(self.N, dtype=bool)
+        d = adaptive_dumping.coefficient(self.d, "r")
+        squared_diff = self.denoiser.kernel(kernels.sa_amp_update_r)(Atz, r, chi, l, T, self.alpha, d, R, new_r,
+                                                                     new_chi, support, self.denoiser.parameters)
+        if self.active_set is not None:
+            self.active_set.dumped(new_r, None, r, chi, support, d)
+        return new_V, new_z, R, T, new_r, new_chi, squared_diff
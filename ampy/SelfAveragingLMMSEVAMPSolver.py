@@ -1,91 +1,232 @@
 # coding=utf-8
 
+import time
+
 import numpy  as np
 from .utils import utils
-import numba
+from .utils import iterative
+from .utils import operators
+from .utils import kernels
+from .utils import cache as caching
+from .utils import trace
+from .utils import adaptive_dumping
+from .utils import acceleration as accelerating
+from .utils import denoisers
 
 
 class SelfAveragingLMMSEVAMPSolver(object):
     """ Naive self averaging vector approximate message passing solver (LMMSE form)
         in this version, singular value decomposition is executed at the constructor
+        (it is skipped for a row orthogonal operator, whose singular values are known analytically)
     """
 
-    def __init__(self, A, y, regularization_strength, dumping_coefficient):
+    def __init__(self, A, y, regularization_strength, dumping_coefficient, dtype=np.float64, svd_backend="thin",
+                 rank=None, oversampling=10, n_power_iterations=2, cache=None, cache_key=None,
+                 acceleration=None, denoiser=None):
         """constructor
 
         Args:
-            A: observation matrix of shape (M, N)
-            y: observed value of shape (M, )
+            A: observation matrix of shape (M, N) (numpy array, np.memmap, scipy.sparse matrix, path of a .npy file
+               or utils.operators.LinearOperator)
+            y: observed value of shape (M, ) or (M, B) for B observations sharing A
             regularization_strength: regularization parameter
-            dumping_coefficient: dumping coefficient
+            dumping_coefficient: dumping coefficient or utils.adaptive_dumping.AdaptiveDumping
+            dtype: data type of the observation matrix, the matrix products and the vector messages
+                   (np.float32 halves the memory traffic, the convergence check is accumulated in np.float64)
+            svd_backend: singular value decomposition of A (not used for a row orthogonal operator)
+                "full": U of shape (M, M), VT of shape (N, N) and the dense S and S_inv
+                "thin": U of shape (M, K), VT of shape (K, N) with K = min(M, N), S and S_inv are not formed
+                "randomized": rank-truncated decomposition computed from the products of A only,
+                              for approximately low rank observation matrices
+            rank: rank of the "randomized" backend (min(M, N) if None)
+            oversampling: number of additional random vectors of the "randomized" backend
+            n_power_iterations: number of power iterations of the "randomized" backend
+            cache: utils.cache.DecompositionCache in which the decomposition is looked up and stored (not cached if None)
+                   (a cached "randomized" decomposition does not draw its random vectors again)
+            cache_key: str identifying A in the cache (the content of A is hashed if None)
+            acceleration: utils.acceleration.AndersonAcceleration of the solve loop (plain iteration if None)
+            denoiser: name of a denoiser of utils.denoisers or utils.denoisers.Denoiser (soft thresholding if None)
         """
+        start = time.perf_counter()
+        self.dtype = np.dtype(dtype)
         self.l = regularization_strength
         self.dumping = dumping_coefficient
+        self.acceleration = acceleration
+        self.denoiser = denoisers.get(denoiser)
+
+        self.A = operators.aslinearoperator(A, dtype=self.dtype)
+        self.y = np.array(y, dtype=self.dtype)
+
+        self.M, self.N = self.A.shape
+        batch_shape = self.y.shape[1:]  # () for a single observation, (B, ) for multiple observations
+
+        self.row_orthogonal = self.A.row_orthogonal
+        self.svd_backend = None if self.row_orthogonal else svd_backend
+        self.S = self.S_inv = None
+        if self.row_orthogonal:
+            # A = [S 0] VT with U = I and VT[:M] = A / s, i.e. A @ A.T = s^2 I
+            s = self.A.singular_values()
+            self.U = self.VT = self.V = self.y_tilde = None
+            self.s = np.zeros(self.N)  # kept in double precision for the scalar messages
+            self.s[:len(s)] = s
+        elif svd_backend in ("full", "thin", "randomized"):
+            u, s, vh = self.__decompose(svd_backend, rank, oversampling, n_power_iterations, cache, cache_key)
+            self.U = u.astype(self.dtype, copy=False)
+            self.VT = vh.astype(self.dtype, copy=False)
+            self.V = self.VT.T
+            if svd_backend == "full":
+                self.S = np.zeros((self.M, self.N), dtype=self.dtype)
+                self.S_inv = np.zeros((self.N, self.M), dtype=self.dtype)
+                for i, val in enumerate(s):
+                    self.S[i, i] = s[i]
+                    self.S_inv[i, i] = 1.0 / s[i]
+
+                self.y_tilde = self.S_inv @ self.U.T @ self.y
+                self.s = np.zeros(self.N)
+                self.s[:len(s)] = s
+            else:
+                # only the K right singular vectors with non-zero singular values enter x_hat_2,
+                # r_2 + V (d * (y_tilde - VT r_2)), the other components of d vanish
+                self.s = np.array(s, dtype=np.float64)
+                self.y_tilde = (self.U.T @ self.y) / s.astype(self.dtype).reshape((-1,) + (1,) * len(batch_shape))
+        else:
+            raise ValueError("unknown svd_backend: {}".format(svd_backend))
 
-        self.A = A.copy()
-        self.y = y.copy()
-
-        self.M, self.N = A.shape
-
-        # SVD
-        u, s, vh = np.linalg.svd(self.A)
-        self.s = np.zeros(self.N)
-        self.s[:len(s)] = s
         self.s2 = self.s * self.s
-        self.U = u
-        self.VT = vh
-        self.V = self.VT.T
-        self.S = np.zeros((self.M, self.N))
-        self.S_inv = np.zeros((self.N, self.M))
-        for i, val in enumerate(s):
-            self.S[i, i] = s[i]
-            self.S_inv[i, i] = 1.0 / s[i]
 
-        self.y_tilde = self.S_inv @ self.U.T @ self.y
+        # the initial d is drawn for all the N components, so that the random state does not depend on the backend
+        self.d = np.random.normal(0.0, 1.0, (self.N,) + batch_shape).astype(self.dtype)[:len(self.s)]
 
-        self.d = np.random.normal(0.0, 1.0, self.N)
+        # construction time in seconds and memory in bytes of the decomposition, to choose the backend per problem
+        self.construction_time = time.perf_counter() - start
+        self.construction_nbytes = sum(
+            x.nbytes for x in (self.U, self.VT, self.S, self.S_inv, self.y_tilde, self.s) if x is not None)
 
         # de-noising part
-        self.x_hat_1 = np.random.normal(0.0, 1.0, self.N)
-        self.alpha_1 = 1.0
-        self.eta_1 = 1.0
-        self.gamma_2 = 1.0
-        self.r_2 = np.random.normal(0.0, 1.0, self.N)
+        self.x_hat_1 = np.random.normal(0.0, 1.0, (self.N,) + batch_shape).astype(self.dtype)
+        self.alpha_1 = np.ones(batch_shape)
+        self.eta_1 = np.ones(batch_shape)
+        self.gamma_2 = np.ones(batch_shape)
+        self.r_2 = np.random.normal(0.0, 1.0, (self.N,) + batch_shape).astype(self.dtype)
 
         # Linear Minimum Mean Square Error (LMMSE) Estimator part
-        self.x_hat_2 = np.random.normal(0.0, 1.0, self.N)
-        self.alpha_2 = 1.0
-        self.eta_2 = 1.0
-        self.gamma_1 = 1.0
-        self.r_1 = np.random.normal(0.0, 1.0, self.N)
-
-    @numba.jit(parallel=True)
-    def solve(self, max_iteration=50, tolerance=1e-5, message=False):
+        self.x_hat_2 = np.random.normal(0.0, 1.0, (self.N,) + batch_shape).astype(self.dtype)
+        self.alpha_2 = np.ones(batch_shape)
+        self.eta_2 = np.ones(batch_shape)
+        self.gamma_1 = np.ones(batch_shape)
+        self.r_1 = np.random.normal(0.0, 1.0, (self.N,) + batch_shape).astype(self.dtype)
+
+        self.converged = np.zeros(batch_shape, dtype=bool)  # convergence flag of each observation
+
+    def __decompose(self, svd_backend, rank, oversampling, n_power_iterations, cache, cache_key):
+        """singular value decomposition of A, looked up in the cache if any
+
+        Returns:
+            U, singular values and VT
+        """
+        def compute():
+            if svd_backend == "full":
+                u, s, vh = np.linalg.svd(self.A.toarray())
+            elif svd_backend == "thin":
+                u, s, vh = np.linalg.svd(self.A.toarray(), full_matrices=False)
+            else:
+                u, s, vh = iterative.randomized_svd(self.A, min(self.M, self.N) if rank is None else rank,
+                                                    oversampling=oversampling, n_power_iterations=n_power_iterations)
+            return {"U": u, "s": s, "VT": vh}
+
+        if cache is not None and cache_key is None:
+            cache_key = caching.fingerprint(self.A)
+        params = {"svd_backend": svd_backend, "dtype": self.dtype.str}
+        if svd_backend == "randomized":
+            params.update(rank=rank, oversampling=oversampling, n_power_iterations=n_power_iterations)
+        decomposition = caching.cached(cache, cache_key, "svd", compute, **params)
+        return decomposition["U"], decomposition["s"], decomposition["VT"]
+
+    def solve(self, max_iteration=50, tolerance=1e-5, message=False, trace_every=1):
         """VAMP solver
 
         Args:
             max_iteration: maximum number of iterations to be used
             tolerance: stopping criterion
             message: convergence info
+            trace_every: sampling rate of the traces of self.result (only the last iteration if 0)
 
         Returns:
-            estimated signal
+            estimated signal of shape (N, ) or (N, B)
+            (the iteration count, the convergence flags and the traces of abs_diff, the estimate norm,
+            alpha_1, alpha_2, gamma_1 and gamma_2 are stored in self.result)
+        """
+        convergence_flag, abs_diff, iteration_index = self.__iterate(max_iteration, tolerance, message, trace_every)
+
+        if message and not convergence_flag:
+            estimate_norm = np.linalg.norm(self.x_hat_1, axis=0)
+            print("does not converged.")
+            print("abs_diff=", abs_diff)
+            print("estimate norm=", estimate_norm)
+            if np.all(estimate_norm != 0.0):
+                print("relative diff= ", abs_diff / estimate_norm)
+            print("iteration num=", iteration_index + 1)
+            print()
+
+        return self.x_hat_1
+
+    def loo_error(self):
+        """approximate leave-one-out cross-validation error of the current fixed point
+
+        the residual of each row predicted by the estimate without that row is approximated by
+        (y - A x_hat_1) / (1 - h), with the self averaging leverage h = N alpha_1 / M
+        (the degrees of freedom N alpha_1 of the soft thresholding per row), so that the error is obtained
+        without refitting. it is meaningful only when the solver has converged.
+
+        Returns:
+            mean squared leave-one-out residual of shape () or (B, ) (inf if N alpha_1 >= M)
+        """
+        return self.__loo_error(self.x_hat_1, self.alpha_1)
+
+    def __loo_error(self, x_hat, alpha_1):
+        """approximate leave-one-out error of estimates
+
+        Args:
+            x_hat: estimates of shape (N, ...)
+            alpha_1: alpha_1 of the estimates of shape (...)
+
+        Returns:
+            mean squared leave-one-out residual of shape (...)
+        """
+        prediction = (self.A @ x_hat.reshape(self.N, -1)).reshape((self.M,) + x_hat.shape[1:])
+        y = self.y.reshape(self.y.shape + (1,) * (x_hat.ndim - self.y.ndim))
+        squared_residual = np.mean(np.square(y - prediction), axis=0, dtype=np.float64)
+        h = self.N * np.asarray(alpha_1) / self.M
+        with np.errstate(divide="ignore"):
+            return np.where(h < 1.0, squared_residual / np.square(1.0 - np.minimum(h, 1.0)), np.inf)
+
+    def __iterate(self, max_iteration, tolerance, message, trace_every=1):
+        """VAMP iteration starting from the current state, recorded in self.result
+
+        Args:
+            max_iteration: maximum number of iterations to be used
+            tolerance: stopping criterion
+            message: convergence info
+            trace_every: sampling rate of the traces
+
+        Returns:
+            convergence flag, the last abs_diff and the last iteration index
         """
         convergence_flag = False
         abs_diff = 9999
         iteration_index = 9999
+        self.result = trace.SolveResult(max_iteration, self.y.shape[1:], ("alpha_1", "alpha_2", "gamma_1", "gamma_2"),
+                                        trace_every)
 
+        adaptive_dumping.reset(self.dumping)
+        accelerating.reset(self.acceleration)
         for iteration_index in range(max_iteration):
-            old_x_hat_1 = self.x_hat_1.copy()
-
             # denonising
-            new_x_hat_1 = self.__update_x_hat_1()
-            new_alpha_1 = self.__update_alpha_1()
-            self.x_hat_1 = utils.update_dumping(old_x=self.x_hat_1, new_x=new_x_hat_1, dumping_coefficient=self.dumping)
-            self.alpha_1 = new_alpha_1
+            self.x_hat_1, self.alpha_1, squared_diff = self.__update_x_hat_1()
             new_eta_1 = self.__update_eta_1()
             self.eta_1 = np.clip(
-                utils.update_dumping(old_x=self.eta_1, new_x=new_eta_1, dumping_coefficient=self.dumping),
+                utils.update_dumping(old_x=self.eta_1, new_x=new_eta_1,
+                                     dumping_coefficient=adaptive_dumping.coefficient(self.dumping, "eta_1")),
                 a_min=1e-9,
                 a_max=1e9)
 
@@ -95,11 +236,7 @@ class SelfAveragingLMMSEVAMPSolver(object):
             self.r_2 = new_r_2
 
             # LMMSE estimation
-            self.d = self.__update_d()
-            new_x_hat_2 = self.__update_x_hat_2()
-            new_alpha_2 = self.__update_alpha_2()
-            self.x_hat_2 = new_x_hat_2
-            self.alpha_2 = new_alpha_2
+            self.x_hat_2, self.d, self.alpha_2 = self.__update_x_hat_2()
             new_eta_2 = self.__update_eta_2()
             self.eta_2 = new_eta_2
 
@@ -108,58 +245,123 @@ class SelfAveragingLMMSEVAMPSolver(object):
             new_r_1 = self.__update_r_1()
             self.r_1 = new_r_1
 
-            abs_diff = np.linalg.norm(old_x_hat_1 - self.x_hat_1) / np.sqrt(self.N)
-            if abs_diff < tolerance:
+            abs_diff = np.sqrt(squared_diff / self.N).reshape(self.y.shape[1:])
+            adaptive_dumping.update(self.dumping, abs_diff, gamma_1=self.gamma_1, gamma_2=self.gamma_2)
+            if self.result.due(iteration_index):
+                self.__record(iteration_index, abs_diff)
+            if np.all(abs_diff < tolerance):
                 convergence_flag = True
                 if message:
                     print("requirement satisfied")
                     print("abs_diff: ", abs_diff)
-                    print("abs_estimate: ", np.linalg.norm(self.x_hat_1))
+                    print("abs_estimate: ", np.linalg.norm(self.x_hat_1, axis=0))
                     print("iteration number = ", iteration_index)
                     print()
                 break
-        if convergence_flag:
-            pass
-            # print("converged")
-            # print("abs_diff=", abs_diff)
-            # print("estimate norm=", np.linalg.norm(self.x_hat_1))
-            # if np.linalg.norm(self.x_hat_1) != 0.0:
-            #     print("relative diff= ", abs_diff / np.linalg.norm(self.x_hat_1))
-            # print("iteration num=", iteration_index)
-            # print()
-        else:
+            accelerating.step(self.acceleration, self, ("x_hat_1", "eta_1", "gamma_1", "r_1"),
+                              positive=("eta_1", "gamma_1"))
+
+        self.__record(iteration_index, abs_diff)
+        self.converged = abs_diff < tolerance
+        self.result.finish(iteration_index, abs_diff, self.converged, self.x_hat_1)
+        return convergence_flag, abs_diff, iteration_index
+
+    def __record(self, iteration_index, abs_diff):
+        """record an iteration in self.result
+
+        Args:
+            iteration_index: index of the iteration
+            abs_diff: abs_diff of the iteration
+        """
+        self.result.record(iteration_index, abs_diff=abs_diff, estimate_norm=np.linalg.norm(self.x_hat_1, axis=0),
+                           alpha_1=self.alpha_1, alpha_2=self.alpha_2, gamma_1=self.gamma_1, gamma_2=self.gamma_2)
+
+    def solve_path(self, regularization_strengths, dumping_coefficients=None, max_iteration=50, tolerance=1e-5,
+                   message=False):
+        """VAMP solver for a path of regularization parameters
+
+        the singular value decomposition of the constructor is shared by all the points of the path,
+        and each point is warm-started from the fixed point of the previous one.
+        if a point does not converge with a dumping coefficient,
+        it is solved again from the previous fixed point with the next dumping coefficient.
+        the approximate leave-one-out error of each point (see loo_error) is stored in self.path_loo_error,
+        computed for all the points at once from one product of A.
+
+        Args:
+            regularization_strengths: regularization parameters of shape (K, )
+            dumping_coefficients: dumping coefficients to be tried in order (the current one if None)
+            max_iteration: maximum number of iterations to be used
+            tolerance: stopping criterion
+            message: convergence info
+
+        Returns:
+            estimated signals of shape (N, K) or (N, B, K)
+        """
+        l_path = np.asarray(regularization_strengths, dtype=np.float64).ravel()
+        initial_dumping = self.dumping
+        if dumping_coefficients is None:
+            dumping_coefficients = [initial_dumping]
+
+        batch_shape = self.y.shape[1:]
+        x_hat_path = np.zeros((self.N,) + batch_shape + l_path.shape, dtype=self.dtype)
+        self.path_converged = np.zeros(batch_shape + l_path.shape, dtype=bool)  # convergence flag of each point
+        alpha_1_path = np.zeros(batch_shape + l_path.shape)
+
+        for k, l in enumerate(l_path):
+            self.l = l
+            initial_state = self.__get_state()
+            for dumping in dumping_coefficients:
+                self.__set_state(initial_state)
+                self.dumping = dumping
+                convergence_flag, abs_diff, iteration_index = self.__iterate(max_iteration, tolerance, message)
+                if convergence_flag:
+                    break
+            x_hat_path[..., k] = self.x_hat_1
+            self.path_converged[..., k] = self.converged
+            alpha_1_path[..., k] = self.alpha_1
+        self.dumping = initial_dumping
+        self.path_loo_error = self.__loo_error(x_hat_path, alpha_1_path)  # approximate leave-one-out error
+
+        if message and not self.path_converged.all():
             print("does not converged.")
-            print("abs_diff=", abs_diff)
-            print("estimate norm=", np.linalg.norm(self.x_hat_1))
-            if np.linalg.norm(self.x_hat_1) != 0.0:
-                print("relative diff= ", abs_diff / np.linalg.norm(self.x_hat_1))
-            print("iteration num=", iteration_index + 1)
+            print("regularization strengths=", l_path[~self.path_converged.reshape(-1, l_path.shape[0]).all(axis=0)])
             print()
 
-        return self.x_hat_1
+        return x_hat_path
 
-    @numba.jit(parallel=True)
-    def __update_x_hat_1(self):
-        """ update x_hat_1
+    def __get_state(self):
+        """copy of the messages
 
         Returns:
-            new x_hat_1
+            dict of the messages
         """
-        v1 = (self.r_1 - self.l / self.gamma_1 * np.sign(self.r_1))
-        v2 = np.heaviside(np.abs(self.r_1) - self.l / self.gamma_1, 0.5)
-        return v1 * v2
+        return {
+            "x_hat_1": self.x_hat_1.copy(), "alpha_1": self.alpha_1, "eta_1": self.eta_1,
+            "gamma_2": self.gamma_2, "r_2": self.r_2.copy(),
+            "x_hat_2": self.x_hat_2.copy(), "alpha_2": self.alpha_2, "eta_2": self.eta_2,
+            "gamma_1": self.gamma_1, "r_1": self.r_1.copy(),
+        }
 
-    @numba.jit(parallel=True)
-    def __update_alpha_1(self):
-        """update alpha_1
+    def __set_state(self, state):
+        """restore the messages
+
+        Args:
+            state: dict of the messages returned by __get_state
+        """
+        for key, value in state.items():
+            setattr(self, key, value.copy() if isinstance(value, np.ndarray) else value)
+
+    def __update_x_hat_1(self):
+        """ update x_hat_1 with dumping and alpha_1 in one pass
 
         Returns:
-            new alpha_1
+            new x_hat_1, new alpha_1 and squared norm of the change of x_hat_1
         """
-        v1 = np.heaviside(np.abs(self.r_1) - self.l / self.gamma_1, 0.5)
-        return np.mean(v1)
+        d = adaptive_dumping.coefficient(self.dumping, "x_hat_1")
+        x_hat_1, alpha_1, squared_diff = kernels.vamp_denoise(self.denoiser, self.r_1, self.l, self.gamma_1,
+                                                              self.x_hat_1, d)
+        return x_hat_1, alpha_1.reshape(self.alpha_1.shape), squared_diff
 
-    @numba.jit(parallel=True)
     def __update_eta_1(self):
         """update eta_1
 
@@ -168,7 +370,6 @@ class SelfAveragingLMMSEVAMPSolver(object):
         """
         return self.gamma_1 / self.alpha_1
 
-    @numba.jit(parallel=True)
     def __update_gamma_2(self):
         """update gamma_2
 
@@ -177,49 +378,47 @@ class SelfAveragingLMMSEVAMPSolver(object):
         """
         return self.eta_1 - self.gamma_1
 
-    @numba.jit(parallel=True)
     def __update_r_2(self):
         """update r_2
 
         Returns:
             new r_2
         """
-        return (self.eta_1 * self.x_hat_1 - self.gamma_1 * self.r_1) / self.gamma_2
+        return kernels.combine(self.eta_1 / self.gamma_2, self.x_hat_1, self.gamma_1 / self.gamma_2, self.r_1)
 
-    @numba.jit(parallel=True)
     def __update_x_hat_2(self):
-        """update x_hat_2
+        """update x_hat_2, d and alpha_2
 
         Returns:
-            new x_hat_2
+            new x_hat_2, new d and new alpha_2
         """
-
-        def __calc_v1(r2):
-            return r2
-
-        def __calc_v2(V, d, y_tilde):
-            return V @ (d * y_tilde)
-
-        def __calc_v3(V, d, VT, r2):
-            v1 = VT @ r2
-            v2 = d * v1
-            return V @ v2
-
-        v1 = __calc_v1(self.r_2)
-        v2 = __calc_v2(self.V, self.d, self.y_tilde)
-        v3 = __calc_v3(self.V, self.d, self.VT, self.r_2)
-        return v1 + v2 - v3
-
-    @numba.jit(parallel=True)
-    def __update_alpha_2(self):
+        if self.row_orthogonal:
+            # r_2 + V (d * (y_tilde - VT r_2)) = r_2 + A.T (y - A r_2) / (s^2 + gamma_2)
+            d = self.__update_d()
+            c = np.asarray(1.0 / (self.s2[0] + self.gamma_2), dtype=self.dtype)
+            return self.r_2 + self.A.T @ (self.y - self.A @ self.r_2) * c, d, self.__update_alpha_2(d)
+
+        # r_2 + V (d * y_tilde) - V (d * (VT r_2)) = r_2 + V (d * (y_tilde - VT r_2))
+        r_2 = kernels.as_columns(self.r_2)
+        VTr_2 = self.VT @ r_2
+        d, t = np.empty_like(VTr_2), np.empty_like(VTr_2)
+        d_sum = kernels.vamp_lmmse_coefficients(self.s2, kernels.as_column_scalars(self.gamma_2, r_2.shape[1]),
+                                                kernels.as_columns(self.y_tilde), VTr_2, d, t)
+        x_hat_2 = r_2 + self.V @ t
+        alpha_2 = 1.0 - d_sum / self.N
+        return x_hat_2.reshape(self.r_2.shape), d.reshape(self.d.shape), alpha_2.reshape(self.alpha_2.shape)
+
+    def __update_alpha_2(self, d):
         """update alpha_2
 
+        Args:
+            d: d
+
         Returns:
             new alpha_2
         """
-        return 1.0 - self.d.mean()
+        return 1.0 - d.mean(axis=0, dtype=np.float64)
 
-    @numba.jit(parallel=True)
     def __update_eta_2(self):
         """update eta_2
 
@@ -228,7 +427,6 @@ class SelfAveragingLMMSEVAMPSolver(object):
         """
         return self.gamma_2 / self.alpha_2
 
-    @numba.jit(parallel=True)
     def __update_gamma_1(self):
         """update gamma_1
 
@@ -237,23 +435,22 @@ class SelfAveragingLMMSEVAMPSolver(object):
         """
         return self.eta_2 - self.gamma_2
 
-    @numba.jit(parallel=True)
     def __update_r_1(self):
         """update r_1
 
         Returns:
             new r_1
         """
-        return (self.eta_2 * self.x_hat_2 - self.gamma_2 * self.r_2) / self.gamma_1
+        return kernels.combine(self.eta_2 / self.gamma_1, self.x_hat_2, self.gamma_2 / self.gamma_1, self.r_2)
 
-    @numba.jit(parallel=True)
     def __update_d(self):
         """get d
 
         Returns:
             new d
         """
-        return self.s2 / (self.s2 + self.gamma_2)
+        s2 = self.s2.reshape((-1,) + (1,) * np.ndim(self.gamma_2))
+        return (s2 / (s2 + self.gamma_2)).astype(self.dtype)
 
     def show_me(self):
         """debug method"""
@@ -6,6 +6,7 @@ from . import SelfAveragingAMPSolver
 from . import NaiveSelfAveragingLMMSEVAMPSolver
 from . import SelfAveragingLMMSEVAMPSolver
 from . import NaiveLMMSEVAMPSolver
+from . import CGSelfAveragingLMMSEVAMPSolver
 
 __all__ = [
     'utils',
@@ -14,4 +15,5 @@ __all__ = [
     'NaiveSelfAveragingLMMSEVAMPSolver.py',
     'SelfAveragingLMMSEVAMPSolver',
     'NaiveLMMSEVAMPSolver',
+    'CGSelfAveragingLMMSEVAMPSolver',
 ]
@@ -1,7 +1,37 @@
 # coding=utf-8
 
 from . import utils
+from . import operators
+from . import kernels
+from . import iterative
+from . import cache
+from . import trace
+from . import profiler
+from . import cross_validation
+from . import state_evolution
+from . import adaptive_dumping
+from . import acceleration
+from . import screening
+from . import denoisers
+from . import executor
+from . import ensembles
+from . import regularization_path
 
 __all__ = [
-    'utils'
+    'utils',
+    'operators',
+    'kernels',
+    'iterative',
+    'cache',
+    'trace',
+    'profiler',
+    'cross_validation',
+    'state_evolution',
+    'adaptive_dumping',
+    'acceleration',
+    'screening',
+    'denoisers',
+    'executor',
+    'ensembles',
+    'regularization_path',
 ]
@@ -0,0 +1,148 @@
+# coding=utf-8
+"""Anderson acceleration of the fixed-point iterations of the solvers
+
+every solver accepts an AndersonAcceleration (acceleration=...) which acts on the full message state of its
+solve loop. one iteration of the solver is a map G of the state x, including the dumping,
+and the accelerator replaces G(x_k) by the extrapolation
+
+    x_{k+1} = G(x_k) - dG gamma,   gamma = argmin || f_k - dF gamma ||,   f_k = G(x_k) - x_k
+
+where the columns of dF and dG are the differences of the last window residuals f and images G(x).
+gamma is solved for each observation (each column of the state) separately.
+the extrapolation is safeguarded: when the norm of the residual f_k of a column grows by more than growth,
+the history is cleared and the plain (dumped) step G(x_k) is taken, and a column whose extrapolated state
+is not finite or whose precisions / variances are not positive takes the plain step as well.
+
+the history holds 2 window + 3 copies of the message state in double precision,
+i.e. about 2 window + 3 vectors of length N (or M) per message vector of the solver.
+
+the message state of each solver:
+    AMPSolver, SelfAveragingAMPSolver: V, z, r and chi
+    SelfAveragingLMMSEVAMPSolver, NaiveSelfAveragingLMMSEVAMPSolver, CGSelfAveragingLMMSEVAMPSolver:
+        x_hat_1, eta_1, gamma_1 and r_1
+    NaiveLMMSEVAMPSolver: x1_hat, chi1, q1_hat and r1
+"""
+import collections
+
+import numpy as np
+
+
+class AndersonAcceleration(object):
+    """ Anderson mixing of the message state with a bounded history window """
+
+    def __init__(self, window=5, growth=1.0, regularization=1e-10):
+        """constructor
+
+        Args:
+            window: number of differences kept in the history
+            growth: ratio of the residual norm to the previous one above which the plain step is taken
+            regularization: Tikhonov regularization of the least squares, relative to the trace of its Gram matrix
+        """
+        self.window = window
+        self.growth = growth
+        self.regularization = regularization
+        self.reset()
+
+    def reset(self):
+        """start a solve from the plain iteration"""
+        self.n_accelerated = 0  # number of extrapolated steps of the current solve
+        self.n_restarts = 0  # number of times the history was cleared by the safeguard
+        self.__x = None  # state returned by the previous step
+        self.__f = None  # residual of the previous step
+        self.__g = None  # image of the previous step
+        self.__norm = None  # residual norm of each column of the previous step
+        self.__dF = collections.deque(maxlen=self.window)
+        self.__dG = collections.deque(maxlen=self.window)
+
+    def step(self, state, positive=()):
+        """extrapolate the state after an iteration
+
+        Args:
+            state: list of (name, array of shape (L, B) or (1, B)) of the state G(x_k), in float64
+            positive: names of the variables which must stay positive
+
+        Returns:
+            array of shape (n, B) of the next state x_{k+1}
+        """
+        g = np.concatenate([value for _, value in state])
+        if self.__x is None or self.__x.shape != g.shape:
+            # first iteration of a solve, or the columns of a path block have changed
+            self.reset()
+            self.__x = g
+            return g
+
+        f = g - self.__x
+        norm = np.sqrt(np.sum(np.square(f), axis=0))
+        if self.__f is not None:
+            self.__dF.append(f - self.__f)
+            self.__dG.append(g - self.__g)
+        grown = ~np.isfinite(norm)
+        if self.__norm is not None:
+            grown |= norm > self.growth * self.__norm
+        self.__f, self.__g, self.__norm = f, g, norm
+
+        if np.any(grown):
+            self.__dF.clear()
+            self.__dG.clear()
+            self.n_restarts += 1
+        if len(self.__dF) == 0:
+            self.__x = g
+            return g
+
+        dF = np.stack(self.__dF)  # (m, n, B)
+        dG = np.stack(self.__dG)
+        gram = np.einsum("inb,jnb->bij", dF, dF)
+        rhs = np.einsum("inb,nb->bi", dF, f)
+        scale = np.trace(gram, axis1=1, axis2=2) / gram.shape[1]
+        gram += (self.regularization * scale + np.finfo(np.float64).tiny)[:, None, None] * np.eye(gram.shape[1])
+        gamma = np.linalg.solve(gram, rhs[..., None])[..., 0]  # (B, m)
+        x = g - np.einsum("inb,bi->nb", dG, gamma)
+
+        valid = np.all(np.isfinite(x), axis=0)
+        offset = 0
+        for name, value in state:
+            if name in positive:
+                valid &= np.all(x[offset:offset + value.shape[0]] > 0.0, axis=0)
+            offset += value.shape[0]
+        x[:, ~valid] = g[:, ~valid]
+        self.n_accelerated += int(np.any(valid))
+        self.__x = x
+        return x
+
+    def __repr__(self):
+        return "AndersonAcceleration(window={0}, growth={1})".format(self.window, self.growth)
+
+
+def reset(acceleration):
+    """start a solve (nothing without acceleration)
+
+    Args:
+        acceleration: AndersonAcceleration or None
+    """
+    if acceleration is not None:
+        acceleration.reset()
+
+
+def step(acceleration, solver, names, positive=()):
+    """replace the message state of a solver by its extrapolation (nothing without acceleration)
+
+    Args:
+        acceleration: AndersonAcceleration or None
+        solver: solver whose attributes names hold the state G(x_k) of shape (L, ...) or (...)
+                with the batch shape (...) of solver.y
+        names: names of the message attributes of the solver
+        positive: names of the attributes which must stay positive
+    """
+    if acceleration is None:
+        return
+    batch_shape = solver.y.shape[1:]
+    B = int(np.prod(batch_shape))
+    values = [np.asarray(getattr(solver, name)) for name in names]
+    state = [(name, value.reshape(-1, B).astype(np.float64)) for name, value in zip(names, values)]
+    x = acceleration.step(state, positive)
+
+    offset = 0
+    for (name, column_state), value in zip(state, values):
+        length = column_state.shape[0]
+        setattr(solver, name, x[offset:offset + length].reshape(value.shape).astype(value.dtype))
+        offset += length
@@ -0,0 +1,126 @@
+# coding=utf-8
+"""forward products of AMP over the active columns of the denoised estimate
+
+an AMP iteration dumps the denoised estimate s (and its variance chi_s) into the messages,
+r_new = d s + (1 - d) r and chi_new = d chi_s + (1 - d) chi, so that r and chi stay dense while d < 1
+although, for a sparse denoiser (e.g. the soft thresholding), s and chi_s vanish outside the active set
+S = {i : s_i != 0}. by linearity
+
+    A @ r_new = d A[:, S] @ s[S] + (1 - d) A @ r,    A2 @ chi_new = d A2[:, S] @ chi_s[S] + (1 - d) A2 @ chi,
+
+and A @ r, A2 @ chi are the products of the previous iteration, so that the forward products cost O(M |S|)
+instead of O(M N). the columns A[:, S] and their squares are cached in preallocated buffers:
+the columns entering S are appended, the columns leaving S are kept (their entries of s are zero)
+until they outnumber the active ones, when the buffers are rebuilt from S.
+
+the kernels of the iteration (utils.kernels.amp_update_r and sa_amp_update_r) flag S while they denoise,
+and d s[S] = r_new[S] - (1 - d) r[S] (and d chi_s[S] likewise), so that the denoiser is not evaluated again.
+
+a product is taken this way only if its argument is the very message dumped by the previous iteration,
+i.e. an array of the same memory, shape and strides, whose reference is held until then
+(anything else, e.g. the first iteration, a warm start or an accelerated step, is multiplied densely),
+and only if |S| is at most max_fraction N. the solvers call reset at the start of each solve,
+so that a message written in place between two solves is multiplied densely.
+"""
+import numpy as np
+
+
+class ActiveSetProducts(object):
+    """ A @ r and A2 @ chi of a dense observation matrix over the active columns """
+
+    def __init__(self, operator, max_fraction=0.5):
+        """constructor
+
+        Args:
+            operator: utils.operators.DenseOperator of shape (M, N)
+            max_fraction: largest fraction of active columns for which the active set is used
+        """
+        self.operator = operator
+        self.max_fraction = max_fraction
+        self.columns = np.zeros(0, dtype=np.intp)  # cached columns, in the order of the buffers
+        self.position = np.full(operator.N, -1, dtype=np.intp)  # column -> index in the buffers (-1 if not cached)
+        self.submatrix = np.zeros((operator.M, 0), dtype=operator.dtype, order="F")
+        self.squared_submatrix = np.zeros((operator.M, 0), dtype=operator.dtype, order="F")
+        self.__products = {}  # False / True (squared) -> product of the last argument
+        self.__pending = {}  # False / True (squared) -> (dumped message, d times the denoised part, d)
+
+    def reset(self):
+        """forget the dumped messages, so that the next products are taken densely"""
+        self.__pending.clear()
+
+    def matvec(self, x, squared=False):
+        """A @ x or A2 @ x
+
+        Args:
+            x: array of shape (N, K)
+            squared: whether the product is A2 @ x
+
+        Returns:
+            array of shape (M, K)
+        """
+        pending = self.__pending.pop(squared, None)
+        previous = self.__products.get(squared)
+        if pending is not None and previous is not None and _same_array(pending[0], x):
+            _, s, d = pending
+            submatrix = self.squared_submatrix if squared else self.submatrix
+            product = submatrix[:, :self.columns.size] @ s + (1.0 - d) * previous
+        elif squared:
+            product = self.operator.squared_matvec(x)
+        else:
+            product = self.operator.matvec(x)
+        self.__products[squared] = product
+        return product
+
+    def dumped(self, r_new, chi_new, r, chi, support, d):
+        """record the messages dumped by an iteration, whose products are taken over the active set
+
+        Args:
+            r_new: dumped estimator of shape (N, K)
+            chi_new: dumped variance of shape (N, K) (None if A2 @ chi is not needed)
+            r: estimator of the iteration of shape (N, K)
+            chi: variance of the iteration of shape (N, K)
+            support: rows of a nonzero denoised estimate of shape (N, ), as flagged by the kernel
+            d: dumping coefficient of the iteration
+        """
+        self.__pending.clear()
+        active = np.flatnonzero(support)
+        if active.size > self.max_fraction * self.operator.N:
+            return
+        self.__update_columns(active)
+
+        # d times the denoised part on the cached columns, zero on the columns which left the active set
+        columns = self.columns
+        inside = support[columns][:, np.newaxis]
+        self.__pending[False] = (r_new, np.where(inside, r_new[columns] - (1.0 - d) * r[columns], 0.0), d)
+        if chi_new is not None:
+            self.__pending[True] = (chi_new, np.where(inside, chi_new[columns] - (1.0 - d) * chi[columns], 0.0), d)
+
+    def __update_columns(self, active):
+        """cache the columns of the active set, reading only the columns which enter it
+
+        Args:
+            active: indices of the active columns
+        """
+        entering = active[self.position[active] < 0]
+        n = self.columns.size
+        if n + entering.size > self.submatrix.shape[1] or n + entering.size > 2 * active.size:
+            # rebuild from the active set, with room for as many entering columns
+            self.position[self.columns] = -1
+            self.columns = np.zeros(0, dtype=np.intp)
+            capacity = min(self.operator.N, 2 * active.size + 16)
+            self.submatrix = np.empty((self.operator.M, capacity), dtype=self.operator.dtype, order="F")
+            self.squared_submatrix = np.empty_like(self.submatrix)
+            entering, n = active, 0
+        if entering.size == 0:
+            return
+        block = self.operator.A[:, entering]
+        self.submatrix[:, n:n + entering.size] = block
+        self.squared_submatrix[:, n:n + entering.size] = np.square(block)
+        self.position[entering] = np.arange(n, n + entering.size)
+        self.columns = np.concatenate((self.columns, entering))
+
+
+def _same_array(a, b):
+    """whether two arrays are views of the same memory with the same shape and strides"""
+    return a.shape == b.shape and a.strides == b.strides and \
+        a.__array_interface__["data"][0] == b.__array_interface__["data"][0]
@@ -0,0 +1,139 @@
+# coding=utf-8
+"""adaptive dumping of the solvers
+
+every solver accepts an AdaptiveDumping in place of its dumping coefficient (dumping_coefficient, solver.d or
+solver.dumping). the controller starts each solve from its initial coefficient and, after each iteration,
+lowers the coefficient when the undumped step (abs_diff / coefficient for the solvers whose abs_diff is
+the change of a dumped estimate, abs_diff otherwise) grows or is not finite,
+keeps it while the increments of the scalar messages of the solver change sign (an oscillation),
+and raises it otherwise, within [minimum, maximum].
+
+a float dumping coefficient is passed through coefficient, reset and update unchanged,
+so that the solvers use one code path for fixed and adaptive dumping.
+
+the dumped variables of each solver, whose coefficients can be scaled by rates:
+    AMPSolver, SelfAveragingAMPSolver: "r" (the estimate and its variance)
+    SelfAveragingLMMSEVAMPSolver, NaiveSelfAveragingLMMSEVAMPSolver, CGSelfAveragingLMMSEVAMPSolver:
+        "x_hat_1" and "eta_1"
+    NaiveLMMSEVAMPSolver: "x1_hat", "chi1", "q1_hat" and "r1"
+"""
+import numpy as np
+
+
+class AdaptiveDumping(object):
+    """ dumping coefficient controlled by the trajectory of abs_diff and of the scalar messages """
+
+    def __init__(self, initial=1.0, minimum=0.1, maximum=1.0, increase=1.2, decrease=0.5, growth=1.0, rates=None):
+        """constructor
+
+        Args:
+            initial: coefficient of the first iteration of each solve
+            minimum: lower bound of the coefficient
+            maximum: upper bound of the coefficient
+            increase: factor of the coefficient after an iteration whose step did not grow
+            decrease: factor of the coefficient after an iteration whose step grew
+            growth: ratio of the undumped step to the previous one above which the step has grown
+            rates: dict of variable name -> factor of the coefficient of that variable (1 if not given)
+        """
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.growth = growth
+        self.rates = {} if rates is None else dict(rates)
+        self.reset()
+
+    def reset(self):
+        """start a solve from the initial coefficient"""
+        self.value = float(np.clip(self.initial, self.minimum, self.maximum))
+        self.history = []  # coefficient of each iteration
+        self.__step = None  # largest undumped step of the previous iteration
+        self.__scalars = {}  # name -> (previous value, previous increment)
+
+    def coefficient(self, name=None):
+        """coefficient of the current iteration
+
+        Args:
+            name: dumped variable (the coefficient itself if None or not in rates)
+
+        Returns:
+            dumping coefficient
+        """
+        return float(np.clip(self.value * self.rates.get(name, 1.0), self.minimum, self.maximum))
+
+    def update(self, abs_diff, dumped_step=True, **scalars):
+        """adapt the coefficient after an iteration
+
+        Args:
+            abs_diff: abs_diff of the iteration of shape () or (B, ), computed with the current coefficient
+            dumped_step: whether abs_diff is the change of an estimate dumped with the current coefficient
+            scalars: scalar messages of the iteration (e.g. gamma_1=...), of shape () or (B, )
+
+        Returns:
+            coefficient of the next iteration
+        """
+        self.history.append(self.value)
+        abs_diff = np.asarray(abs_diff, dtype=np.float64)
+        step = np.max(abs_diff) if abs_diff.size else 0.0
+        if dumped_step:
+            step /= self.value
+
+        oscillating = False
+        for name, value in scalars.items():
+            value = np.asarray(value, dtype=np.float64)
+            previous = self.__scalars.get(name)
+            if previous is not None and previous[0].shape != value.shape:
+                previous = None  # the columns of a path block have changed
+            increment = None if previous is None else value - previous[0]
+            if increment is not None and previous[1] is not None:
+                oscillating |= bool(np.any(increment * previous[1] < 0.0))
+            self.__scalars[name] = (value, increment)
+
+        if not np.isfinite(step) or (self.__step is not None and step > self.growth * self.__step):
+            self.value = max(self.minimum, self.value * self.decrease)
+        elif not oscillating:
+            self.value = min(self.maximum, self.value * self.increase)
+        self.__step = step if np.isfinite(step) else None
+        return self.value
+
+    def __repr__(self):
+        return "AdaptiveDumping(value={0}, minimum={1}, maximum={2})".format(self.value, self.minimum, self.maximum)
+
+
+def coefficient(dumping, name=None):
+    """coefficient of a fixed or adaptive dumping
+
+    Args:
+        dumping: dumping coefficient or AdaptiveDumping
+        name: dumped variable
+
+    Returns:
+        dumping coefficient of the current iteration
+    """
+    if isinstance(dumping, AdaptiveDumping):
+        return dumping.coefficient(name)
+    return dumping
+
+
+def reset(dumping):
+    """start a solve (nothing for a fixed dumping)
+
+    Args:
+        dumping: dumping coefficient or AdaptiveDumping
+    """
+    if isinstance(dumping, AdaptiveDumping):
+        dumping.reset()
+
+
+def update(dumping, abs_diff, dumped_step=True, **scalars):
+    """adapt the dumping after an iteration (nothing for a fixed dumping)
+
+    Args:
+        dumping: dumping coefficient or AdaptiveDumping
+        abs_diff: abs_diff of the iteration
+        dumped_step: whether abs_diff is the change of an estimate dumped with the current coefficient
+        scalars: scalar messages of the iteration
+    """
+    if isinstance(dumping, AdaptiveDumping):
+        dumping.update(abs_diff, dumped_step, **scalars)
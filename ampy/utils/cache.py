@@ -0,0 +1,219 @@
+# coding=utf-8
+"""content-addressed cache of the precomputations of the solvers (decompositions, Gram matrices)
+
+an entry is a dict of arrays stored under a key derived from a hash of the observation matrix.
+recently used entries are kept in memory up to a byte budget, and every entry is also written to a directory
+as .npy files, which later processes memory-map instead of recomputing them.
+"""
+import collections
+import hashlib
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from scipy import sparse
+
+from . import operators
+
+# number of bytes hashed at once
+HASH_BLOCK_BYTES = 1 << 24
+
+
+def _update_hash(h, x):
+    """feed the shape, the dtype and the content of an array to a hash
+
+    Args:
+        h: hashlib object
+        x: array
+    """
+    x = np.asarray(x)
+    h.update(repr((x.shape, x.dtype.str)).encode())
+    if x.ndim == 0:
+        h.update(x.tobytes())
+        return
+    rows = max(1, HASH_BLOCK_BYTES // max(1, x[0].nbytes))
+    for start in range(0, x.shape[0], rows):
+        h.update(np.ascontiguousarray(x[start:start + rows]).data)
+
+
+def fingerprint(A):
+    """hash of the content of an observation matrix
+
+    Args:
+        A: numpy array, np.memmap, scipy.sparse matrix or utils.operators.LinearOperator
+
+    Returns:
+        hexadecimal digest
+    """
+    h = hashlib.blake2b(digest_size=20)
+    h.update(type(A).__name__.encode())
+    if isinstance(A, (operators.DenseOperator, operators.MemmapOperator)):
+        _update_hash(h, A.A)
+        h.update(A.dtype.str.encode())
+    elif isinstance(A, operators.SparseOperator) or sparse.issparse(A):
+        A = A.A if isinstance(A, operators.SparseOperator) else A.tocsr()
+        h.update(repr((A.shape, A.format)).encode())
+        for x in (A.data, A.indices, A.indptr):
+            _update_hash(h, x)
+    elif isinstance(A, operators.SubsampledDCTOperator):
+        h.update(repr((A.shape, A.dtype.str)).encode())
+        _update_hash(h, A.rows)
+    elif isinstance(A, operators.RandomizedHadamardOperator):
+        h.update(repr((A.shape, A.dtype.str)).encode())
+        _update_hash(h, A.rows)
+        _update_hash(h, A.signs)
+    elif isinstance(A, operators.LinearOperator):
+        _update_hash(h, A.toarray())
+    else:
+        _update_hash(h, A)
+    return h.hexdigest()
+
+
+class DecompositionCache(object):
+    """ in-memory LRU cache of precomputed arrays with an optional on-disk store """
+
+    def __init__(self, directory=None, max_bytes=1 << 30):
+        """constructor
+
+        Args:
+            directory: directory of the on-disk store (memory only if None)
+            max_bytes: budget of the arrays held in memory (memory-mapped arrays are not counted)
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+        self.entries = collections.OrderedDict()  # key -> dict of arrays, the most recently used last
+        self.nbytes = 0  # bytes held in memory
+
+        # statistics
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def key(self, A, name, **params):
+        """key of a precomputation
+
+        Args:
+            A: observation matrix (hashed by fingerprint), or a str identifying it (not hashed)
+            name: name of the precomputation
+            params: parameters of the precomputation (arrays are hashed)
+
+        Returns:
+            hexadecimal key
+        """
+        h = hashlib.blake2b(digest_size=20)
+        h.update((A if isinstance(A, str) else fingerprint(A)).encode())
+        h.update(name.encode())
+        for param_name, value in sorted(params.items()):
+            h.update(param_name.encode())
+            if isinstance(value, np.ndarray):
+                _update_hash(h, value)
+            else:
+                h.update(repr(value).encode())
+        return h.hexdigest()
+
+    def get(self, key):
+        """cached arrays
+
+        Args:
+            key: key of the entry
+
+        Returns:
+            dict of arrays, or None if the entry is not cached
+        """
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.memory_hits += 1
+            return self.entries[key]
+
+        path = self.__path(key)
+        if path is not None and os.path.isdir(path):
+            arrays = {
+                file_name[:-len(".npy")]: np.load(os.path.join(path, file_name), mmap_mode="r")
+                for file_name in os.listdir(path) if file_name.endswith(".npy")
+            }
+            self.disk_hits += 1
+            self.__insert(key, arrays)
+            return arrays
+
+        self.misses += 1
+        return None
+
+    def put(self, key, arrays):
+        """store arrays in memory and on disk
+
+        Args:
+            key: key of the entry
+            arrays: dict of arrays, which must not be modified afterwards
+        """
+        path = self.__path(key)
+        if path is not None and not os.path.isdir(path):
+            # written to a temporary directory and renamed, so that concurrent processes never read a partial entry
+            temporary = tempfile.mkdtemp(dir=self.directory)
+            for array_name, x in arrays.items():
+                np.save(os.path.join(temporary, array_name + ".npy"), x)
+            try:
+                os.rename(temporary, path)
+            except OSError:
+                # written by another process in the meantime
+                shutil.rmtree(temporary, ignore_errors=True)
+        self.__insert(key, arrays)
+
+    def get_or_compute(self, key, compute):
+        """cached arrays, computed and stored if they are not cached
+
+        Args:
+            key: key of the entry
+            compute: function returning the dict of arrays
+
+        Returns:
+            dict of arrays
+        """
+        arrays = self.get(key)
+        if arrays is None:
+            arrays = compute()
+            self.put(key, arrays)
+        return arrays
+
+    def clear(self):
+        """drop the entries held in memory (the on-disk store is kept)"""
+        self.entries.clear()
+        self.nbytes = 0
+
+    def __path(self, key):
+        return None if self.directory is None else os.path.join(self.directory, key)
+
+    def __insert(self, key, arrays):
+        if key in self.entries:
+            self.nbytes -= self.__nbytes(self.entries.pop(key))
+        self.entries[key] = arrays
+        self.nbytes += self.__nbytes(arrays)
+        # the least recently used entries are evicted, but the new one is always kept
+        while self.nbytes > self.max_bytes and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.nbytes -= self.__nbytes(evicted)
+
+    @staticmethod
+    def __nbytes(arrays):
+        return sum(x.nbytes for x in arrays.values() if not isinstance(x, np.memmap))
+
+
+def cached(cache, A, name, compute, **params):
+    """precomputation through an optional cache
+
+    Args:
+        cache: DecompositionCache or None
+        A: observation matrix, or a str identifying it
+        name: name of the precomputation
+        compute: function returning the dict of arrays
+        params: parameters of the precomputation
+
+    Returns:
+        dict of arrays, computed directly if cache is None
+    """
+    if cache is None:
+        return compute()
+    return cache.get_or_compute(cache.key(A, name, **params), compute)
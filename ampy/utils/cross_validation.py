@@ -0,0 +1,199 @@
+# coding=utf-8
+"""K-fold cross-validation of the regularization parameter with the ampy solvers
+
+the rows of (A, y) are split into folds, and a warm-started path of regularization parameters is solved
+on the rows of the other folds for each fold. the folds run in a process pool,
+to which A and y are passed through shared memory instead of being pickled for each worker.
+
+the regularization parameters are on the scale of the solvers, whose objective is 1/2 ||y - A x||^2 + l ||x||_1,
+i.e. l = M * alpha for the alpha of sklearn.linear_model.Lasso (1 / (2 M) ||y - A x||^2 + alpha ||x||_1).
+a fold with M_train rows is solved with l * M_train / M, so that the per-row alpha is the same for every fold.
+"""
+import multiprocessing
+import os
+from concurrent import futures
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from . import regularization_path
+
+# arrays of the worker processes, attached to the shared memory by _attach
+_shared = {}
+
+
+def from_sklearn_alpha(alpha, M):
+    """regularization parameter of the solvers from the alpha of sklearn.linear_model.Lasso
+
+    Args:
+        alpha: alpha of sklearn (e.g. LassoCV().alpha_)
+        M: number of rows of A
+
+    Returns:
+        M * alpha
+    """
+    return M * np.asarray(alpha)
+
+
+def to_sklearn_alpha(l, M):
+    """alpha of sklearn.linear_model.Lasso from the regularization parameter of the solvers
+
+    Args:
+        l: regularization parameter of the solvers
+        M: number of rows of A
+
+    Returns:
+        l / M
+    """
+    return np.asarray(l) / M
+
+
+class CrossValidationResult(object):
+    """ cross-validation error curve and the chosen regularization parameter """
+
+    def __init__(self, regularization_strengths, fold_errors, M):
+        """constructor
+
+        Args:
+            regularization_strengths: regularization parameters of shape (L, )
+            fold_errors: mean squared test error of shape (n_folds, L) or (n_folds, L, B)
+            M: number of rows of A
+        """
+        self.regularization_strengths = regularization_strengths
+        self.fold_errors = fold_errors
+        self.cv_error = np.mean(fold_errors, axis=0)  # error curve of shape (L, ) or (L, B)
+        self.cv_error_std = np.std(fold_errors, axis=0) / np.sqrt(fold_errors.shape[0])  # standard error
+        self.best_index = np.argmin(self.cv_error, axis=0)  # of shape () or (B, )
+        self.regularization_strength = regularization_strengths[self.best_index]  # chosen l of each observation
+        self.alpha = to_sklearn_alpha(self.regularization_strength, M)  # the same on the scale of sklearn
+
+    def __repr__(self):
+        return "CrossValidationResult(regularization_strength={0}, alpha={1})".format(
+            self.regularization_strength, self.alpha)
+
+
+def _solve_path(solver_class, A, y, regularization_strengths, dumping_coefficient, solver_kwargs, max_iteration,
+                tolerance, block_size=1):
+    """estimates along a path of decreasing regularization parameters, each warm-started from the previous one
+
+    Returns:
+        estimates of shape (N, L) or (N, B, L)
+    """
+    solver = solver_class(A, y, regularization_strengths[0], dumping_coefficient, **solver_kwargs)
+    if isinstance(solver, regularization_path.RegularizationPath):
+        # the columns of a block start from the same state, so that only one column per block is warm-started
+        return solver.solve_path(regularization_strengths, max_iteration=max_iteration, tolerance=tolerance,
+                                 block_size=block_size)
+    if hasattr(solver, "solve_path"):
+        return solver.solve_path(regularization_strengths, max_iteration=max_iteration, tolerance=tolerance)
+
+    # warm start from the messages of the previous solve
+    x_path = []
+    for l in regularization_strengths:
+        solver.l = l
+        x_path.append(np.array(solver.solve(max_iteration=max_iteration, tolerance=tolerance)))
+    return np.stack(x_path, axis=-1)
+
+
+def _fold_errors(solver_class, A, y, test_rows, regularization_strengths, dumping_coefficient, solver_kwargs,
+                 max_iteration, tolerance, block_size, seed):
+    """mean squared test error of one fold
+
+    Returns:
+        errors of shape (L, ) or (L, B)
+    """
+    if seed is not None:
+        np.random.seed(seed)
+    M = A.shape[0]
+    train = np.ones(M, dtype=bool)
+    train[test_rows] = False
+    M_train = np.count_nonzero(train)
+
+    x_path = _solve_path(solver_class, A[train], y[train], regularization_strengths * M_train / M,
+                         dumping_coefficient, solver_kwargs, max_iteration, tolerance, block_size)
+    # (M_test, N) @ (N, B * L) -> residuals of shape (M_test, ..., L)
+    prediction = (A[test_rows] @ x_path.reshape(x_path.shape[0], -1)).reshape((len(test_rows),) + x_path.shape[1:])
+    residual = y[test_rows][..., np.newaxis] - prediction
+    return np.moveaxis(np.mean(np.square(residual), axis=0), -1, 0)
+
+
+def _attach(names):
+    """initializer of the workers: views of the shared A and y
+
+    Args:
+        names: dict of name -> (shared memory name, shape, dtype)
+    """
+    for name, (shm_name, shape, dtype) in names.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        _shared[name] = (shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+
+
+def _shared_fold_errors(*args):
+    """_fold_errors on the shared A and y"""
+    return _fold_errors(args[0], _shared["A"][1], _shared["y"][1], *args[1:])
+
+
+def cross_validate(solver_class, A, y, regularization_strengths, dumping_coefficient, n_folds=5, n_jobs=None,
+                   max_iteration=50, tolerance=1e-5, solver_kwargs=None, seed=None, block_size=1):
+    """K-fold cross-validation of the regularization parameter
+
+    Args:
+        solver_class: ampy solver class (e.g. ampy.AMPSolver.AMPSolver)
+        A: observation matrix of shape (M, N) (numpy array or scipy.sparse matrix, which is densified)
+        y: observed value of shape (M, ) or (M, B)
+        regularization_strengths: regularization parameters of the solvers for all the M rows
+        dumping_coefficient: dumping coefficient
+        n_folds: number of folds
+        n_jobs: number of worker processes (os.cpu_count() if None, the folds run in this process if 1)
+        max_iteration: maximum number of iterations of each solve
+        tolerance: stopping criterion of each solve
+        solver_kwargs: additional keyword arguments of the solver constructor (e.g. dtype)
+        seed: seed of np.random for the split of the rows and the initial messages of each fold
+              (the current random state is used if None)
+        block_size: number of regularization parameters solved at once by the AMP solvers
+                    (see utils.regularization_path), 1 for a path warm-started at every point
+
+    Returns:
+        CrossValidationResult
+    """
+    A = np.ascontiguousarray(A.toarray() if hasattr(A, "toarray") else A)
+    y = np.ascontiguousarray(y)
+    M = A.shape[0]
+    solver_kwargs = {} if solver_kwargs is None else solver_kwargs
+
+    # the path is solved from the largest regularization parameter, where the estimate is the sparsest
+    regularization_strengths = np.asarray(regularization_strengths, dtype=np.float64).ravel()
+    order = np.argsort(-regularization_strengths)
+    l_path = regularization_strengths[order]
+
+    if seed is not None:
+        np.random.seed(seed)
+    folds = np.array_split(np.random.permutation(M), n_folds)
+    fold_seeds = [None if seed is None else seed + 1 + k for k in range(n_folds)]
+    args = [(solver_class, test_rows, l_path, dumping_coefficient, solver_kwargs, max_iteration, tolerance,
+             block_size, fold_seed) for test_rows, fold_seed in zip(folds, fold_seeds)]
+
+    n_jobs = min(os.cpu_count() if n_jobs is None else n_jobs, n_folds)
+    if n_jobs <= 1:
+        errors = [_fold_errors(a[0], A, y, *a[1:]) for a in args]
+    else:
+        blocks = {}
+        try:
+            for name, x in (("A", A), ("y", y)):
+                shm = shared_memory.SharedMemory(create=True, size=max(x.nbytes, 1))
+                blocks[name] = shm
+                np.ndarray(x.shape, dtype=x.dtype, buffer=shm.buf)[...] = x
+            names = {name: (shm.name, x.shape, x.dtype.str) for (name, shm), x in zip(blocks.items(), (A, y))}
+            # spawned rather than forked workers, since the thread pool of the compiled kernels is not fork-safe
+            context = multiprocessing.get_context("spawn")
+            with futures.ProcessPoolExecutor(n_jobs, mp_context=context, initializer=_attach,
+                                             initargs=(names,)) as executor:
+                errors = list(executor.map(_shared_fold_errors, *zip(*args)))
+        finally:
+            for shm in blocks.values():
+                shm.close()
+                shm.unlink()
+
+    fold_errors = np.empty((n_folds,) + errors[0].shape)
+    fold_errors[:, order] = np.stack(errors)
+    return CrossValidationResult(regularization_strengths, fold_errors, M)
@@ -0,0 +1,220 @@
+# coding=utf-8
+"""separable denoisers of the solvers
+
+a denoiser estimates each component of the signal from its effective observation x = x_0 + sqrt(T) n,
+where T is the effective noise variance (T of AMP, 1 / gamma_1 of VAMP) and l the regularization parameter
+of the column, and returns the estimate and its derivative with respect to x in one call.
+the functions are compiled in nopython mode with the signature
+
+    function(x, l, T, parameters) -> (estimate, derivative)
+
+and are compiled into the fused kernels of utils.kernels (see Denoiser.kernel), once per denoiser,
+so that an iteration makes no temporary array for the denoiser. the built-in denoisers are
+
+    "soft_threshold": proximal operator of l |x| (the LASSO)
+    "elastic_net": proximal operator of l |x| + ridge x^2 / 2, parameters (ridge, )
+    "mcp": proximal operator of the minimax concave penalty, parameters (gamma, ) with gamma > 0
+    "scad": proximal operator of the smoothly clipped absolute deviation, parameters (a, ) with a > 2
+    "bernoulli_gauss": posterior mean of the prior (1 - rho) delta(x) + rho N(x; 0, sigma2),
+                       parameters (rho, sigma2) (l is not used)
+
+and a solver selects one by name, e.g. AMPSolver(..., denoiser="mcp"), or by a Denoiser with its parameters,
+e.g. AMPSolver(..., denoiser=denoisers.get("mcp", gamma=3.0)).
+the solvers take the noise variance of y as 1 (the loss ||y - A x||^2 / 2), so that the Bayes-optimal
+estimate of "bernoulli_gauss" for the noise variance delta is obtained from A / sqrt(delta) and y / sqrt(delta).
+"""
+import math
+
+import numba
+import numpy as np
+
+from . import kernels
+
+
+class Denoiser(object):
+    """ a compiled denoiser and its parameters """
+
+    def __init__(self, name, function, parameters=(), sparse=True):
+        """constructor
+
+        Args:
+            name: name of the denoiser
+            function: compiled function(x, l, T, parameters) -> (estimate, derivative)
+            parameters: parameters of the denoiser
+            sparse: whether the estimate is exactly zero on a range of x (the active set of AMP is used only then)
+        """
+        self.name = name
+        self.function = function
+        self.parameters = np.array(parameters, dtype=np.float64).reshape(-1)
+        self.sparse = sparse
+
+    def __call__(self, x, l, T):
+        """estimate and derivative of arrays
+
+        Args:
+            x: effective observations of shape (N, ...)
+            l: regularization parameters broadcast to the shape of x
+            T: effective noise variances broadcast to the shape of x
+
+        Returns:
+            estimate and derivative of the shape of x
+        """
+        x = np.asarray(x)
+        l = np.ascontiguousarray(np.broadcast_to(l, x.shape), dtype=np.float64).reshape(-1)
+        T = np.ascontiguousarray(np.broadcast_to(T, x.shape), dtype=x.dtype).reshape(-1)
+        estimate, derivative = np.empty(x.size, dtype=x.dtype), np.empty(x.size, dtype=x.dtype)
+        self.kernel(kernels.denoise)(np.ascontiguousarray(x).reshape(-1), l, T, estimate, derivative,
+                                     self.parameters)
+        return estimate.reshape(x.shape), derivative.reshape(x.shape)
+
+    def kernel(self, kernel):
+        """fused kernel of utils.kernels compiled with this denoiser (see utils.kernels.with_denoiser)
+
+        Args:
+            kernel: kernels.amp_update_r, kernels.sa_amp_update_r, kernels.vamp_update_x_hat_1 or kernels.denoise
+
+        Returns:
+            compiled kernel, which takes the parameters of the denoiser as its last argument
+        """
+        return kernels.with_denoiser(kernel, self.name, self.function)
+
+    def __repr__(self):
+        return "Denoiser({}, parameters={})".format(self.name, self.parameters.tolist())
+
+
+@numba.njit(cache=True)
+def soft_threshold(x, l, T, parameters):
+    """soft thresholding with threshold l T and its derivative (np.heaviside(|x| - l T, 0.5))"""
+    threshold = l * T
+    a = abs(x)
+    if a > threshold:
+        return x - threshold * np.sign(x), 1.0
+    if a == threshold:
+        return 0.5 * (x - threshold * np.sign(x)), 0.5
+    return 0.0 * x, 0.0
+
+
+@numba.njit(cache=True)
+def elastic_net(x, l, T, parameters):
+    """soft thresholding with threshold l T shrunk by 1 / (1 + ridge T)"""
+    shrinkage = 1.0 / (1.0 + parameters[0] * T)
+    estimate, derivative = soft_threshold(x, l, T, parameters)
+    return estimate * shrinkage, derivative * shrinkage
+
+
+@numba.njit(cache=True)
+def mcp(x, l, T, parameters):
+    """firm thresholding of the minimax concave penalty (hard thresholding at l sqrt(gamma T) if gamma <= T)"""
+    gamma = parameters[0]
+    a = abs(x)
+    if gamma > T:
+        if a <= l * T:
+            return 0.0 * x, 0.0
+        if a <= gamma * l:
+            slope = gamma / (gamma - T)
+            return (x - l * T * np.sign(x)) * slope, slope
+        return x, 1.0
+    # the penalized objective is concave below gamma l, whose minimum is 0 or x
+    if a > l * math.sqrt(gamma * T):
+        return x, 1.0
+    return 0.0 * x, 0.0
+
+
+@numba.njit(cache=True)
+def __scad_penalty(u, l, a):
+    """smoothly clipped absolute deviation penalty"""
+    u = abs(u)
+    if u <= l:
+        return l * u
+    if u <= a * l:
+        return (2.0 * a * l * u - u * u - l * l) / (2.0 * (a - 1.0))
+    return l * l * (a + 1.0) / 2.0
+
+
+@numba.njit(cache=True)
+def scad(x, l, T, parameters):
+    """thresholding of the smoothly clipped absolute deviation (exact minimization if a - 1 <= T)"""
+    a = parameters[0]
+    magnitude = abs(x)
+    if a - 1.0 > T:
+        if magnitude <= l * (1.0 + T):
+            return soft_threshold(x, l, T, parameters)
+        if magnitude <= a * l:
+            slope = (a - 1.0) / (a - 1.0 - T)
+            return ((a - 1.0) * x - np.sign(x) * a * l * T) / (a - 1.0 - T), slope
+        return x, 1.0
+    # the penalized objective is concave between l and a l: compare the minima below l and above a l
+    inner = min(max(magnitude - l * T, 0.0), l) * np.sign(x)
+    outer = max(magnitude, a * l) * np.sign(x)
+    if (outer - x) ** 2 / (2.0 * T) + __scad_penalty(outer, l, a) < \
+            (inner - x) ** 2 / (2.0 * T) + __scad_penalty(inner, l, a):
+        return outer, 1.0 if magnitude > a * l else 0.0
+    return inner, 1.0 if 0.0 < abs(inner) < l else 0.0
+
+
+@numba.njit(cache=True)
+def bernoulli_gauss(x, l, T, parameters):
+    """posterior mean of the Bernoulli-Gaussian prior and its derivative (posterior variance / T)"""
+    rho, sigma2 = parameters[0], parameters[1]
+    variance = sigma2 + T
+    # log odds of the Gaussian component against the zero component
+    log_odds = math.log(rho / (1.0 - rho)) + 0.5 * math.log(T / variance) + 0.5 * x * x * (1.0 / T - 1.0 / variance)
+    if log_odds > 0.0:
+        probability = 1.0 / (1.0 + math.exp(-log_odds))
+    else:
+        probability = math.exp(log_odds) / (1.0 + math.exp(log_odds))
+    mean = x * sigma2 / variance
+    posterior_variance = probability * sigma2 * T / variance + probability * (1.0 - probability) * mean * mean
+    return probability * mean, posterior_variance / T
+
+
+# name -> (function, names of the parameters, default parameters, sparse)
+REGISTRY = {
+    "soft_threshold": (soft_threshold, (), (), True),
+    "elastic_net": (elastic_net, ("ridge",), (1.0,), True),
+    "mcp": (mcp, ("gamma",), (3.0,), True),
+    "scad": (scad, ("a",), (3.7,), True),
+    "bernoulli_gauss": (bernoulli_gauss, ("rho", "sigma2"), (0.1, 1.0), False),
+}
+
+
+def register(name, function, parameter_names=(), default_parameters=(), sparse=False):
+    """register a denoiser
+
+    Args:
+        name: name of the denoiser
+        function: compiled function(x, l, T, parameters) -> (estimate, derivative), e.g. decorated by numba.njit
+        parameter_names: names of the parameters
+        default_parameters: default values of the parameters
+        sparse: whether the estimate is exactly zero on a range of x
+    """
+    if len(parameter_names) != len(default_parameters):
+        raise ValueError("{} parameter names for {} default parameters".format(len(parameter_names),
+                                                                               len(default_parameters)))
+    REGISTRY[name] = (function, tuple(parameter_names), tuple(default_parameters), sparse)
+
+
+def get(denoiser=None, **parameters):
+    """denoiser of a solver
+
+    Args:
+        denoiser: name of a registered denoiser, Denoiser, or None (soft thresholding)
+        parameters: parameters of the registered denoiser by name (the defaults of the registry otherwise)
+
+    Returns:
+        Denoiser
+    """
+    if isinstance(denoiser, Denoiser):
+        if parameters:
+            raise ValueError("parameters are given to a constructed denoiser")
+        return denoiser
+    if denoiser is None:
+        denoiser = "soft_threshold"
+    if denoiser not in REGISTRY:
+        raise ValueError("unknown denoiser: {}".format(denoiser))
+    function, names, defaults, sparse = REGISTRY[denoiser]
+    unknown = set(parameters) - set(names)
+    if unknown:
+        raise ValueError("unknown parameters of {}: {}".format(denoiser, ", ".join(sorted(unknown))))
+    return Denoiser(denoiser, function, [parameters.get(name, default) for name, default in zip(names, defaults)],
+                    sparse)
@@ -0,0 +1,314 @@
+# coding=utf-8
+"""seeded random matrix ensembles generated in blocks of rows
+
+an ensemble is an (M, N) matrix drawn from a numpy.random.SeedSequence, whose rows are generated block by block,
+so that A need not fit in memory: save writes the blocks into a .npy file, which the solvers memory-map
+(see utils.operators.MemmapOperator), and toarray collects them. the random rows of A are drawn in chunks of
+CHUNK_ROWS rows, each from its own child of the seed, so that A does not depend on the size of the blocks
+and any block is generated without the rows before it. the ensembles are
+
+    GaussEnsemble: i.i.d. N(0, 1 / N) entries
+    DCTEnsemble: M random rows of the orthonormal DCT-II matrix (the matrix of utils.operators.SubsampledDCTOperator)
+    HadamardEnsemble: M random rows of the Walsh-Hadamard matrix with random column signs
+                      (the matrix of utils.operators.RandomizedHadamardOperator)
+    OrthogonallyInvariantEnsemble: U diag(s) V.T with Haar distributed U and V and a given spectrum s
+
+independent reproducible problems of parallel workers are drawn from the children of one seed (see spawn).
+"""
+import math
+import os
+from concurrent import futures
+
+import numba
+import numpy as np
+
+from . import operators
+
+# rows of a chunk drawn from one child of the seed
+CHUNK_ROWS = 256
+
+# first entry of the spawn keys of the streams of an ensemble, apart from the children of spawn
+_STREAM = 0x656E73
+
+
+def seed_sequence(seed=None):
+    """seed sequence of a seed
+
+    Args:
+        seed: int, numpy.random.SeedSequence or None (fresh entropy)
+
+    Returns:
+        numpy.random.SeedSequence
+    """
+    return seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+
+
+def spawn(seed, n):
+    """independent seeds, e.g. of the problems of parallel workers
+
+    Args:
+        seed: int, numpy.random.SeedSequence or None
+        n: number of seeds
+
+    Returns:
+        list of n numpy.random.SeedSequence
+    """
+    return seed_sequence(seed).spawn(n)
+
+
+class Ensemble(object):
+    """ a random (M, N) matrix generated in blocks of rows """
+
+    def __init__(self, m, n, seed=None, dtype=np.float64):
+        """constructor
+
+        Args:
+            m: number of rows
+            n: number of columns
+            seed: int, numpy.random.SeedSequence or None (fresh entropy)
+            dtype: data type of the matrix
+        """
+        self.M, self.N = m, n
+        self.seed = seed_sequence(seed)
+        self.dtype = np.dtype(dtype)
+
+    @property
+    def shape(self):
+        return self.M, self.N
+
+    def generator(self, *key):
+        """numpy.random.Generator of a stream of the ensemble
+
+        Args:
+            key: ints identifying the stream
+
+        Returns:
+            numpy.random.Generator
+        """
+        return np.random.Generator(np.random.PCG64(np.random.SeedSequence(
+            self.seed.entropy, spawn_key=tuple(self.seed.spawn_key) + (_STREAM,) + key)))
+
+    def block(self, start, stop):
+        """rows of A
+
+        Args:
+            start: first row
+            stop: row after the last one
+
+        Returns:
+            array of shape (stop - start, N)
+        """
+        raise NotImplementedError
+
+    def blocks(self, block_rows=4 * CHUNK_ROWS):
+        """blocks of rows in order
+
+        Args:
+            block_rows: number of rows of a block
+
+        Returns:
+            generator of the slice of the rows and the block of shape (rows, N)
+        """
+        for start in range(0, self.M, block_rows):
+            rows = slice(start, min(start + block_rows, self.M))
+            yield rows, self.block(rows.start, rows.stop)
+
+    def toarray(self, block_rows=4 * CHUNK_ROWS):
+        """A in memory
+
+        Args:
+            block_rows: number of rows generated at once
+
+        Returns:
+            array of shape (M, N)
+        """
+        A = np.empty(self.shape, dtype=self.dtype)
+        for rows, block in self.blocks(block_rows):
+            A[rows] = block
+        return A
+
+    def save(self, path, block_rows=4 * CHUNK_ROWS):
+        """write A into a .npy file block by block
+
+        Args:
+            path: path of the .npy file
+            block_rows: number of rows generated at once
+
+        Returns:
+            path, which the solvers take as A (memory-mapped by utils.operators.MemmapOperator)
+        """
+        A = np.lib.format.open_memmap(path, mode="w+", dtype=self.dtype, shape=self.shape)
+        for rows, block in self.blocks(block_rows):
+            A[rows] = block
+        A.flush()
+        del A
+        return path
+
+
+class GaussEnsemble(Ensemble):
+    """ i.i.d. Gaussian entries of variance 1 / N (utils.make_gauss_matrix), the chunks of a block drawn in parallel """
+
+    def block(self, start, stop):
+        chunks = range(start // CHUNK_ROWS, (stop - 1) // CHUNK_ROWS + 1)
+        scale = self.dtype.type(1.0 / math.sqrt(self.N))
+        rows = np.empty((len(chunks) * CHUNK_ROWS, self.N), dtype=self.dtype)
+
+        def fill(i):
+            chunk = chunks[i]
+            n_rows = min(CHUNK_ROWS, self.M - chunk * CHUNK_ROWS)
+            self.generator(chunk).standard_normal((n_rows, self.N), dtype=self.dtype,
+                                                  out=rows[i * CHUNK_ROWS:i * CHUNK_ROWS + n_rows])
+
+        # the chunks are independent streams, and the generators release the GIL while they fill the rows
+        n_workers = min(len(chunks), os.cpu_count() or 1)
+        if n_workers > 1:
+            with futures.ThreadPoolExecutor(n_workers) as executor:
+                list(executor.map(fill, range(len(chunks))))
+        else:
+            for i in range(len(chunks)):
+                fill(i)
+        offset = start - chunks[0] * CHUNK_ROWS
+        block = rows[offset:offset + stop - start]
+        block *= scale
+        return block
+
+
+class DCTEnsemble(Ensemble):
+    """ M random rows of the orthonormal DCT-II matrix (utils.make_random_dct_matrix) """
+
+    def __init__(self, m, n, seed=None, dtype=np.float64):
+        super().__init__(m, n, seed, dtype)
+        self.rows = self.generator(0).permutation(n)[:m]  # indices of the selected rows
+        # cos(pi k (2 j + 1) / (2 N)) of the row k depends on k (2 j + 1) modulo 4 N only
+        self.table = np.cos(np.pi * np.arange(4 * n) / (2.0 * n))
+
+    def block(self, start, stop):
+        block = np.empty((stop - start, self.N), dtype=self.dtype)
+        _dct_rows(self.rows[start:stop], self.table, block)
+        return block
+
+    def operator(self):
+        """the same matrix applied by the fast cosine transform
+
+        Returns:
+            utils.operators.SubsampledDCTOperator
+        """
+        return operators.SubsampledDCTOperator(self.M, self.N, rows=self.rows, dtype=self.dtype)
+
+
+class HadamardEnsemble(Ensemble):
+    """ M random rows of the Walsh-Hadamard matrix with random column signs, P H D / sqrt(N) """
+
+    def __init__(self, m, n, seed=None, dtype=np.float64):
+        if n & (n - 1) != 0:
+            raise ValueError("the number of columns of a Hadamard matrix must be a power of two: {}".format(n))
+        super().__init__(m, n, seed, dtype)
+        self.rows = self.generator(0).permutation(n)[:m]  # indices of the selected rows
+        self.signs = self.generator(1).choice(np.array([-1.0, 1.0]), n)  # signs of the columns
+
+    def block(self, start, stop):
+        block = np.empty((stop - start, self.N), dtype=self.dtype)
+        _hadamard_rows(self.rows[start:stop], self.signs / math.sqrt(self.N), block)
+        return block
+
+    def operator(self):
+        """the same matrix applied by the fast Walsh-Hadamard transform
+
+        Returns:
+            utils.operators.RandomizedHadamardOperator
+        """
+        return operators.RandomizedHadamardOperator(self.M, self.N, rows=self.rows, signs=self.signs,
+                                                    dtype=self.dtype)
+
+
+class OrthogonallyInvariantEnsemble(Ensemble):
+    """ U diag(s) V.T with Haar distributed U of shape (M, K) and V of shape (N, K) and a given spectrum s
+
+    U and V are drawn once, in O((M + N) K^2) time and O((M + N) K) memory, and a block of rows costs O(rows N K).
+    """
+
+    def __init__(self, m, n, singular_values, seed=None, dtype=np.float64):
+        """constructor
+
+        Args:
+            m: number of rows
+            n: number of columns
+            singular_values: singular values of shape (K, ), K <= min(m, n) (see geometric_singular_values)
+            seed: int, numpy.random.SeedSequence or None (fresh entropy)
+            dtype: data type of the matrix
+        """
+        super().__init__(m, n, seed, dtype)
+        self.singular_values = np.asarray(singular_values, dtype=np.float64)
+        k = self.singular_values.shape[0]
+        if k > min(m, n):
+            raise ValueError("{} singular values of a ({}, {}) matrix".format(k, m, n))
+        self.U = _haar(self.generator(0), m, k) * self.singular_values
+        self.V = _haar(self.generator(1), n, k)
+
+    def block(self, start, stop):
+        return (self.U[start:stop] @ self.V.T).astype(self.dtype, copy=False)
+
+
+def geometric_singular_values(k, condition_number, m):
+    """singular values decaying geometrically from the largest to the smallest
+
+    Args:
+        k: number of singular values
+        condition_number: ratio of the largest to the smallest singular value
+        m: squared Frobenius norm of the matrix, e.g. M for the same norm as GaussEnsemble
+
+    Returns:
+        singular values of shape (k, )
+    """
+    s = np.power(float(condition_number), -np.arange(k) / max(k - 1, 1))
+    return s * np.sqrt(m / np.sum(np.square(s)))
+
+
+def _haar(rng, n, k):
+    """Haar distributed n x k matrix with orthonormal columns (QR of a Gaussian matrix with the signs fixed)"""
+    q, r = np.linalg.qr(rng.standard_normal((n, k)))
+    return q * np.sign(np.diag(r))
+
+
+@numba.njit(parallel=True, nogil=True, cache=True)
+def _dct_rows(rows, table, out):
+    """rows of the orthonormal DCT-II matrix
+
+    Args:
+        rows: indices k of the rows of shape (B, )
+        table: cos(pi m / (2 N)) for m < 4 N
+        out: output of shape (B, N)
+    """
+    B, N = out.shape
+    period = 4 * N
+    for b in numba.prange(B):
+        k = rows[b]
+        scale = math.sqrt(1.0 / N) if k == 0 else math.sqrt(2.0 / N)
+        step = 2 * k % period  # k (2 j + 1) advances by 2 k
+        m = k % period
+        for j in range(N):
+            out[b, j] = scale * table[m]
+            m += step
+            if m >= period:
+                m -= period
+
+
+@numba.njit(parallel=True, nogil=True, cache=True)
+def _hadamard_rows(rows, column_scale, out):
+    """rows of the Walsh-Hadamard matrix of Sylvester type, H[k, j] = (-1)^popcount(k & j), scaled per column
+
+    Args:
+        rows: indices k of the rows of shape (B, )
+        column_scale: scale of the columns of shape (N, )
+        out: output of shape (B, N)
+    """
+    B, N = out.shape
+    for b in numba.prange(B):
+        k = rows[b]
+        for j in range(N):
+            v = k & j
+            parity = 0
+            while v:
+                v &= v - 1
+                parity ^= 1
+            out[b, j] = -column_scale[j] if parity else column_scale[j]
@@ -0,0 +1,169 @@
+# coding=utf-8
+"""many independent solves on a thread pool
+
+a batch of tasks (A, y, regularization parameter, dumping coefficient) is solved by the workers of a thread pool.
+the matrix products (BLAS) and the compiled kernels release the GIL, so that the workers run concurrently,
+and the threads of the machine are split between the workers and the BLAS library of each product:
+a product of M x N elements is given about M N / ELEMENTS_PER_BLAS_THREAD threads,
+so that small problems run one solve per thread and large problems fewer solves with a multithreaded BLAS.
+the BLAS threads are limited through threadpoolctl (installed with scikit-learn; left as they are without it),
+and the threads of the compiled kernels of each worker are set by numba.set_num_threads.
+
+the workers of the pool require a thread safe threading layer of numba ("tbb" or "omp", see NUMBA_THREADING_LAYER),
+since the "workqueue" layer does not support launches from several threads at once.
+"""
+import os
+import threading
+import time
+from concurrent import futures
+
+import numba
+import numpy as np
+
+from . import kernels
+
+try:
+    import threadpoolctl
+except ImportError:  # installed with scikit-learn
+    threadpoolctl = None
+
+# elements of A per BLAS thread, below which a product gains little from another thread
+ELEMENTS_PER_BLAS_THREAD = 1 << 20
+
+# the solvers draw their initial messages from np.random, which a seeded batch reseeds for each task
+_random_lock = threading.Lock()
+
+
+class BatchResult(object):
+    """ estimates of a batch of solves and the throughput reached """
+
+    def __init__(self, estimates, converged, n_iterations, elapsed, n_workers, blas_threads):
+        """constructor
+
+        Args:
+            estimates: estimated signals in the order of the tasks
+            converged: convergence flags in the order of the tasks
+            n_iterations: numbers of iterations in the order of the tasks
+            elapsed: wall-clock time of the batch in seconds
+            n_workers: number of workers of the pool
+            blas_threads: number of BLAS threads of each worker
+        """
+        self.estimates = estimates
+        self.converged = converged
+        self.n_iterations = np.array(n_iterations)
+        self.elapsed = elapsed
+        self.n_workers = n_workers
+        self.blas_threads = blas_threads
+        self.throughput = len(estimates) / elapsed if elapsed > 0 else np.inf  # solves per second
+
+    def __repr__(self):
+        return "BatchResult(n_tasks={0}, throughput={1:.3g} solves/s, n_workers={2}, blas_threads={3})".format(
+            len(self.estimates), self.throughput, self.n_workers, self.blas_threads)
+
+
+def split_threads(n_threads, M, N, n_tasks):
+    """number of workers and of BLAS threads of each worker
+
+    Args:
+        n_threads: number of threads of the machine
+        M: number of rows of the largest A
+        N: number of columns of the largest A
+        n_tasks: number of tasks
+
+    Returns:
+        number of workers and number of BLAS threads of each worker
+    """
+    blas_threads = int(np.clip(M * N // ELEMENTS_PER_BLAS_THREAD, 1, n_threads))
+    n_workers = max(1, min(n_threads // blas_threads, n_tasks))
+    # the threads left by fewer tasks than workers go to the BLAS
+    return n_workers, max(1, n_threads // n_workers)
+
+
+def _shape(A):
+    """shape of an observation matrix of the solvers (array, sparse matrix, operator or path of a .npy file)"""
+    if isinstance(A, (str, os.PathLike)):
+        return np.load(A, mmap_mode="r").shape
+    return A.shape
+
+
+def _threading_layer():
+    """threading layer of the compiled kernels, which is chosen at the first launch of a kernel"""
+    try:
+        return numba.threading_layer()
+    except ValueError:
+        out = np.zeros((1, 1))
+        kernels.linear_combination(np.ones(1), out, np.ones(1), out, out)
+        return numba.threading_layer()
+
+
+def _solve(solver_class, task, solver_kwargs, max_iteration, tolerance, seed, kernel_threads):
+    """one task
+
+    Returns:
+        estimate, convergence flag and number of iterations
+    """
+    numba.set_num_threads(kernel_threads)  # of this worker thread only
+    A, y, l, dumping_coefficient = task
+    if seed is None:
+        solver = solver_class(A, y, l, dumping_coefficient, **solver_kwargs)
+    else:
+        with _random_lock:
+            np.random.seed(seed)
+            solver = solver_class(A, y, l, dumping_coefficient, **solver_kwargs)
+    estimate = solver.solve(max_iteration=max_iteration, tolerance=tolerance)
+    return estimate, solver.converged, solver.result.n_iterations
+
+
+def solve_batch(solver_class, tasks, n_workers=None, blas_threads=None, max_iteration=50, tolerance=1e-5,
+                solver_kwargs=None, seed=None):
+    """solve independent tasks on a thread pool
+
+    a matrix shared by many tasks is copied by each solver unless it is given as a utils.operators.LinearOperator
+    (e.g. utils.operators.DenseOperator(A)), which the solvers share.
+
+    Args:
+        solver_class: ampy solver class (e.g. ampy.AMPSolver.AMPSolver)
+        tasks: sequence of (A, y, regularization parameter, dumping coefficient)
+        n_workers: number of workers of the pool (chosen from the size of the largest A if None)
+        blas_threads: number of BLAS threads of each worker (the threads left by the workers if None)
+        max_iteration: maximum number of iterations of each solve
+        tolerance: stopping criterion of each solve
+        solver_kwargs: additional keyword arguments of the solver constructor (e.g. dtype)
+        seed: seed of np.random for the initial messages of the task i, seed + i
+              (the constructions are serialized then; the current random state is used if None)
+
+    Returns:
+        BatchResult
+    """
+    tasks = list(tasks)
+    solver_kwargs = {} if solver_kwargs is None else solver_kwargs
+    n_threads = os.cpu_count() or 1
+    shapes = [_shape(task[0]) for task in tasks]
+    M, N = (max(shape[i] for shape in shapes) for i in (0, 1)) if shapes else (0, 0)
+
+    if _threading_layer() == "workqueue":
+        if n_workers is not None and n_workers > 1:
+            raise ValueError("the workqueue threading layer of numba does not support several workers: "
+                             "set NUMBA_THREADING_LAYER to tbb or omp")
+        n_workers = 1
+    auto_workers, auto_blas_threads = split_threads(n_threads, M, N, max(len(tasks), 1))
+    if n_workers is None:
+        n_workers = auto_workers
+    if blas_threads is None:
+        blas_threads = auto_blas_threads if n_workers == auto_workers else max(1, n_threads // n_workers)
+    kernel_threads = int(min(blas_threads, numba.config.NUMBA_NUM_THREADS))
+
+    args = [(solver_class, task, solver_kwargs, max_iteration, tolerance, None if seed is None else seed + i,
+             kernel_threads) for i, task in enumerate(tasks)]
+    limits = threadpoolctl.threadpool_limits(blas_threads, user_api="blas") if threadpoolctl is not None else None
+    start = time.perf_counter()
+    try:
+        with futures.ThreadPoolExecutor(n_workers) as executor:
+            results = list(executor.map(lambda a: _solve(*a), args))  # in the order of the tasks
+    finally:
+        if limits is not None:
+            limits.restore_original_limits()
+    elapsed = time.perf_counter() - start
+
+    estimates, converged, n_iterations = ([r[i] for r in results] for i in range(3))
+    return BatchResult(estimates, converged, n_iterations, elapsed, n_workers, blas_threads)
@@ -0,0 +1,95 @@
+# coding=utf-8
+"""iterative solvers, stochastic estimators and randomized decompositions for the LMMSE part of VAMP"""
+import numpy as np
+
+
+def rademacher(shape, dtype=np.float64):
+    """random vectors with independent entries of +1 and -1
+
+    Args:
+        shape: shape of the vectors
+        dtype: data type
+
+    Returns:
+        array of the given shape
+    """
+    return (2 * np.random.binomial(1, 0.5, shape) - 1).astype(dtype)
+
+
+def conjugate_gradient(matvec, b, x0=None, preconditioner=None, tolerance=1e-6, max_iteration=None):
+    """preconditioned conjugate gradient for symmetric positive definite systems, column by column
+
+    all the columns of b are solved at once, so that each iteration calls matvec once on a block of vectors.
+    a column whose residual is small enough is not updated anymore.
+
+    Args:
+        matvec: function computing K @ x for x of shape (N, K)
+        b: right hand sides of shape (N, K)
+        x0: initial guess of shape (N, K) (zero if None)
+        preconditioner: inverse of the diagonal of the system, broadcastable to (N, K) (no preconditioning if None)
+        tolerance: relative tolerance of the residual norm of each column
+        max_iteration: maximum number of iterations (N if None)
+
+    Returns:
+        solution of shape (N, K) and the number of iterations
+    """
+    if max_iteration is None:
+        max_iteration = b.shape[0]
+
+    x = np.zeros_like(b) if x0 is None else np.array(x0, dtype=b.dtype)
+    residual = b - matvec(x) if x0 is not None else b.copy()
+    b_norm = np.sqrt(np.sum(np.square(b, dtype=np.float64), axis=0))
+    b_norm[b_norm == 0.0] = 1.0
+
+    z = residual if preconditioner is None else preconditioner * residual
+    p = z.copy()
+    rz = np.sum(residual * z, axis=0, dtype=np.float64)
+
+    iteration_index = 0
+    for iteration_index in range(max_iteration):
+        residual_norm = np.sqrt(np.sum(np.square(residual, dtype=np.float64), axis=0))
+        active = residual_norm > tolerance * b_norm
+        if not np.any(active):
+            break
+
+        Kp = matvec(p)
+        pKp = np.sum(p * Kp, axis=0, dtype=np.float64)
+        step = np.where(active & (pKp > 0.0), rz / np.where(pKp > 0.0, pKp, 1.0), 0.0).astype(b.dtype)
+        x += step * p
+        residual -= step * Kp
+
+        z = residual if preconditioner is None else preconditioner * residual
+        new_rz = np.sum(residual * z, axis=0, dtype=np.float64)
+        beta = np.where(rz > 0.0, new_rz / np.where(rz > 0.0, rz, 1.0), 0.0).astype(b.dtype)
+        p = z + beta * p
+        rz = new_rz
+    else:
+        iteration_index = max_iteration
+
+    return x, iteration_index
+
+
+def randomized_svd(A, rank, oversampling=10, n_power_iterations=2):
+    """truncated singular value decomposition from the products of A (Halko, Martinsson and Tropp)
+
+    Args:
+        A: matrix or utils.operators.LinearOperator of shape (M, N), used only as A @ x and A.T @ z
+        rank: number of singular values to be computed
+        oversampling: number of additional random vectors
+        n_power_iterations: number of power iterations, which sharpen the decay of the spectrum
+
+    Returns:
+        U of shape (M, rank), singular values of shape (rank, ) and VT of shape (rank, N)
+    """
+    M, N = A.shape
+    n_vectors = min(rank + oversampling, M, N)
+    dtype = getattr(A, "dtype", np.float64)
+
+    Q, _ = np.linalg.qr(A @ np.random.normal(0.0, 1.0, (N, n_vectors)).astype(dtype))
+    for _ in range(n_power_iterations):
+        Q, _ = np.linalg.qr(A.T @ Q)
+        Q, _ = np.linalg.qr(A @ Q)
+
+    # B = Q.T @ A of shape (n_vectors, N)
+    u, s, vh = np.linalg.svd((A.T @ Q).T, full_matrices=False)
+    return (Q @ u)[:, :rank], s[:rank], vh[:rank]
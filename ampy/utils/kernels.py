@@ -0,0 +1,399 @@
+# coding=utf-8
+"""fused element-wise kernels of the solvers
+
+the kernels are compiled in nopython mode and act on plain arrays of shape (L, B),
+where the B columns are independent observations or regularization parameters.
+the matrix products stay outside of the kernels (BLAS or the observation operator),
+and everything between two products is done in a single parallel pass over the rows.
+reductions over the rows (convergence norms, means) are accumulated per chunk of rows in float64.
+the kernels which call a denoiser (amp_update_r, sa_amp_update_r, vamp_update_x_hat_1 and denoise) are plain
+functions which call the global denoiser_function, and are compiled once per denoiser by with_denoiser,
+so that each denoiser is compiled into the pass and has its own cache file.
+the kernels release the GIL, so that solvers in several threads (see utils.executor) run them concurrently.
+"""
+import hashlib
+import marshal
+import re
+import threading
+import types
+
+import numba
+import numpy as np
+
+# number of chunks of rows for the column-wise reductions
+N_CHUNKS = 256
+
+# (kernel, name of the denoiser) -> (denoiser, kernel compiled with the denoiser)
+_compiled = {}
+_compiled_lock = threading.Lock()
+
+
+def as_columns(x):
+    """view of an array of shape (L, ) or (L, B) as (L, B)
+
+    Args:
+        x: array of shape (L, ) or (L, B)
+
+    Returns:
+        array of shape (L, B)
+    """
+    return x.reshape(x.shape[0], -1)
+
+
+def as_column_scalars(v, n_columns):
+    """per-column scalars as a float64 array
+
+    Args:
+        v: scalar, array of shape () or (B, )
+        n_columns: number of columns B
+
+    Returns:
+        array of shape (B, )
+    """
+    return np.ascontiguousarray(np.broadcast_to(np.asarray(v, dtype=np.float64), (n_columns,)))
+
+
+@numba.njit(parallel=True, nogil=True, cache=True)
+def amp_update_z(y, Ar, V_old, V, z, z_new, w, zw):
+    """Onsager corrected residual of AMP
+
+    z_new = y - A r + V_old / (1 + V_old) z, w = 1 / (1 + V) and zw = z_new * w
+
+    Args:
+        y: observed values of shape (M, B)
+        Ar: A @ r of shape (M, B)
+        V_old: V of the previous iteration of shape (M, B)
+        V: A2 @ chi of shape (M, B)
+        z: z of shape (M, B)
+        z_new: output of shape (M, B)
+        w: output of shape (M, B)
+        zw: output of shape (M, B)
+    """
+    M, B = z.shape
+    for i in numba.prange(M):
+        for b in range(B):
+            z_ib = y[i, b] - Ar[i, b] + V_old[i, b] / (1.0 + V_old[i, b]) * z[i, b]
+            w_ib = 1.0 / (1.0 + V[i, b])
+            z_new[i, b] = z_ib
+            w[i, b] = w_ib
+            zw[i, b] = z_ib * w_ib
+
+
+def amp_update_r(v1, v2, r, chi, l, d, R, T, r_new, chi_new, support, parameters):
+    """R, T, denoising and dumping of AMP
+
+    R = r + v1 / v2, T = 1 / v2, and the denoised r and chi = T * derivative of R are dumped.
+    support flags the rows whose denoised estimate is nonzero in some column (see utils.active_set).
+
+    Args:
+        v1: A.T @ (z / (1 + V)) of shape (N, B)
+        v2: A2.T @ (1 / (1 + V)) of shape (N, B)
+        r: estimator of shape (N, B)
+        chi: variance of shape (N, B)
+        l: regularization parameters of shape (B, )
+        d: dumping coefficient
+        R: output of shape (N, B)
+        T: output of shape (N, B)
+        r_new: output of shape (N, B)
+        chi_new: output of shape (N, B)
+        support: output of shape (N, )
+        parameters: parameters of the denoiser
+
+    Returns:
+        squared norm of r_new - r of shape (B, )
+    """
+    N, B = r.shape
+    n_chunks = min(N_CHUNKS, N)
+    partial = np.zeros((n_chunks, B))
+    for c in numba.prange(n_chunks):
+        for i in range(c * N // n_chunks, (c + 1) * N // n_chunks):
+            nonzero = False
+            for b in range(B):
+                T_ib = 1.0 / v2[i, b]
+                R_ib = r[i, b] + v1[i, b] * T_ib
+                estimate, derivative = denoiser_function(R_ib, l[b], T_ib, parameters)
+                r_ib = d * estimate + (1.0 - d) * r[i, b]
+                R[i, b] = R_ib
+                T[i, b] = T_ib
+                r_new[i, b] = r_ib
+                chi_new[i, b] = d * T_ib * derivative + (1.0 - d) * chi[i, b]
+                nonzero = nonzero or estimate != 0.0
+                diff = r_ib - r[i, b]
+                partial[c, b] += diff * diff
+            support[i] = nonzero
+    return partial.sum(axis=0)
+
+
+@numba.njit(parallel=True, nogil=True, cache=True)
+def sa_amp_update_z(y, Ar, V, z, z_new):
+    """Onsager corrected residual of self averaging AMP
+
+    z_new = y - A r + z V / (1 + V)
+
+    Args:
+        y: observed values of shape (M, B)
+        Ar: A @ r of shape (M, B)
+        V: V of the previous iteration of shape (B, )
+        z: z of shape (M, B)
+        z_new: output of shape (M, B)
+    """
+    M, B = z.shape
+    for i in numba.prange(M):
+        for b in range(B):
+            z_new[i, b] = y[i, b] - Ar[i, b] + z[i, b] * V[b] / (1.0 + V[b])
+
+
+def sa_amp_update_r(Atz, r, chi, l, T, alpha, d, R, r_new, chi_new, support, parameters):
+    """R, denoising and dumping of self averaging AMP
+
+    R = r + A.T z / alpha, and the denoised r and chi = T * derivative of R are dumped.
+    support flags the rows whose denoised estimate is nonzero in some column (see utils.active_set).
+
+    Args:
+        Atz: A.T @ z of shape (N, B)
+        r: estimator of shape (N, B)
+        chi: variance of shape (N, B)
+        l: regularization parameters of shape (B, )
+        T: T of shape (B, )
+        alpha: measurement ratio M / N
+        d: dumping coefficient
+        R: output of shape (N, B)
+        r_new: output of shape (N, B)
+        chi_new: output of shape (N, B)
+        support: output of shape (N, )
+        parameters: parameters of the denoiser
+
+    Returns:
+        squared norm of r_new - r of shape (B, )
+    """
+    N, B = r.shape
+    n_chunks = min(N_CHUNKS, N)
+    partial = np.zeros((n_chunks, B))
+    for c in numba.prange(n_chunks):
+        for i in range(c * N // n_chunks, (c + 1) * N // n_chunks):
+            nonzero = False
+            for b in range(B):
+                R_ib = r[i, b] + Atz[i, b] / alpha
+                estimate, derivative = denoiser_function(R_ib, l[b], T[b], parameters)
+                r_ib = d * estimate + (1.0 - d) * r[i, b]
+                R[i, b] = R_ib
+                r_new[i, b] = r_ib
+                chi_new[i, b] = d * T[b] * derivative + (1.0 - d) * chi[i, b]
+                nonzero = nonzero or estimate != 0.0
+                diff = r_ib - r[i, b]
+                partial[c, b] += diff * diff
+            support[i] = nonzero
+    return partial.sum(axis=0)
+
+
+def vamp_update_x_hat_1(r_1, l, T, x_hat_1, d, x_hat_1_new, parameters):
+    """denoiser of VAMP with dumping
+
+    Args:
+        r_1: r_1 of shape (N, B)
+        l: regularization parameters of shape (B, )
+        T: effective noise variance 1 / gamma_1 of shape (B, )
+        x_hat_1: x_hat_1 of shape (N, B)
+        d: dumping coefficient
+        x_hat_1_new: output of shape (N, B)
+        parameters: parameters of the denoiser
+
+    Returns:
+        alpha_1 (mean derivative of the denoiser) and squared norm of x_hat_1_new - x_hat_1, both of shape (B, )
+    """
+    N, B = r_1.shape
+    n_chunks = min(N_CHUNKS, N)
+    partial = np.zeros((n_chunks, B))
+    partial_derivative = np.zeros((n_chunks, B))
+    for c in numba.prange(n_chunks):
+        for i in range(c * N // n_chunks, (c + 1) * N // n_chunks):
+            for b in range(B):
+                estimate, derivative = denoiser_function(r_1[i, b], l[b], T[b], parameters)
+                x_ib = d * estimate + (1.0 - d) * x_hat_1[i, b]
+                x_hat_1_new[i, b] = x_ib
+                diff = x_ib - x_hat_1[i, b]
+                partial[c, b] += diff * diff
+                partial_derivative[c, b] += derivative
+    return partial_derivative.sum(axis=0) / N, partial.sum(axis=0)
+
+
+@numba.njit(parallel=True, nogil=True, cache=True)
+def vamp_lmmse_coefficients(s2, gamma_2, y_tilde, VTr_2, d, t):
+    """spectral coefficients of the LMMSE estimation of VAMP
+
+    d = s2 / (s2 + gamma_2) and t = d * (y_tilde - VT r_2), so that x_hat_2 = r_2 + V t
+
+    Args:
+        s2: squared singular values of shape (K, )
+        gamma_2: gamma_2 of shape (B, )
+        y_tilde: y_tilde of shape (K, B)
+        VTr_2: VT @ r_2 of shape (K, B)
+        d: output of shape (K, B)
+        t: output of shape (K, B)
+
+    Returns:
+        sum of d of shape (B, ), i.e. alpha_2 = 1 - sum(d) / N
+    """
+    K, B = t.shape
+    n_chunks = min(N_CHUNKS, K)
+    partial = np.zeros((n_chunks, B))
+    for c in numba.prange(n_chunks):
+        for i in range(c * K // n_chunks, (c + 1) * K // n_chunks):
+            for b in range(B):
+                d_ib = s2[i] / (s2[i] + gamma_2[b])
+                d[i, b] = d_ib
+                t[i, b] = d_ib * (y_tilde[i, b] - VTr_2[i, b])
+                partial[c, b] += d_ib
+    return partial.sum(axis=0)
+
+
+@numba.njit(parallel=True, nogil=True, cache=True)
+def linear_combination(c1, x1, c2, x2, out):
+    """out = c1 x1 - c2 x2 with per-column coefficients
+
+    Args:
+        c1: coefficients of shape (B, )
+        x1: array of shape (N, B)
+        c2: coefficients of shape (B, )
+        x2: array of shape (N, B)
+        out: output of shape (N, B)
+    """
+    N, B = out.shape
+    for i in numba.prange(N):
+        for b in range(B):
+            out[i, b] = c1[b] * x1[i, b] - c2[b] * x2[i, b]
+
+
+def combine(c1, x1, c2, x2):
+    """c1 x1 - c2 x2 with per-observation coefficients, by linear_combination
+
+    Args:
+        c1: coefficients of shape () or (B, )
+        x1: array of shape (N, ) or (N, B)
+        c2: coefficients of shape () or (B, )
+        x2: array of shape (N, ) or (N, B)
+
+    Returns:
+        c1 x1 - c2 x2
+    """
+    out = np.empty_like(x1)
+    n_columns = as_columns(out).shape[1]
+    linear_combination(as_column_scalars(c1, n_columns), as_columns(x1),
+                       as_column_scalars(c2, n_columns), as_columns(x2), as_columns(out))
+    return out
+
+
+def vamp_denoise(denoiser, r_1, l, gamma_1, x_hat_1, d):
+    """dumped x_hat_1 and alpha_1 of the VAMP solvers in one pass, by vamp_update_x_hat_1
+
+    Args:
+        denoiser: utils.denoisers.Denoiser
+        r_1: message of shape (N, ) or (N, B)
+        l: regularization parameters of shape () or (B, )
+        gamma_1: precisions of shape () or (B, )
+        x_hat_1: x_hat_1 of the previous iteration of shape (N, ) or (N, B)
+        d: dumping coefficient
+
+    Returns:
+        new x_hat_1, alpha_1 of shape (B, ) and squared norm of the change of x_hat_1 of shape (B, )
+    """
+    r_1_columns = as_columns(r_1)
+    n_columns = r_1_columns.shape[1]
+    x_hat_1_new = np.empty_like(x_hat_1)
+    alpha_1, squared_diff = denoiser.kernel(vamp_update_x_hat_1)(
+        r_1_columns, as_column_scalars(l, n_columns), as_column_scalars(1.0 / gamma_1, n_columns),
+        as_columns(x_hat_1), d, as_columns(x_hat_1_new), denoiser.parameters)
+    return x_hat_1_new, alpha_1, squared_diff
+
+
+def denoise(x, l, T, estimate, derivative, parameters):
+    """the denoiser applied to arrays
+
+    Args:
+        x: effective observations of shape (L, )
+        l: regularization parameters of shape (L, )
+        T: effective noise variances of shape (L, )
+        estimate: output of shape (L, )
+        derivative: output of shape (L, )
+        parameters: parameters of the denoiser
+    """
+    for i in numba.prange(x.shape[0]):
+        estimate[i], derivative[i] = denoiser_function(x[i], l[i], T[i], parameters)
+
+
+def with_denoiser(kernel, name, function):
+    """kernel compiled with a denoiser, memoized by the name of the denoiser
+
+    the denoiser is bound as the global denoiser_function of a copy of the kernel named after the denoiser
+    and the bytecode of the denoiser, so that the compiled kernel is cached on disk and loaded by later processes.
+    (a closure over the denoiser or the denoiser as an argument would put the compiled denoiser into the key
+    of the cache, which differs between processes, so that every process would compile the kernel again.)
+    the cache of numba checks only the source file of the kernel, and the denoiser and the functions it calls
+    are compiled into the kernel, so that the name also hashes the bytecode of the functions the denoiser refers to
+    (e.g. soft_threshold in elastic_net), recursively, and the values of its globals and closure (see _fingerprint).
+
+    Args:
+        kernel: amp_update_r, sa_amp_update_r, vamp_update_x_hat_1 or denoise
+        name: name of the denoiser
+        function: compiled function(x, l, T, parameters) -> (estimate, derivative) of utils.denoisers
+
+    Returns:
+        compiled kernel, which takes the parameters of the denoiser as its last argument
+    """
+    key = (kernel.__name__, name)
+    with _compiled_lock:
+        if key not in _compiled or _compiled[key][0] is not function:
+            code = _fingerprint(function, set())
+            py_func = types.FunctionType(kernel.__code__, dict(kernel.__globals__, denoiser_function=function),
+                                         kernel.__name__)
+            py_func.__qualname__ = "{}_{}_{}".format(kernel.__name__, re.sub(r"\W", "_", name),
+                                                     hashlib.sha256(code).hexdigest()[:16])
+            py_func.__doc__ = kernel.__doc__
+            _compiled[key] = function, numba.njit(parallel=True, nogil=True, cache=True)(py_func)
+        return _compiled[key][1]
+
+
+def _fingerprint(function, seen):
+    """bytes of the code of a function, of the functions it refers to and of the values of its globals and closure
+
+    Args:
+        function: python function or numba dispatcher
+        seen: ids of the functions already hashed (to stop at recursive references)
+
+    Returns:
+        bytes
+    """
+    py_func = getattr(function, "py_func", function)
+    if id(py_func) in seen:
+        return b""
+    seen.add(id(py_func))
+    parts = [marshal.dumps(py_func.__code__)]
+    for name in sorted(_global_names(py_func.__code__)):
+        if name in py_func.__globals__:
+            parts.append(name.encode() + b"=" + _value_fingerprint(py_func.__globals__[name], seen))
+    for cell in py_func.__closure__ or ():
+        try:
+            parts.append(_value_fingerprint(cell.cell_contents, seen))
+        except ValueError:  # empty cell
+            parts.append(b"")
+    return b";".join(parts)
+
+
+def _global_names(code):
+    """names of the globals and attributes referred to by a code object and the code objects nested in it"""
+    names = set(code.co_names)
+    for constant in code.co_consts:
+        if isinstance(constant, types.CodeType):
+            names |= _global_names(constant)
+    return names
+
+
+def _value_fingerprint(value, seen):
+    """bytes of a value referred to by a compiled function (which numba freezes at compilation)"""
+    if isinstance(value, types.FunctionType) or hasattr(value, "py_func"):
+        return _fingerprint(value, seen)
+    if isinstance(value, types.ModuleType):
+        return value.__name__.encode()
+    if isinstance(value, np.ndarray):
+        return str((value.dtype, value.shape)).encode() + value.tobytes()
+    return repr(value).encode()
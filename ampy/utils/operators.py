@@ -0,0 +1,478 @@
+# coding=utf-8
+"""observation matrices of the solvers behind a common operator protocol
+
+the solvers take A through aslinearoperator, which wraps it by a LinearOperator: A @ x, A.T @ z and the products
+of the element-wise square A2 = A * A (A.squared() @ x, A.squared().T @ z), the singular values and, if needed,
+the dense matrix and the Gram matrix. the adapters are
+
+    DenseOperator: numpy array, whose square is computed once on first use
+    SparseOperator: scipy.sparse matrix
+    MemmapOperator: memory-mapped .npy file, read in blocks of rows (streaming), with the next block prefetched
+
+and the matrix-free operators SubsampledDCTOperator and RandomizedHadamardOperator apply the rows of a transform
+in O(N log N) without storing A, and their squared products by the same transforms. they are row orthogonal
+(A @ A.T proportional to the identity), so that the VAMP solvers need no decomposition of them.
+unwrap returns the operator behind a proxy of it (e.g. the counting proxies of utils.profiler).
+"""
+import os
+from concurrent import futures
+
+import numpy as np
+from scipy import fft
+from scipy import sparse
+
+
+class LinearOperator(object):
+    """ observation matrix given implicitly by its products
+
+    subclasses implement matvec, rmatvec, squared_matvec and squared_rmatvec.
+    A @ x, A.T @ z and (A * A) @ x, (A * A).T @ z of a dense matrix are written as
+    A @ x, A.T @ z, A.squared() @ x and A.squared().T @ z with an operator, so that the solvers accept both.
+    """
+
+    # True if A @ A.T is proportional to the identity matrix
+    row_orthogonal = False
+
+    # True if the rows are read in blocks (see MemmapOperator.blocks),
+    # in which case the AMP solvers fuse the products of an iteration into one pass over the blocks
+    streaming = False
+
+    def __init__(self, shape, dtype=np.float64):
+        """constructor
+
+        Args:
+            shape: shape (M, N) of the operator
+            dtype: data type of the operator
+        """
+        self.shape = tuple(shape)
+        self.M, self.N = self.shape
+        self.dtype = np.dtype(dtype)
+
+    def matvec(self, x):
+        """A @ x
+
+        Args:
+            x: array of shape (N, ) or (N, B)
+
+        Returns:
+            array of shape (M, ) or (M, B)
+        """
+        raise NotImplementedError
+
+    def rmatvec(self, z):
+        """A.T @ z
+
+        Args:
+            z: array of shape (M, ) or (M, B)
+
+        Returns:
+            array of shape (N, ) or (N, B)
+        """
+        raise NotImplementedError
+
+    def squared_matvec(self, x):
+        """(A * A) @ x
+
+        Args:
+            x: array of shape (N, ) or (N, B)
+
+        Returns:
+            array of shape (M, ) or (M, B)
+        """
+        raise NotImplementedError
+
+    def squared_rmatvec(self, z):
+        """(A * A).T @ z
+
+        Args:
+            z: array of shape (M, ) or (M, B)
+
+        Returns:
+            array of shape (N, ) or (N, B)
+        """
+        raise NotImplementedError
+
+    def singular_values(self):
+        """singular values known analytically
+
+        Returns:
+            singular values of shape (min(M, N), ), or None if they are not known
+        """
+        return None
+
+    def toarray(self):
+        """dense matrix of the operator
+
+        Returns:
+            array of shape (M, N)
+        """
+        return self.matvec(np.eye(self.N, dtype=self.dtype))
+
+    def gram(self):
+        """dense Gram matrix A.T @ A
+
+        Returns:
+            array of shape (N, N)
+        """
+        return self.rmatvec(self.toarray())
+
+    def squared(self):
+        """operator of the element-wise squared matrix
+
+        Returns:
+            operator whose products are squared_matvec and squared_rmatvec
+        """
+        return _SquaredOperator(self)
+
+    @property
+    def T(self):
+        return _TransposedOperator(self)
+
+    def __matmul__(self, x):
+        return self.matvec(x)
+
+
+class _TransposedOperator(object):
+    """ transpose of an operator, only used as A.T @ z """
+
+    def __init__(self, operator):
+        self.operator = operator
+        self.shape = operator.shape[::-1]
+
+    def __matmul__(self, z):
+        return self.operator.rmatvec(z)
+
+
+class _SquaredOperator(LinearOperator):
+    """ element-wise squared operator """
+
+    def __init__(self, operator):
+        super(_SquaredOperator, self).__init__(operator.shape, operator.dtype)
+        self.operator = operator
+
+    def matvec(self, x):
+        return self.operator.squared_matvec(x)
+
+    def rmatvec(self, z):
+        return self.operator.squared_rmatvec(z)
+
+
+class SubsampledDCTOperator(LinearOperator):
+    """ rows of the orthonormal discrete cosine transform (DCT-II) matrix
+
+    the same matrix as utils.make_random_dct_matrix, applied in O(N log N) by the fast cosine transform.
+    """
+
+    row_orthogonal = True
+
+    def __init__(self, m, n, rows=None, dtype=np.float64):
+        """constructor
+
+        Args:
+            m: number of rows
+            n: size of the dct matrix
+            rows: indices of the selected rows of shape (m, ) (drawn at random if None)
+            dtype: data type of the operator
+        """
+        super(SubsampledDCTOperator, self).__init__((m, n), dtype)
+        if rows is None:
+            rows = np.random.permutation(n)[:m]
+        self.rows = np.asarray(rows)
+
+        # the squared rows are (1 + cos(2 theta)) / n, i.e. the dct at the doubled frequencies 2 * rows,
+        # which is folded back to 2 * n - 2 * rows with the opposite sign above n
+        frequency = 2 * self.rows
+        self.squared_frequency = np.where(frequency < n, frequency, 2 * n - frequency)
+        self.squared_sign = np.where(frequency < n, 1.0, -1.0).astype(self.dtype)
+        self.squared_sign[(self.rows == 0) | (frequency == n)] = 0.0
+        self.squared_frequency[frequency == n] = 0
+
+    def matvec(self, x):
+        return fft.dct(x, type=2, norm="ortho", axis=0)[self.rows]
+
+    def rmatvec(self, z):
+        full = np.zeros((self.N,) + z.shape[1:], dtype=np.result_type(z, self.dtype))
+        full[self.rows] = z
+        return fft.idct(full, type=2, norm="ortho", axis=0)
+
+    def squared_matvec(self, x):
+        total = x.sum(axis=0)
+        c = fft.dct(x, type=2, axis=0)  # 2 * sum_j x_j cos(pi k (2j + 1) / 2n)
+        sign = self.squared_sign.reshape((-1,) + (1,) * (x.ndim - 1))
+        return (total + 0.5 * sign * c[self.squared_frequency]) / self.N
+
+    def squared_rmatvec(self, z):
+        sign = self.squared_sign.reshape((-1,) + (1,) * (z.ndim - 1))
+        u = np.zeros((self.N,) + z.shape[1:], dtype=np.result_type(z, self.dtype))
+        np.add.at(u, self.squared_frequency, sign * z)
+        # dct-iii gives u_0 + 2 sum_k u_k cos(pi k (2j + 1) / 2n) and u_0 is always zero
+        return (z.sum(axis=0) + 0.5 * fft.dct(u, type=3, axis=0)) / self.N
+
+    def singular_values(self):
+        return np.ones(self.M)
+
+
+class RandomizedHadamardOperator(LinearOperator):
+    """ randomized Walsh-Hadamard transform P H D / sqrt(N)
+
+    D flips the signs of the columns at random, H is the (N, N) Hadamard matrix of Sylvester type
+    and P selects M rows at random. N must be a power of two.
+    """
+
+    row_orthogonal = True
+
+    def __init__(self, m, n, rows=None, signs=None, dtype=np.float64):
+        """constructor
+
+        Args:
+            m: number of rows
+            n: size of the Hadamard matrix (a power of two)
+            rows: indices of the selected rows of shape (m, ) (drawn at random if None)
+            signs: signs of the columns of shape (n, ) (drawn at random if None)
+            dtype: data type of the operator
+        """
+        if n & (n - 1) != 0:
+            raise ValueError("n must be a power of two, got {0}".format(n))
+        super(RandomizedHadamardOperator, self).__init__((m, n), dtype)
+        if rows is None:
+            rows = np.random.permutation(n)[:m]
+        if signs is None:
+            signs = 2.0 * np.random.binomial(1, 0.5, n) - 1.0
+        self.rows = np.asarray(rows)
+        self.signs = np.asarray(signs, dtype=self.dtype)
+
+    def __fwht(self, x):
+        """orthonormal fast Walsh-Hadamard transform along the first axis
+
+        Args:
+            x: array of shape (N, ) or (N, B)
+
+        Returns:
+            H @ x / sqrt(N)
+        """
+        batch_shape = x.shape[1:]
+        y = x.reshape((1, self.N, -1))
+        h = self.N
+        while h > 1:
+            h //= 2
+            y = y.reshape((-1, 2, h, y.shape[-1]))
+            y = np.stack((y[:, 0] + y[:, 1], y[:, 0] - y[:, 1]), axis=1)
+        return y.reshape((self.N,) + batch_shape) / np.sqrt(self.N)
+
+    def matvec(self, x):
+        signs = self.signs.reshape((-1,) + (1,) * (x.ndim - 1))
+        return self.__fwht(signs * x)[self.rows]
+
+    def rmatvec(self, z):
+        full = np.zeros((self.N,) + z.shape[1:], dtype=np.result_type(z, self.dtype))
+        full[self.rows] = z
+        signs = self.signs.reshape((-1,) + (1,) * (z.ndim - 1))
+        return signs * self.__fwht(full)
+
+    def squared_matvec(self, x):
+        return np.broadcast_to(x.sum(axis=0) / self.N, (self.M,) + x.shape[1:]).copy()
+
+    def squared_rmatvec(self, z):
+        return np.broadcast_to(z.sum(axis=0) / self.N, (self.N,) + z.shape[1:]).copy()
+
+    def singular_values(self):
+        return np.ones(self.M)
+
+
+class DenseOperator(LinearOperator):
+    """ adapter of a dense numpy array """
+
+    def __init__(self, A):
+        """constructor
+
+        Args:
+            A: observation matrix of shape (M, N), stored without copy
+        """
+        super(DenseOperator, self).__init__(A.shape, A.dtype)
+        self.A = A
+        self.A2 = None  # A squared, computed at the first squared product
+
+    def matvec(self, x):
+        return self.A @ x
+
+    def rmatvec(self, z):
+        return self.A.T @ z
+
+    def squared_matvec(self, x):
+        return self.__squared() @ x
+
+    def squared_rmatvec(self, z):
+        return self.__squared().T @ z
+
+    def __squared(self):
+        if self.A2 is None:
+            self.A2 = self.A * self.A
+        return self.A2
+
+    def toarray(self):
+        return self.A
+
+    def gram(self):
+        return self.A.T @ self.A
+
+
+class SparseOperator(LinearOperator):
+    """ adapter of a scipy.sparse matrix, stored in CSR or CSC format """
+
+    def __init__(self, A, dtype=None):
+        """constructor
+
+        Args:
+            A: scipy.sparse matrix of shape (M, N)
+            dtype: data type of the stored matrix (that of A if None)
+        """
+        dtype = A.dtype if dtype is None else dtype
+        super(SparseOperator, self).__init__(A.shape, dtype)
+        self.A = A if A.format in ("csr", "csc") else A.tocsr()
+        if self.A.dtype != self.dtype:
+            self.A = self.A.astype(self.dtype)
+        self.A2 = None  # A squared, which has the same sparsity pattern as A
+
+    def matvec(self, x):
+        return self.A @ x
+
+    def rmatvec(self, z):
+        return self.A.T @ z
+
+    def squared_matvec(self, x):
+        return self.__squared() @ x
+
+    def squared_rmatvec(self, z):
+        return self.__squared().T @ z
+
+    def __squared(self):
+        if self.A2 is None:
+            self.A2 = self.A.multiply(self.A).asformat(self.A.format)
+        return self.A2
+
+    def toarray(self):
+        return self.A.toarray()
+
+    def gram(self):
+        return (self.A.T @ self.A).toarray()
+
+
+class MemmapOperator(LinearOperator):
+    """ adapter of a memory-mapped .npy file
+
+    the rows are read in blocks, so that only two blocks of A are resident in memory at a time.
+    the squared products are computed block by block instead of storing A squared.
+    with prefetch, the next block is read from the file by a background thread
+    while the products of the current block are computed.
+    """
+
+    streaming = True
+
+    def __init__(self, A, block_rows=1024, dtype=None, prefetch=True):
+        """constructor
+
+        Args:
+            A: path of a .npy file or np.memmap of shape (M, N)
+            block_rows: number of rows read at once
+            dtype: data type of the products, to which each block is cast (that of the file if None)
+            prefetch: whether the next block is read by a background thread
+        """
+        if not isinstance(A, np.ndarray):
+            A = np.load(A, mmap_mode="r")
+        super(MemmapOperator, self).__init__(A.shape, A.dtype if dtype is None else dtype)
+        self.A = A
+        self.block_rows = block_rows
+        self.prefetch = prefetch
+
+    def __read(self, start):
+        """read a block of rows into memory
+
+        Args:
+            start: index of the first row
+
+        Returns:
+            slice of the rows and the block of shape (rows, N)
+        """
+        rows = slice(start, min(start + self.block_rows, self.M))
+        # copied, so that the file is read here and not at the first product of the block
+        return rows, np.array(self.A[rows], dtype=self.dtype)
+
+    def blocks(self):
+        """blocks of rows in order, read ahead by a background thread with prefetch
+
+        Yields:
+            slice of the rows and the block of shape (rows, N)
+        """
+        starts = range(0, self.M, self.block_rows)
+        if not self.prefetch:
+            for start in starts:
+                yield self.__read(start)
+            return
+        with futures.ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(self.__read, starts[0])
+            for start in starts[1:]:
+                block = future.result()
+                future = executor.submit(self.__read, start)
+                yield block
+            yield future.result()
+
+    def matvec(self, x):
+        return np.concatenate([block @ x for rows, block in self.blocks()], axis=0)
+
+    def rmatvec(self, z):
+        result = np.zeros((self.N,) + z.shape[1:], dtype=np.result_type(z, self.dtype))
+        for rows, block in self.blocks():
+            result += block.T @ z[rows]
+        return result
+
+    def squared_matvec(self, x):
+        return np.concatenate([np.square(block) @ x for rows, block in self.blocks()], axis=0)
+
+    def squared_rmatvec(self, z):
+        result = np.zeros((self.N,) + z.shape[1:], dtype=np.result_type(z, self.dtype))
+        for rows, block in self.blocks():
+            result += np.square(block).T @ z[rows]
+        return result
+
+    def toarray(self):
+        return np.asarray(self.A, dtype=self.dtype)
+
+    def gram(self):
+        result = np.zeros((self.N, self.N), dtype=self.dtype)
+        for rows, block in self.blocks():
+            result += block.T @ block
+        return result
+
+
+def aslinearoperator(A, dtype=None):
+    """wrap an observation matrix by the operator protocol used by the solvers
+
+    Args:
+        A: LinearOperator, numpy array (copied), np.memmap, scipy.sparse matrix or path of a .npy file
+        dtype: data type in which the matrix is stored and the products are computed
+               (that of A if None, ignored for a LinearOperator)
+
+    Returns:
+        LinearOperator
+    """
+    if isinstance(A, LinearOperator):
+        return A
+    if sparse.issparse(A):
+        return SparseOperator(A, dtype=dtype)
+    if isinstance(A, (str, os.PathLike, np.memmap)):
+        return MemmapOperator(A, dtype=dtype)
+    return DenseOperator(np.array(A, dtype=dtype))
+
+
+def unwrap(A):
+    """the operator behind the proxies of it (e.g. of utils.profiler), which refer to it by __wrapped__
+
+    Args:
+        A: operator or a proxy of it
+
+    Returns:
+        operator
+    """
+    while hasattr(A, "__wrapped__"):
+        A = A.__wrapped__
+    return A
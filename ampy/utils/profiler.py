@@ -0,0 +1,345 @@
+# coding=utf-8
+"""opt-in profiler of the update steps of a solver
+
+profile(solver) replaces, on that instance only, the private step methods (__update, __update_x_hat_2, ...)
+of the class and of its bases with timed wrappers, the observation matrix, its dense copy and the decomposition
+(A, A2, A_dense, U, V, VT) with counting proxies and the products of the active set (utils.active_set)
+with counting wrappers. the reduced solvers of a screened path (utils.regularization_path) are instrumented
+in the same way. a solver which is not profiled is not modified, so that profiling costs nothing when disabled.
+the proxies set __wrapped__, which utils.operators.unwrap follows to the matrix.
+
+for each step and each product the profiler records the number of calls, the wall-clock time
+(inclusive and exclusive of the nested steps), the number of matrix-vector and matrix-matrix products
+and the bytes allocated, i.e. the peak of the memory traced by tracemalloc during the call above that at its start,
+and the same totals for each iteration. tracemalloc sees the allocations of numpy and of python,
+not those of the numba kernels, and slows the allocations down (see Profiler(trace_memory=False)).
+the products of the row blocks of a streaming operator are timed in their step but not counted.
+an iteration starts at each call of the first update step of the solver.
+"""
+import collections
+import csv
+import time
+import tracemalloc
+import types
+
+import numpy as np
+
+# attributes of the solvers holding the operators and the singular vectors whose products are counted
+OPERATOR_ATTRIBUTES = ("A", "A2", "A_dense")
+DECOMPOSITION_ATTRIBUTES = ("U", "V", "VT")
+
+# columns of the flat profile
+COLUMNS = ("name", "calls", "time", "self_time", "matvec", "matmat", "allocated")
+
+
+class _Record(object):
+    """ totals of a step or a product """
+
+    def __init__(self):
+        self.calls = 0
+        self.time = 0.0
+        self.self_time = 0.0
+        self.matvec = 0
+        self.matmat = 0
+        self.allocated = 0
+
+
+class _ProfiledMatrix(object):
+    """ proxy of a matrix or a utils.operators.LinearOperator counting its products """
+
+    # numpy defers x @ proxy to __rmatmul__ instead of converting the proxy to an array
+    __array_ufunc__ = None
+
+    def __init__(self, matrix, name, profiler):
+        self.matrix = matrix
+        self.name = name
+        self.profiler = profiler
+
+    @property
+    def __wrapped__(self):
+        return self.matrix
+
+    def __matmul__(self, x):
+        self.profiler.enter(self.name + " @")
+        result = None
+        try:
+            result = self.matrix @ x
+        finally:
+            self.profiler.exit(result, product=int(np.prod(np.shape(x)[1:])))
+        return result
+
+    def __rmatmul__(self, x):
+        # each row of x is multiplied by the matrix
+        self.profiler.enter("@ " + self.name)
+        result = None
+        try:
+            result = x @ self.matrix
+        finally:
+            self.profiler.exit(result, product=int(np.prod(np.shape(x)[:-1])))
+        return result
+
+    def __mul__(self, x):
+        return self.matrix * x
+
+    def __truediv__(self, x):
+        return self.matrix / x
+
+    @property
+    def T(self):
+        return _ProfiledMatrix(self.matrix.T, self.name + ".T", self.profiler)
+
+    def squared(self):
+        return _ProfiledMatrix(self.matrix.squared(), self.name + "2", self.profiler)
+
+    def __getattr__(self, name):
+        return getattr(self.matrix, name)
+
+
+class Profiler(object):
+    """ wall-clock time, products and allocations of the steps of a solver """
+
+    def __init__(self, trace_memory=True):
+        """constructor
+
+        Args:
+            trace_memory: whether the allocations are measured with tracemalloc (zero if False)
+        """
+        self.trace_memory = trace_memory
+        self.steps = collections.OrderedDict()  # name -> totals, in the order of the first call
+        self.iteration_step = None  # name of the step which starts an iteration
+
+        # totals of each iteration
+        self.iteration_time = []
+        self.iteration_matvec = []
+        self.iteration_matmat = []
+        self.iteration_allocated = []
+
+        # [name, start time, time of the nested steps, traced memory at the start, peak traced memory]
+        # of the running steps
+        self.__stack = []
+        # [start time, matvec, matmat, traced memory at the start, peak traced memory] of the running iteration
+        self.__iteration = None
+        self.__solver = None
+        self.__patched = []
+        self.__started_tracing = False
+
+    def attach(self, solver):
+        """instrument the steps and the matrices of a solver
+
+        Args:
+            solver: solver instance (the other instances of the class are not modified)
+        """
+        self.detach()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.__started_tracing = True
+        self.__solver = solver
+        self.__patched = self.instrument(solver)
+
+    def instrument(self, solver):
+        """instrument the steps and the matrices of a solver for this profiler without attaching it,
+        e.g. a reduced solver of a screened path
+
+        Args:
+            solver: solver instance
+
+        Returns:
+            names of the instrumented attributes
+        """
+        patched = []
+        # the private methods of the class and of its bases (e.g. utils.regularization_path.RegularizationPath)
+        for cls in type(solver).__mro__[:-1]:
+            prefix = "_" + cls.__name__ + "__"
+            for attribute, value in vars(cls).items():
+                if not isinstance(value, types.FunctionType) or attribute in patched:
+                    continue
+                if attribute.startswith(prefix):
+                    name = attribute[len(prefix):]
+                elif attribute in ("solve", "solve_path") or (attribute.startswith("_") and
+                                                               not attribute.startswith("__")):
+                    name = attribute.lstrip("_")
+                else:
+                    continue
+                setattr(solver, attribute, self.__wrap(getattr(solver, attribute), name))
+                patched.append(attribute)
+        matrices = OPERATOR_ATTRIBUTES
+        if getattr(solver, "VT", None) is not None:
+            matrices += DECOMPOSITION_ATTRIBUTES  # V is a message of the AMP solvers
+        for attribute in matrices:
+            matrix = getattr(solver, attribute, None)
+            if matrix is not None:
+                setattr(solver, attribute, _ProfiledMatrix(matrix, attribute, self))
+                patched.append(attribute)
+        active_set = getattr(solver, "active_set", None)
+        if active_set is not None:
+            active_set.matvec = self.__wrap_active_set(active_set.matvec)
+        solver.profiler = self
+        return patched
+
+    def detach(self):
+        """restore the solver (the records are kept)"""
+        if self.__started_tracing:
+            tracemalloc.stop()
+            self.__started_tracing = False
+        if self.__solver is None:
+            return
+        for attribute in self.__patched:
+            value = getattr(self.__solver, attribute)
+            if isinstance(value, _ProfiledMatrix):
+                setattr(self.__solver, attribute, value.matrix)
+            elif attribute not in OPERATOR_ATTRIBUTES + DECOMPOSITION_ATTRIBUTES:
+                delattr(self.__solver, attribute)
+        active_set = getattr(self.__solver, "active_set", None)
+        if active_set is not None:
+            del active_set.matvec
+        self.__solver.profiler = None
+        self.__solver = None
+        self.__patched = []
+
+    def __wrap(self, method, name):
+        def wrapper(*args, **kwargs):
+            self.enter(name)
+            result = None
+            try:
+                result = method(*args, **kwargs)
+            finally:
+                self.exit(result)
+            return result
+        return wrapper
+
+    def __wrap_active_set(self, matvec):
+        # the products over the active columns are counted as products of A and A2
+        def wrapper(x, squared=False):
+            self.enter("A2 @" if squared else "A @")
+            result = None
+            try:
+                result = matvec(x, squared)
+            finally:
+                self.exit(result, product=int(np.prod(np.shape(x)[1:])))
+            return result
+        return wrapper
+
+    def __traced_memory(self):
+        """current and peak traced memory since the last reset (zeros if not tracing)"""
+        if not tracemalloc.is_tracing():
+            return 0, 0
+        return tracemalloc.get_traced_memory()
+
+    def enter(self, name):
+        """start a step
+
+        Args:
+            name: name of the step
+        """
+        current, peak = self.__traced_memory()
+        if self.__stack:
+            self.__stack[-1][4] = max(self.__stack[-1][4], peak)
+        if self.iteration_step is None and name.startswith("update"):
+            self.iteration_step = name
+        if name == self.iteration_step:
+            self.__end_iteration()
+            self.__iteration = [time.perf_counter(), 0, 0, current, current]
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        self.__stack.append([name, time.perf_counter(), 0.0, current, current])
+
+    def exit(self, result, product=None):
+        """end the running step
+
+        Args:
+            result: value returned by the step
+            product: number of columns of the right operand of a product (None for a step)
+        """
+        name, start, nested_time, start_memory, peak = self.__stack.pop()
+        elapsed = time.perf_counter() - start
+        peak = max(peak, self.__traced_memory()[1])
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        record = self.steps.get(name)
+        if record is None:
+            record = self.steps[name] = _Record()
+        record.calls += 1
+        record.time += elapsed
+        record.self_time += elapsed - nested_time
+        record.allocated += max(peak - start_memory, 0)
+        if self.__stack:
+            self.__stack[-1][2] += elapsed
+            self.__stack[-1][4] = max(self.__stack[-1][4], peak)
+
+        matvec, matmat = product == 1, product is not None and product > 1
+        if product is not None:
+            record.matvec += matvec
+            record.matmat += matmat
+            # the product is also counted for the step which called it
+            for step in reversed(self.__stack):
+                if "@" not in step[0]:
+                    self.steps.setdefault(step[0], _Record())
+                    self.steps[step[0]].matvec += matvec
+                    self.steps[step[0]].matmat += matmat
+                    break
+        if self.__iteration is not None:
+            self.__iteration[1] += matvec
+            self.__iteration[2] += matmat
+            self.__iteration[4] = max(self.__iteration[4], peak)
+        if not self.__stack:
+            self.__end_iteration()
+
+    def __end_iteration(self):
+        if self.__iteration is None:
+            return
+        start, matvec, matmat, start_memory, peak = self.__iteration
+        if self.__stack:
+            peak = max(peak, self.__traced_memory()[1])
+        self.iteration_time.append(time.perf_counter() - start)
+        self.iteration_matvec.append(matvec)
+        self.iteration_matmat.append(matmat)
+        self.iteration_allocated.append(max(peak - start_memory, 0))
+        self.__iteration = None
+
+    def flat(self):
+        """flat profile
+
+        Returns:
+            list of dicts with the keys COLUMNS, sorted by the exclusive time
+        """
+        rows = [{"name": name, "calls": record.calls, "time": record.time, "self_time": record.self_time,
+                 "matvec": record.matvec, "matmat": record.matmat, "allocated": record.allocated}
+                for name, record in self.steps.items()]
+        return sorted(rows, key=lambda row: row["self_time"], reverse=True)
+
+    def save(self, path):
+        """write the flat profile to a CSV file
+
+        Args:
+            path: path of the file
+        """
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNS)
+            writer.writeheader()
+            writer.writerows(self.flat())
+
+    def __str__(self):
+        lines = ["{:<28}{:>8}{:>12}{:>12}{:>8}{:>8}{:>14}".format(
+            "step", "calls", "time [s]", "self [s]", "matvec", "matmat", "allocated")]
+        row_format = "{name:<28}{calls:>8}{time:>12.4f}{self_time:>12.4f}{matvec:>8}{matmat:>8}{allocated:>14}"
+        for row in self.flat():
+            lines.append(row_format.format(**row))
+        if self.iteration_time:
+            lines.append("{} iterations, {:.3f} ms per iteration".format(
+                len(self.iteration_time), 1e3 * np.mean(self.iteration_time)))
+        return "\n".join(lines)
+
+
+def profile(solver, trace_memory=True):
+    """profile a solver
+
+    Args:
+        solver: solver instance
+        trace_memory: whether the allocations are measured with tracemalloc
+
+    Returns:
+        Profiler attached to the solver (also stored in solver.profiler)
+    """
+    profiler = Profiler(trace_memory)
+    profiler.attach(solver)
+    return profiler
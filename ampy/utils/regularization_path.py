@@ -0,0 +1,267 @@
+# coding=utf-8
+"""regularization path of AMP and self averaging AMP
+
+RegularizationPath is a mixin of ampy.AMPSolver and ampy.SelfAveragingAMPSolver which solves a path of
+regularization parameters in blocks, warm-starting each block from the last column of the previous one.
+the solver provides the iteration of a block,
+
+    _iterate_columns(y, l, V, z, r, chi, max_iteration, tolerance, message, min_iteration) -> (R, T, convergence flags),
+
+which takes the messages as arrays of shape (L, K), V of shape (M, K) or (K, ), and updates them in place,
+and may define _finish_path(l_path, r_path, R_path, T_path), which is called with the whole path at the end.
+with a screening rule of utils.screening, each block is solved by a solver of the same class
+on the kept columns of A, whose means and convergence norm are taken over the whole signal (see _iterate_screened).
+"""
+import numpy as np
+
+from . import kernels
+from . import operators
+from . import screening as screenings
+
+# iterations of a column before it may be frozen
+MIN_ITERATION = 5
+
+
+class RegularizationPath(object):
+    """ blocked, warm-started path of regularization parameters of the AMP solvers """
+
+    def solve_path(self, regularization_strengths, max_iteration=50, tolerance=1e-5, message=False, block_size=None,
+                   screening=None, min_iteration=MIN_ITERATION):
+        """solve for a path of regularization parameters
+
+        the regularization parameters in a block are processed at once,
+        i.e. the messages become arrays of shape (N, K) or (M, K) and each iteration consists of matrix-matrix products.
+        each column is frozen as soon as it converges.
+        AMPSolver also stores the approximate leave-one-out error of each column in self.path_loo_error.
+        the first block starts from the current state and the following blocks are warm-started
+        from the last column of the previous block, i.e. only the blocks are warm-started:
+        all the columns of a block start from the same state,
+        so that the whole path in one block (the default) is a cold start of every column, and block_size=1 is
+        the warm-started path of one solve per regularization parameter.
+        since a column starting from the zero estimate may stay at zero for the first iterations
+        while its variance decays, no column is frozen before min_iteration iterations.
+
+        Args:
+            regularization_strengths: regularization parameters of shape (K, )
+            max_iteration: maximum number of iterations to be used
+            tolerance: stopping criterion
+            message: convergence info
+            block_size: number of regularization parameters processed at once
+                        (all of them if None, one if None and screened)
+            screening: rule of utils.screening ("strong" or "gap_safe") by which the columns of A are screened
+                       before each block from its warm start (not screened if None).
+                       the block is solved on the kept columns, and solved again with the discarded columns
+                       which violate the optimality condition (a dense or sparse A only).
+                       a block keeps the union of the columns kept for its regularization parameters,
+                       so that a block of the whole path keeps nearly all the columns; hence a screened path
+                       is solved one regularization parameter per block by default, which trades the matrix-matrix
+                       products of the blocks for products over the kept columns (a screened path is faster
+                       than an unscreened one of block_size=1, but not necessarily than one of the whole path
+                       in one block when few columns are discarded).
+                       the gap safe test is repeated during the solve of each block, as the gap decreases.
+                       the number of columns kept at the end of each regularization parameter is stored
+                       in self.path_n_columns
+            min_iteration: number of iterations before which no column is frozen
+
+        Returns:
+            estimated signals of shape (N, K) or (N, B, K)
+        """
+        l_path = np.asarray(regularization_strengths, dtype=np.float64).ravel()
+        K = l_path.shape[0]
+        if block_size is None:
+            block_size = K if screening is None else 1
+        if screening is not None and not isinstance(operators.unwrap(self.A),
+                                                    (operators.DenseOperator, operators.SparseOperator)):
+            raise ValueError("screening requires the columns of A, i.e. a dense or sparse observation matrix")
+        if screening is not None and self.denoiser.name != "soft_threshold":
+            raise ValueError("screening requires the soft thresholding denoiser")
+        self.path_n_columns = np.full(K, self.N)
+
+        batch_shape = self.y.shape[1:]
+        B = int(np.prod(batch_shape))
+        r_path = np.zeros((self.N,) + batch_shape + (K,), dtype=self.dtype)
+        self.path_converged = np.zeros(batch_shape + (K,), dtype=bool)  # convergence flag of each column
+        R_path, T_path = None, None
+
+        for start in range(0, K, block_size):
+            l = l_path[start:start + block_size]
+            k = l.shape[0]
+            # columns are ordered as (observation, regularization parameter)
+            y = self.__to_columns(self.y, k)
+            z = self.__to_columns(self.z, k)
+            r = self.__to_columns(self.r, k)
+            chi = self.__to_columns(self.chi, k)
+            V = self.__to_columns(self.V, k)
+
+            if screening is None:
+                R, T, converged = self._iterate_columns(y, np.tile(l, B), V, z, r, chi, max_iteration, tolerance,
+                                                        message, min_iteration)
+            else:
+                # the strong rule takes the initial zero estimate as the solution at max |A.T y|
+                l_previous = np.repeat(kernels.as_column_scalars(self.l, B), k) if np.any(self.r) else None
+                R, T, converged, n_columns = self._iterate_screened(screening, y, np.tile(l, B), l_previous, V, z,
+                                                                    r, chi, max_iteration, tolerance, message,
+                                                                    min_iteration)
+                self.path_n_columns[start:start + k] = n_columns
+
+            V, z, R, T, r, chi = [
+                x.reshape(x.shape[:-1] + batch_shape + (k,)) for x in (V, z, R, T, r, chi)
+            ]
+            if R_path is None:
+                R_path = np.zeros(R.shape[:-1] + (K,), dtype=R.dtype)
+                T_path = np.zeros(T.shape[:-1] + (K,), dtype=T.dtype)
+            r_path[..., start:start + k] = r
+            self.path_converged[..., start:start + k] = converged.reshape(batch_shape + (k,))
+            R_path[..., start:start + k], T_path[..., start:start + k] = R, T
+
+            # warm start of the next block
+            self.V, self.z, self.R, self.T = V[..., -1], z[..., -1], R[..., -1], T[..., -1]
+            self.r, self.chi = r[..., -1], chi[..., -1]
+            self.l = l[-1]
+
+        self._finish_path(l_path, r_path, R_path, T_path)
+
+        if message and not self.path_converged.all():
+            print("does not converged.")
+            print("regularization strengths=", l_path[~self.path_converged.reshape(B, K).all(axis=0)])
+            print()
+
+        return r_path
+
+    def _finish_path(self, l_path, r_path, R_path, T_path):
+        """called with the whole path at the end of solve_path
+
+        Args:
+            l_path: regularization parameters of shape (K, )
+            r_path: estimates of shape (N, ..., K)
+            R_path: R of the estimates of shape (N, ..., K)
+            T_path: T of the estimates of shape (N, ..., K) or (..., K)
+        """
+        pass
+
+    def _iterate_screened(self, rule, y, l, l_previous, V, z, r, chi, max_iteration, tolerance, message,
+                          min_iteration):
+        """iteration of a block of regularization parameters on the columns kept by a screening rule
+
+        the block is solved on the kept columns by a solver of the same class, and solved again from that solution
+        with the discarded columns which violate the optimality condition restored, until there are none.
+        the reduced solver takes its means and its convergence norm over the N components of the signal
+        (n_components), so that it makes the iteration of the whole problem with the discarded components at zero.
+        the gap safe test is repeated at the current estimate during the solve (see __iterate_kept), since the gap
+        of the warm start at the new regularization parameters is too large to discard many columns.
+        V, z, r and chi are updated in place, r and chi are zero on the discarded columns.
+
+        Args:
+            rule: "strong" or "gap_safe"
+            y: observed values of shape (M, K)
+            l: regularization parameters of shape (K, )
+            l_previous: regularization parameters of the warm start of shape (K, ) (max |A.T y| if None)
+            V: V of the warm start
+            z: z of the warm start of shape (M, K)
+            r: estimator of the warm start of shape (N, K)
+            chi: variance of the warm start of shape (N, K)
+            max_iteration: maximum number of iterations to be used
+            tolerance: stopping criterion
+            message: convergence info
+            min_iteration: number of iterations before which no column is frozen
+
+        Returns:
+            R, T and convergence flags of the columns and the number of columns kept at the end
+        """
+        residual = y - self.A @ r
+        correlation = self.A.T @ residual
+        if l_previous is None:
+            l_previous = np.max(np.abs(correlation), axis=0)
+        column_norms = None
+        if rule == "gap_safe":
+            column_norms = np.sqrt(self.A.squared().T @ np.ones(self.M, dtype=self.dtype))
+        kept = screenings.screen(rule, correlation, residual, r, y, l, l_previous, column_norms)
+
+        while True:
+            R, T, converged, kept = self.__iterate_kept(rule, kept, column_norms, y, l, V, z, r, chi, max_iteration,
+                                                        tolerance, message, min_iteration)
+            if kept.all():
+                return R, T, converged, self.N
+            violations = screenings.kkt_violations(self.A.T @ (y - self.A @ r), l, kept)
+            if not violations.any():
+                return R, T, converged, int(kept.sum())
+            kept |= violations
+
+    def __iterate_kept(self, rule, kept, column_norms, y, l, V, z, r, chi, max_iteration, tolerance, message,
+                       min_iteration):
+        """iteration on the kept columns, narrowed by the gap safe test at the current estimate
+
+        with the gap safe rule the iteration runs in rounds of screening.GAP_SAFE_INTERVAL iterations,
+        doubled after each round, after which the test is repeated at the estimate of the round
+        (the intersection of safe sets is safe), and the columns which it discards are set to zero.
+        with the strong rule the columns are solved in one round.
+
+        Returns:
+            R, T and convergence flags of the columns and the kept columns at the end
+        """
+        interval = screenings.GAP_SAFE_INTERVAL if rule == "gap_safe" else max_iteration
+        solver, solver_kept = None, None
+        done = 0
+        while True:
+            if solver_kept is None or not np.array_equal(kept, solver_kept):
+                solver = self if kept.all() else self.__reduced(np.flatnonzero(kept))
+                solver_kept = kept
+            r_kept, chi_kept = r[kept], chi[kept]
+            n_iteration = min(interval, max_iteration - done)
+            R_kept, T_kept, converged = solver._iterate_columns(y, l, V, z, r_kept, chi_kept, n_iteration, tolerance,
+                                                                message, max(min_iteration - done, 1))
+            r[...], chi[...] = 0.0, 0.0
+            r[kept], chi[kept] = r_kept, chi_kept
+            done += n_iteration
+            if converged.all() or done >= max_iteration:
+                break
+            residual = y - self.A @ r
+            kept = kept & screenings.gap_safe(self.A.T @ residual, residual, r, y, l, column_norms)
+            interval *= 2
+
+        R = np.zeros_like(r)
+        R[kept] = R_kept
+        T = T_kept
+        if T_kept.ndim == 2:  # T of each component (AMP)
+            T = np.zeros_like(r)
+            T[kept] = T_kept
+        return R, T, converged, kept
+
+    def __reduced(self, columns):
+        """solver of the same class on columns of A
+
+        the random initial messages of the constructor do not advance the random state.
+        the reduced solver of a profiled solver is profiled by the same utils.profiler.Profiler.
+
+        Args:
+            columns: indices of the columns
+
+        Returns:
+            solver whose observation matrix is A[:, columns]
+        """
+        A = operators.unwrap(self.A)
+        if isinstance(A, operators.SparseOperator):
+            A = operators.SparseOperator(A.A[:, columns])
+        else:
+            A = operators.DenseOperator(A.A[:, columns])
+        random_state = np.random.get_state()
+        reduced = type(self)(A, self.y, self.l, self.d, dtype=self.dtype, active_set=self.active_set is not None,
+                             denoiser=self.denoiser)
+        np.random.set_state(random_state)
+        reduced.n_components = self.n_components
+        if getattr(self, "profiler", None) is not None:
+            self.profiler.instrument(reduced)
+        return reduced
+
+    def __to_columns(self, x, k):
+        """repeat each observation of a message k times
+
+        Args:
+            x: message of shape (L, ) + batch shape or of the batch shape
+            k: number of repetitions
+
+        Returns:
+            array of shape (L, B * k) or (B * k, )
+        """
+        leading_shape = x.shape[:np.ndim(x) - (self.y.ndim - 1)]
+        return np.repeat(np.reshape(x, leading_shape + (-1,)), k, axis=-1)
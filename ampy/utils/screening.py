@@ -0,0 +1,101 @@
+# coding=utf-8
+"""screening rules of the columns of A along a path of regularization parameters
+
+for the LASSO min_x ||y - A x||^2 / 2 + l ||x||_1, whose fixed points the solvers compute, the column j is
+inactive (x_j = 0) at l if |A_j.T (y - A x)| < l. the rules test this at the next regularization parameter
+from an estimate x at the previous one, through the correlation c = A.T (y - A x):
+
+    "strong": sequential strong rule, keeps |c_j| >= 2 l - l_previous (may discard active columns)
+    "gap_safe": gap safe sphere test, keeps |c_j| / s + ||A_j|| sqrt(2 gap) / l >= 1
+                with the dual point (y - A x) / s, s = max(l, max |c|), and the duality gap of x at l
+                (never discards an active column)
+
+the gap of the estimate at the previous regularization parameter is large at the next one, so that the gap safe test
+discards few columns before a solve; it discards nearly all the inactive columns once the gap of the current
+estimate is small, and is repeated during the solve (dynamic screening, see utils.regularization_path).
+after the problem is solved on the kept columns, kkt_violations returns the discarded columns
+which violate |c_j| <= l, to be restored and solved again.
+"""
+import numpy as np
+
+# relative tolerance of the KKT check, as the solvers stop before the exact fixed point
+KKT_TOLERANCE = 1e-3
+
+# iterations after which the gap safe test is first repeated at the current estimate of a solve (then doubled)
+GAP_SAFE_INTERVAL = 10
+
+
+def strong_rule(correlation, l, l_previous):
+    """columns kept by the sequential strong rule
+
+    Args:
+        correlation: A.T (y - A x) of shape (N, K) of the estimates x at l_previous
+        l: regularization parameters of shape (K, )
+        l_previous: regularization parameters of the estimates of shape (K, )
+
+    Returns:
+        bool array of shape (N, ) of the columns kept for any of the K problems
+    """
+    return np.any(np.abs(correlation) >= 2.0 * l - l_previous, axis=1)
+
+
+def gap_safe(correlation, residual, x, y, l, column_norms):
+    """columns kept by the gap safe sphere test
+
+    Args:
+        correlation: A.T (y - A x) of shape (N, K)
+        residual: y - A x of shape (M, K)
+        x: estimates of shape (N, K)
+        y: observed values of shape (M, K)
+        l: regularization parameters of shape (K, )
+        column_norms: euclidean norms of the columns of A of shape (N, )
+
+    Returns:
+        bool array of shape (N, ) of the columns kept for any of the K problems
+    """
+    correlation = np.asarray(correlation, dtype=np.float64)
+    residual = np.asarray(residual, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    scale = np.maximum(l, np.max(np.abs(correlation), axis=0))
+    primal = 0.5 * np.sum(np.square(residual), axis=0) + l * np.sum(np.abs(x), axis=0, dtype=np.float64)
+    dual = 0.5 * np.sum(np.square(y), axis=0) - 0.5 * np.square(l) * np.sum(np.square(residual / scale - y / l), axis=0)
+    radius = np.sqrt(2.0 * np.maximum(primal - dual, 0.0)) / l
+    return np.any(np.abs(correlation) / scale + np.outer(column_norms, radius) >= 1.0, axis=1)
+
+
+def kkt_violations(correlation, l, kept, tolerance=KKT_TOLERANCE):
+    """discarded columns which violate the optimality condition |c_j| <= l
+
+    Args:
+        correlation: A.T (y - A x) of shape (N, K) of the solutions x on the kept columns
+        l: regularization parameters of shape (K, )
+        kept: bool array of shape (N, ) of the kept columns
+        tolerance: relative tolerance of the condition
+
+    Returns:
+        bool array of shape (N, ) of the discarded columns to be restored
+    """
+    return ~kept & np.any(np.abs(correlation) > (1.0 + tolerance) * l, axis=1)
+
+
+def screen(rule, correlation, residual, x, y, l, l_previous, column_norms):
+    """columns kept by a rule
+
+    Args:
+        rule: "strong" or "gap_safe"
+        correlation: A.T (y - A x) of shape (N, K)
+        residual: y - A x of shape (M, K)
+        x: estimates of shape (N, K)
+        y: observed values of shape (M, K)
+        l: regularization parameters of shape (K, )
+        l_previous: regularization parameters of the estimates of shape (K, ) (the strong rule only)
+        column_norms: euclidean norms of the columns of A of shape (N, ) (the gap safe test only)
+
+    Returns:
+        bool array of shape (N, ) of the kept columns
+    """
+    if rule == "strong":
+        return strong_rule(correlation, l, l_previous)
+    if rule == "gap_safe":
+        return gap_safe(correlation, residual, x, y, l, column_norms)
+    raise ValueError("unknown screening rule: {}".format(rule))
@@ -0,0 +1,315 @@
+# coding=utf-8
+"""state evolution of AMP and self averaging VAMP for LASSO
+
+the scalar recursions predict the MSE of each iteration of AMPSolver and SelfAveragingLMMSEVAMPSolver
+from the measurement ratio, the prior of the signal, the noise level, the regularization parameter
+and, for VAMP, the squared singular values of the observation matrix.
+they are evaluated for a whole grid of regularization parameters and dumping coefficients at once,
+with arrays of shape (L, D) and Gaussian quadrature over the prior (the Gaussian noise of the effective
+scalar channel is integrated analytically), so that a grid can be pruned before any O(MN) work.
+
+conventions are those of the solvers and utils.make_gauss_matrix / utils.make_true_parameter:
+the objective is 1/2 ||y - A x||^2 + l ||x||_1, A has entries of variance 1 / N, y = A x_0 + w with
+w ~ N(0, sigma^2), and x_0 ~ (1 - rho) delta_0 + rho N(0, 1).
+
+the recursions are exact for the fixed points (the predicted MSE at convergence does not depend on the dumping).
+the dumped iterates are approximated by dumping the scalar state: the mean variance of AMP is dumped exactly as
+in the solver, and the MSE of a dumped estimate is replaced by the dumped MSE (an upper bound by convexity).
+the change of the estimate between iterations, from which the number of iterations to tolerance is predicted,
+is evaluated for perfectly correlated effective noises of successive iterations, as they are near a fixed point.
+
+the predictions are those of the large system limit, in which the empirical distribution of x_0 is the prior.
+a single problem of moderate size deviates from them by the fluctuations of its own x_0: with the prior
+bernoulli_gauss_prior(rho) of a problem of N = 2000, the MSE of the solver is often tens of percent off the prediction,
+and the predicted number of iterations is a rough guide only. with the empirical distribution of the x_0
+of the problem (empirical_prior(x_0)) the MSE at convergence is within a few percent from N of a few thousand.
+a solver which stops at the first iteration, because its first estimate is zero for a large l, is not predicted.
+"""
+import numpy as np
+from scipy import special
+
+# clipping of the precisions of VAMP, the same as in the solvers
+PRECISION_MIN = 1e-9
+PRECISION_MAX = 1e9
+
+
+def bernoulli_gauss_prior(rho, n_nodes=41):
+    """quadrature of the Bernoulli-Gaussian prior (1 - rho) delta_0 + rho N(0, 1) of utils.make_true_parameter
+
+    Args:
+        rho: fraction of the non-zero components
+        n_nodes: number of Gauss-Hermite nodes of the Gaussian part
+
+    Returns:
+        nodes and weights of shape (n_nodes + 1, )
+    """
+    nodes, weights = np.polynomial.hermite_e.hermegauss(n_nodes)
+    weights = weights / np.sqrt(2.0 * np.pi)
+    return np.concatenate([[0.0], nodes]), np.concatenate([[1.0 - rho], rho * weights])
+
+
+def empirical_prior(x_0):
+    """empirical distribution of a true signal, the prior for which the predictions of one problem are accurate
+
+    Args:
+        x_0: true signal of shape (N, )
+
+    Returns:
+        nodes and weights of the distinct values of x_0
+    """
+    nodes, counts = np.unique(np.asarray(x_0, dtype=np.float64).ravel(), return_counts=True)
+    return nodes, counts / counts.sum()
+
+
+def _prior(prior, rho, n_nodes):
+    """nodes and weights of the prior (bernoulli_gauss_prior(rho) if None), checked to be a distribution"""
+    if prior is None:
+        return bernoulli_gauss_prior(rho, n_nodes)
+    x_0, weights = (np.asarray(x, dtype=np.float64) for x in prior)
+    if x_0.ndim != 1 or x_0.shape != weights.shape:
+        raise ValueError("the nodes and the weights of the prior must be of the same shape (K, ): {} and {}".format(
+            x_0.shape, weights.shape))
+    if np.any(weights < 0.0) or not np.isclose(weights.sum(), 1.0):
+        raise ValueError("the weights of the prior must be non-negative and sum to 1: sum = {}".format(weights.sum()))
+    return x_0, weights
+
+
+def marchenko_pastur_s2(M, N):
+    """squared singular values of utils.make_gauss_matrix(M, N) in the large system limit
+
+    the min(M, N) non-zero eigenvalues of A A.T follow the Marchenko-Pastur law on
+    [(1 - sqrt(M / N))^2, (1 + sqrt(M / N))^2], whose quantiles are returned.
+
+    Args:
+        M: number of rows
+        N: number of columns
+
+    Returns:
+        squared singular values of shape (min(M, N), )
+    """
+    alpha = M / N
+    a, b = (1.0 - np.sqrt(alpha)) ** 2, (1.0 + np.sqrt(alpha)) ** 2
+    x = np.linspace(a, b, 8192 + 1)
+    density = np.sqrt(np.maximum((b - x) * (x - a), 0.0)) / np.maximum(x, 1e-300)
+    cdf = np.concatenate([[0.0], np.cumsum(0.5 * (density[1:] + density[:-1]) * np.diff(x))])
+    K = min(M, N)
+    return np.interp((np.arange(K) + 0.5) / K, cdf / cdf[-1], x)
+
+
+def _soft_threshold_moments(x_0, variance, threshold):
+    """MSE and mean derivative of the soft thresholding of x_0 + N(0, variance), integrated over the noise
+
+    Args:
+        x_0: true values broadcastable with the others
+        variance: variance of the effective noise
+        threshold: threshold
+
+    Returns:
+        E[(eta(r) - x_0)^2] and P(|r| > threshold)
+    """
+    s = np.sqrt(variance)
+    upper = (threshold - x_0) / s  # the estimate is r - threshold above upper
+    lower = (-threshold - x_0) / s  # and r + threshold below lower
+    phi_upper, phi_lower = np.exp(-0.5 * upper ** 2) / np.sqrt(2.0 * np.pi), np.exp(-0.5 * lower ** 2) / np.sqrt(
+        2.0 * np.pi)
+    q_upper, p_lower = special.ndtr(-upper), special.ndtr(lower)
+
+    mse = x_0 ** 2 * (1.0 - q_upper - p_lower)
+    mse = mse + variance * (upper * phi_upper + q_upper) - 2.0 * s * threshold * phi_upper + threshold ** 2 * q_upper
+    mse = mse + variance * (p_lower - lower * phi_lower) - 2.0 * s * threshold * phi_lower + threshold ** 2 * p_lower
+    return mse, q_upper + p_lower
+
+
+def _soft_threshold(x, threshold):
+    return np.sign(x) * np.maximum(np.abs(x) - threshold, 0.0)
+
+
+class StateEvolutionResult(object):
+    """ predicted MSE and number of iterations over a grid of regularization parameters and dumping coefficients """
+
+    def __init__(self, regularization_strengths, dumping_coefficients, mse_trace, abs_diff_trace, tolerance):
+        """constructor
+
+        Args:
+            regularization_strengths: regularization parameters of shape (L, )
+            dumping_coefficients: dumping coefficients of shape (D, )
+            mse_trace: predicted MSE of each iteration of shape (max_iteration, L, D)
+            abs_diff_trace: predicted abs_diff of each iteration of shape (max_iteration, L, D)
+            tolerance: stopping criterion of the solver
+        """
+        self.regularization_strengths = regularization_strengths
+        self.dumping_coefficients = dumping_coefficients
+        self.mse_trace = mse_trace
+        self.abs_diff_trace = abs_diff_trace
+
+        satisfied = abs_diff_trace < tolerance
+        self.converged = satisfied.any(axis=0)  # of shape (L, D)
+        # the solver stops at the first iteration below the tolerance
+        last_index = np.where(self.converged, np.argmax(satisfied, axis=0), mse_trace.shape[0] - 1)
+        self.n_iterations = last_index + 1
+        self.mse = np.take_along_axis(mse_trace, last_index[np.newaxis], axis=0)[0]  # MSE of the returned estimate
+        self.fixed_point_mse = mse_trace[-1]
+
+    def best(self):
+        """the grid point of the lowest predicted MSE, with the fewest iterations among equal MSEs
+
+        Returns:
+            regularization parameter and dumping coefficient
+        """
+        order = np.lexsort((self.n_iterations.ravel(), np.round(self.mse.ravel(), 12)))
+        i, j = np.unravel_index(order[0], self.mse.shape)
+        return self.regularization_strengths[i], self.dumping_coefficients[j]
+
+    def __repr__(self):
+        l, d = self.best()
+        return "StateEvolutionResult(grid={0}, best regularization_strength={1}, dumping_coefficient={2})".format(
+            self.mse.shape, l, d)
+
+
+def _grid(regularization_strengths, dumping_coefficients):
+    """regularization parameters of shape (L, 1, 1) and dumping coefficients of shape (1, D, 1)"""
+    l = np.asarray(regularization_strengths, dtype=np.float64).ravel()
+    d = np.asarray(dumping_coefficients, dtype=np.float64).ravel()
+    return l, d, l[:, np.newaxis, np.newaxis], d[np.newaxis, :, np.newaxis]
+
+
+def amp_state_evolution(alpha, rho, sigma, regularization_strengths, dumping_coefficients, max_iteration=50,
+                        tolerance=1e-5, prior=None, n_nodes=41):
+    """state evolution of AMPSolver
+
+    the effective observation of each component is x_0 + N(0, tau^2) with tau^2 = (sigma^2 + mse) / alpha,
+    soft thresholded with l T for T = (1 + chi) / alpha, where chi is the mean variance of the estimate.
+
+    Args:
+        alpha: measurement ratio M / N
+        rho: fraction of the non-zero components (not used if prior is given)
+        sigma: standard deviation of the observation noise
+        regularization_strengths: regularization parameters of shape (L, )
+        dumping_coefficients: dumping coefficients of shape (D, )
+        max_iteration: maximum number of iterations
+        tolerance: stopping criterion of the solver
+        prior: nodes and weights of the prior of x_0 (bernoulli_gauss_prior(rho) if None),
+               empirical_prior(x_0) for the accurate prediction of a problem of moderate size
+        n_nodes: number of Gauss-Hermite nodes of the prior and of the change of the estimate
+
+    Returns:
+        StateEvolutionResult
+    """
+    l_grid, d_grid, l, d = _grid(regularization_strengths, dumping_coefficients)
+    x_0, weights = _prior(prior, rho, n_nodes)
+    xi, xi_weights = np.polynomial.hermite_e.hermegauss(n_nodes)
+    xi_weights = xi_weights / np.sqrt(2.0 * np.pi)
+    # axes (L, D, prior, noise) for the change of the estimate
+    x_0_pair, xi_pair = x_0[:, np.newaxis], xi[np.newaxis, :]
+
+    shape = (l_grid.shape[0], d_grid.shape[0])
+    mse = np.full(shape + (1,), np.dot(weights, x_0 ** 2))  # r = 0
+    chi = np.ones(shape + (1,))
+    previous = None  # (standard deviation, threshold) of the previous estimate (r = 0 if None)
+
+    mse_trace = np.empty((max_iteration,) + shape)
+    abs_diff_trace = np.empty((max_iteration,) + shape)
+    for t in range(max_iteration):
+        variance = (sigma ** 2 + mse) / alpha
+        threshold = l * (1.0 + chi) / alpha
+        new_mse, mask = _soft_threshold_moments(x_0, variance, threshold)
+        new_mse, mask = new_mse @ weights, mask @ weights
+
+        estimate = _soft_threshold(x_0_pair + np.sqrt(variance)[..., np.newaxis] * xi_pair, threshold[..., np.newaxis])
+        if previous is None:
+            change = estimate
+        else:
+            change = estimate - _soft_threshold(x_0_pair + previous[0][..., np.newaxis] * xi_pair,
+                                                previous[1][..., np.newaxis])
+        abs_diff_trace[t] = d[..., 0] * np.sqrt(np.square(change) @ xi_weights @ weights)
+        previous = (np.sqrt(variance), threshold)
+
+        mse = (d[..., 0] * new_mse + (1.0 - d[..., 0]) * mse[..., 0])[..., np.newaxis]
+        chi = (d[..., 0] * (1.0 + chi[..., 0]) / alpha * mask + (1.0 - d[..., 0]) * chi[..., 0])[..., np.newaxis]
+        mse_trace[t] = mse[..., 0]
+
+    return StateEvolutionResult(l_grid, d_grid, mse_trace, abs_diff_trace, tolerance)
+
+
+def vamp_state_evolution(s2, N, rho, sigma, regularization_strengths, dumping_coefficients, max_iteration=50,
+                         tolerance=1e-5, prior=None, n_nodes=41):
+    """state evolution of SelfAveragingLMMSEVAMPSolver
+
+    r_1 = x_0 + N(0, tau_1) enters the soft thresholding with l / gamma_1, and r_2 = x_0 + N(0, tau_2)
+    enters the LMMSE estimation, whose error is diagonal in the right singular vectors of A.
+
+    Args:
+        s2: squared non-zero singular values of A (e.g. the solver's s2, or marchenko_pastur_s2(M, N))
+        N: number of columns of A
+        rho: fraction of the non-zero components (not used if prior is given)
+        sigma: standard deviation of the observation noise
+        regularization_strengths: regularization parameters of shape (L, )
+        dumping_coefficients: dumping coefficients of shape (D, )
+        max_iteration: maximum number of iterations
+        tolerance: stopping criterion of the solver
+        prior: nodes and weights of the prior of x_0 (bernoulli_gauss_prior(rho) if None),
+               empirical_prior(x_0) for the accurate prediction of a problem of moderate size
+        n_nodes: number of Gauss-Hermite nodes of the prior and of the change of the estimate
+
+    Returns:
+        StateEvolutionResult
+    """
+    l_grid, d_grid, l, d = _grid(regularization_strengths, dumping_coefficients)
+    x_0, weights = _prior(prior, rho, n_nodes)
+    xi, xi_weights = np.polynomial.hermite_e.hermegauss(n_nodes)
+    xi_weights = xi_weights / np.sqrt(2.0 * np.pi)
+    x_0_pair, xi_pair = x_0[:, np.newaxis], xi[np.newaxis, :]
+    s2 = np.asarray(s2, dtype=np.float64).ravel()
+    s2 = s2[s2 > 0.0]
+    n_zero = N - s2.shape[0]  # components of x_hat_2 which stay at r_2
+    d = d[..., 0]
+
+    # the initial messages of the solver are independent standard normal
+    shape = (l_grid.shape[0], d_grid.shape[0])
+    second_moment = np.dot(weights, x_0 ** 2)
+    tau_1 = np.full(shape, 1.0 + second_moment)
+    gamma_1 = np.ones(shape)
+    eta_1 = np.ones(shape)
+    mse_1 = np.full(shape, 1.0 + second_moment)
+    previous = None
+
+    mse_trace = np.empty((max_iteration,) + shape)
+    abs_diff_trace = np.empty((max_iteration,) + shape)
+    for t in range(max_iteration):
+        # denoising
+        threshold = l[..., 0] / gamma_1
+        new_mse_1, alpha_1 = _soft_threshold_moments(x_0, tau_1[..., np.newaxis], threshold[..., np.newaxis])
+        new_mse_1, alpha_1 = new_mse_1 @ weights, np.maximum(alpha_1 @ weights, 1.0 / N)
+
+        estimate = _soft_threshold(x_0_pair + np.sqrt(tau_1)[..., np.newaxis, np.newaxis] * xi_pair,
+                                   threshold[..., np.newaxis, np.newaxis])
+        if previous is None:
+            # the initial x_hat_1 is independent of the estimate
+            abs_diff_trace[t] = np.inf
+        else:
+            change = estimate - _soft_threshold(x_0_pair + previous[0][..., np.newaxis, np.newaxis] * xi_pair,
+                                                previous[1][..., np.newaxis, np.newaxis])
+            abs_diff_trace[t] = d * np.sqrt(np.square(change) @ xi_weights @ weights)
+        previous = (np.sqrt(tau_1), threshold)
+        mse_1 = d * new_mse_1 + (1.0 - d) * mse_1
+        mse_trace[t] = mse_1
+
+        eta_1 = np.clip(d * gamma_1 / alpha_1 + (1.0 - d) * eta_1, PRECISION_MIN, PRECISION_MAX)
+        gamma_2 = np.clip(eta_1 - gamma_1, PRECISION_MIN, PRECISION_MAX)
+        # r_2 - x_0 = (eta_1 (x_hat_1 - x_0) - gamma_1 (r_1 - x_0)) / gamma_2, E[(x_hat_1 - x_0)(r_1 - x_0)] = alpha_1 tau_1
+        tau_2 = np.maximum(
+            (eta_1 ** 2 * mse_1 - 2.0 * eta_1 * gamma_1 * alpha_1 * tau_1 + gamma_1 ** 2 * tau_1) / gamma_2 ** 2,
+            1e-300)
+
+        # LMMSE estimation, of shape (L, D, K) over the singular values
+        g = gamma_2[..., np.newaxis]
+        mse_2 = (np.sum((s2 * sigma ** 2 + g ** 2 * tau_2[..., np.newaxis]) / (s2 + g) ** 2, axis=-1)
+                 + n_zero * tau_2) / N
+        alpha_2 = 1.0 - np.sum(s2 / (s2 + g), axis=-1) / N
+        eta_2 = gamma_2 / alpha_2
+        gamma_1 = np.clip(eta_2 - gamma_2, PRECISION_MIN, PRECISION_MAX)
+        tau_1 = np.maximum(
+            (eta_2 ** 2 * mse_2 - 2.0 * eta_2 * gamma_2 * alpha_2 * tau_2 + gamma_2 ** 2 * tau_2) / gamma_1 ** 2,
+            1e-300)
+
+    return StateEvolutionResult(l_grid, d_grid, mse_trace, abs_diff_trace, tolerance)
@@ -0,0 +1,91 @@
+# coding=utf-8
+"""structured record of a solve: iteration count, convergence flags and per-iteration traces
+
+the traces are preallocated for max_iteration iterations (one record every trace_every iterations),
+so that recording an iteration only writes into arrays.
+"""
+import numpy as np
+
+
+class SolveResult(object):
+    """ result of a solve with the traces sampled along the iterations """
+
+    def __init__(self, max_iteration, batch_shape=(), scalar_names=(), trace_every=1):
+        """constructor
+
+        Args:
+            max_iteration: maximum number of iterations of the solve
+            batch_shape: () for a single observation, (B, ) for multiple observations
+            scalar_names: names of the per-observation scalars traced besides abs_diff and the estimate norm
+            trace_every: one record every trace_every iterations and at the last iteration (only the last if 0)
+        """
+        self.trace_every = trace_every
+        n_records = 1 if trace_every <= 0 else (max_iteration - 1) // trace_every + 2
+        self.__n_records = 0
+        self.__iteration = np.zeros(n_records, dtype=np.int64)
+        self.__traces = {name: np.full((n_records,) + tuple(batch_shape), np.nan)
+                         for name in ("abs_diff", "estimate_norm") + tuple(scalar_names)}
+
+        self.n_iterations = 0  # number of iterations executed
+        self.converged = np.zeros(batch_shape, dtype=bool)  # convergence flag of each observation
+        self.abs_diff = np.full(batch_shape, np.nan)  # abs_diff of the last iteration
+        self.x_hat = None  # estimate
+
+    def due(self, iteration_index):
+        """whether the iteration is sampled (the last iteration is recorded after the loop)
+
+        Args:
+            iteration_index: index of the iteration
+
+        Returns:
+            True if the iteration has to be recorded
+        """
+        return self.trace_every > 0 and iteration_index % self.trace_every == 0
+
+    def record(self, iteration_index, **values):
+        """record an iteration
+
+        Args:
+            iteration_index: index of the iteration
+            values: abs_diff, estimate_norm and the scalars of the iteration
+        """
+        k = self.__n_records
+        if k > 0 and self.__iteration[k - 1] == iteration_index:
+            k -= 1  # already recorded
+        elif k == len(self.__iteration):
+            k -= 1  # the last record is overwritten when trace_every is 0
+        self.__iteration[k] = iteration_index
+        for name, value in values.items():
+            self.__traces[name][k] = value
+        self.__n_records = k + 1
+
+    def finish(self, iteration_index, abs_diff, converged, x_hat):
+        """summary of the solve
+
+        Args:
+            iteration_index: index of the last iteration
+            abs_diff: abs_diff of the last iteration
+            converged: convergence flag of each observation
+            x_hat: estimate
+        """
+        self.n_iterations = iteration_index + 1
+        self.abs_diff = abs_diff
+        self.converged = converged
+        self.x_hat = x_hat
+
+    @property
+    def iterations(self):
+        """indices of the recorded iterations"""
+        return self.__iteration[:self.__n_records]
+
+    def __getitem__(self, name):
+        """trace of a recorded value of shape (number of records, ) + batch_shape"""
+        return self.__traces[name][:self.__n_records]
+
+    def keys(self):
+        """names of the recorded values"""
+        return self.__traces.keys()
+
+    def __repr__(self):
+        return "SolveResult(n_iterations={0}, converged={1}, abs_diff={2})".format(
+            self.n_iterations, self.converged, self.abs_diff)
@@ -1,51 +1,77 @@
 # coding=utf-8
+import warnings
+
 import numpy as np
 
+# deprecated: the whole dct matrix of size (n,n) from which make_random_dct_matrix takes its rows if it is set
+# (make_random_dct_matrix now computes only the selected rows)
 dct_matrix = None
 
 
 def update_dumping(old_x, new_x, dumping_coefficient):
+    # the coefficient is cast so that single precision messages stay in single precision
+    dumping_coefficient = np.asarray(dumping_coefficient, dtype=np.result_type(old_x, new_x))
     return dumping_coefficient * new_x + (1.0 - dumping_coefficient) * old_x
 
 
-def make_dct_matrix(n):
+def column_norm(x):
+    """euclidean norm of each column, accumulated in double precision
+
+    Args:
+        x: array of shape (N, ) or (N, B)
+
+    Returns:
+        norm of shape () or (B, )
+    """
+    return np.sqrt(np.sum(np.square(x, dtype=np.float64), axis=0))
+
+
+def make_dct_matrix(n, rows=None):
     """make discrete cosine matrix
 
     Args:
         n: size of dct matrix
+        rows: indices of the rows to make (all rows if None)
 
     Returns:
-        dct matrix with size (n,n)
+        dct matrix with size (n,n), or its rows with size (len(rows),n)
     """
 
     n_inv = 1.0 / n
 
-    pi = np.pi
-    A = np.cos(
-        [[pi * i * (2.0 * j + 1) * 0.5 * n_inv for j in range(n)] if i != 0 else [0] * n for i in range(n)]
-
-    )
+    i = np.arange(n) if rows is None else np.asarray(rows)
+    A = np.cos(np.pi * i[:, np.newaxis] * (2.0 * np.arange(n) + 1) * 0.5 * n_inv)
     A *= np.sqrt(2.0 / n)
-    A[0] *= 1.0 / np.sqrt(2)
+    A[i == 0] *= 1.0 / np.sqrt(2)
 
     return A
 
 
-def make_random_dct_matrix(m, n):
-    if not dct_matrix:
-        B = make_dct_matrix(n)
-    else:
-        B = dct_matrix
-    A = []
-    for num in np.random.permutation(n)[:m]:
-        A.append(B[num])
-    A = np.array(A)
-    return A
+def make_random_dct_matrix(m, n, rng=None):
+    """make m random rows of the discrete cosine matrix
+
+    Args:
+        m: number of rows
+        n: size of dct matrix
+        rng: numpy.random.Generator (np.random if None)
+
+    Returns:
+        matrix with size (m,n)
+    """
+    rng = np.random if rng is None else rng
+    rows = rng.permutation(n)[:m]
+    if dct_matrix is not None:
+        warnings.warn("utils.dct_matrix is deprecated, make_random_dct_matrix computes the selected rows itself",
+                      DeprecationWarning, stacklevel=2)
+        return np.array(dct_matrix[rows])
+    return make_dct_matrix(n, rows=rows)
 
 
-def make_gauss_matrix(m, n):
-    return np.random.normal(0.0, 1.0 / np.sqrt(n), (m, n))
+def make_gauss_matrix(m, n, rng=None):
+    rng = np.random if rng is None else rng
+    return rng.normal(0.0, 1.0 / np.sqrt(n), (m, n))
 
 
-def make_true_parameter(n, rho):
-    return np.random.normal(0.0, 1.0, n) * np.random.binomial(1, rho, n)
+def make_true_parameter(n, rho, rng=None):
+    rng = np.random if rng is None else rng
+    return rng.normal(0.0, 1.0, n) * rng.binomial(1, rho, n)
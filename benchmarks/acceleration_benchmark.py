@@ -0,0 +1,73 @@
+# coding=utf-8
+"""Anderson acceleration against the plain solve loops
+
+each solver solves one problem of the notebooks at regularization parameters of 1/20 and 1/50 of max |A.T y|,
+from the same initial state, once with the plain loop and once with utils.acceleration.AndersonAcceleration,
+and reports the number of iterations, the wall-clock time, whether the tolerance was reached
+and the MSE, for each regularization parameter and tolerance.
+
+usage:
+    python benchmarks/acceleration_benchmark.py [window] [max_iteration]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ampy.AMPSolver import AMPSolver  # noqa: E402
+from ampy.SelfAveragingAMPSolver import SelfAveragingAMPSolver  # noqa: E402
+from ampy.SelfAveragingLMMSEVAMPSolver import SelfAveragingLMMSEVAMPSolver  # noqa: E402
+from ampy.NaiveSelfAveragingLMMSEVAMPSolver import NaiveSelfAveragingLMMSEVAMPSolver  # noqa: E402
+from ampy.CGSelfAveragingLMMSEVAMPSolver import CGSelfAveragingLMMSEVAMPSolver  # noqa: E402
+from ampy.NaiveLMMSEVAMPSolver import NaiveLMMSEVAMPSolver  # noqa: E402
+from ampy.utils import acceleration  # noqa: E402
+from ampy.utils import utils  # noqa: E402
+
+TOLERANCES = (1e-5, 1e-7)
+LAMBDA_RATIOS = (20.0, 50.0)  # max |A.T y| / regularization parameter
+
+# name, solver, N, alpha, noise, dumping
+SCENARIOS = [
+    ("AMP", AMPSolver, 2000, 0.6, 1e-2, 0.9),
+    ("self averaging AMP", SelfAveragingAMPSolver, 2000, 0.6, 1e-2, 0.9),
+    ("self averaging VAMP", SelfAveragingLMMSEVAMPSolver, 2000, 0.6, 1e-2, 0.95),
+    ("naive self averaging VAMP", NaiveSelfAveragingLMMSEVAMPSolver, 500, 0.6, 1e-2, 0.95),
+    ("CG self averaging VAMP", CGSelfAveragingLMMSEVAMPSolver, 2000, 0.6, 1e-2, 0.95),
+    ("naive VAMP", NaiveLMMSEVAMPSolver, 500, 0.6, 1e-2, 0.9),
+]
+
+
+def make_problem(N, alpha, noise, seed=0):
+    """Gaussian observation matrix, true parameter and observation"""
+    np.random.seed(seed)
+    M = int(N * alpha)
+    A = utils.make_gauss_matrix(M, N)
+    x_0 = utils.make_true_parameter(N, 0.1)
+    y = A @ x_0 + np.random.normal(0.0, noise, M)
+    return A, x_0, y
+
+
+def main(window=5, max_iteration=500):
+    print("{:<28}{:>7}{:>11}{:>10}{:>8}{:>10}{:>7}{:>11}".format("scenario", "ratio", "tolerance", "loop", "iter",
+                                                                "time[s]", "conv", "mse"))
+    for name, solver_class, N, alpha, noise, dumping in SCENARIOS:
+        A, x_0, y = make_problem(N, alpha, noise)
+        for ratio, tolerance in [(ratio, tolerance) for ratio in LAMBDA_RATIOS for tolerance in TOLERANCES]:
+            l = np.max(np.abs(A.T @ y)) / ratio
+            for label, accelerator in (("plain", None), ("anderson", acceleration.AndersonAcceleration(window))):
+                np.random.seed(1)
+                solver = solver_class(A, y, l, dumping, acceleration=accelerator)
+                start = time.perf_counter()
+                with np.errstate(all="ignore"):
+                    x_hat = solver.solve(max_iteration=max_iteration, tolerance=tolerance)
+                elapsed = time.perf_counter() - start
+                print("{:<28}{:>7.0f}{:>11.0e}{:>10}{:>8}{:>10.3f}{:>7}{:>11.2e}".format(
+                    name, ratio, tolerance, label, solver.result.n_iterations, elapsed, str(bool(np.all(solver.converged))),
+                    np.mean(np.square(x_hat - x_0))))
+
+
+if __name__ == '__main__':
+    main(*[cast(arg) for cast, arg in zip((int, int), sys.argv[1:])])
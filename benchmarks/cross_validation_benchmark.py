@@ -0,0 +1,97 @@
+# coding=utf-8
+"""K-fold cross-validation of utils.cross_validation against separate warm-started solves
+
+the path of each fold is compared with one solve per regularization parameter, each warm-started
+from the previous fixed point, from the same initial state (the largest difference over the path is reported,
+and the fold is marked if it exceeds a few tolerances per component), and cross_validate is timed in this process
+and in the process pool, together with sklearn.linear_model.LassoCV if sklearn is installed.
+
+usage:
+    python benchmarks/cross_validation_benchmark.py [N] [n_folds]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ampy.AMPSolver import AMPSolver  # noqa: E402
+from ampy.SelfAveragingAMPSolver import SelfAveragingAMPSolver  # noqa: E402
+from ampy.utils import cross_validation  # noqa: E402
+from ampy.utils import utils  # noqa: E402
+
+ALPHA, RHO, NOISE = 0.5, 0.1, 0.05
+DUMPING = 0.5
+N_LAMBDAS = 20
+MAX_ITERATION, TOLERANCE = 500, 1e-8
+SEED = 0
+
+
+def make_problem(N, seed=SEED):
+    """Gaussian observation matrix and observation of the notebooks"""
+    np.random.seed(seed)
+    M = int(N * ALPHA)
+    A = utils.make_gauss_matrix(M, N)
+    y = A @ utils.make_true_parameter(N, RHO) + np.random.normal(0.0, NOISE, M)
+    return A, y
+
+
+def separate_solves(solver_class, A, y, l_path):
+    """one solve per regularization parameter, warm-started from the previous one"""
+    solver = solver_class(A, y, l_path[0], DUMPING)
+    x_path = []
+    for l in l_path:
+        solver.l = l
+        x_path.append(np.array(solver.solve(max_iteration=MAX_ITERATION, tolerance=TOLERANCE)))
+    return np.stack(x_path, axis=-1)
+
+
+def check_folds(solver_class, A, y, l_path, n_folds):
+    """largest difference of the fold paths from the separate solves"""
+    M = A.shape[0]
+    np.random.seed(SEED)
+    folds = np.array_split(np.random.permutation(M), n_folds)
+    for k, test_rows in enumerate(folds):
+        train = np.ones(M, dtype=bool)
+        train[test_rows] = False
+        l_train = l_path * np.count_nonzero(train) / M
+        np.random.seed(SEED + 1 + k)
+        path = cross_validation._solve_path(solver_class, A[train], y[train], l_train, DUMPING, {}, MAX_ITERATION,
+                                            TOLERANCE)
+        np.random.seed(SEED + 1 + k)
+        reference = separate_solves(solver_class, A[train], y[train], l_train)
+        difference = np.max(np.abs(path - reference))
+        mark = "" if difference < 10.0 * TOLERANCE * np.sqrt(A.shape[1]) else "  <- differs"
+        print("{:<24}{:>6}{:>16.2e}{}".format(solver_class.__name__, k, difference, mark))
+
+
+def main(N=2000, n_folds=5):
+    A, y = make_problem(N)
+    l_max = np.max(np.abs(A.T @ y))
+    l_path = l_max * np.logspace(0, -2, N_LAMBDAS)
+
+    print("(M, N) = {}, {} regularization parameters".format(A.shape, N_LAMBDAS))
+    print("{:<24}{:>6}{:>16}".format("solver", "fold", "max difference"))
+    for solver_class in (AMPSolver, SelfAveragingAMPSolver):
+        check_folds(solver_class, A, y, l_path, n_folds)
+
+    print("\n{:<36}{:>10}{:>14}".format("cross-validation", "time[s]", "chosen l"))
+    for label, n_jobs in (("AMP, 1 process", 1), ("AMP, process pool", None)):
+        start = time.perf_counter()
+        result = cross_validation.cross_validate(AMPSolver, A, y, l_path, DUMPING, n_folds=n_folds, n_jobs=n_jobs,
+                                                 max_iteration=MAX_ITERATION, tolerance=TOLERANCE, seed=SEED)
+        print("{:<36}{:>10.3f}{:>14.4f}".format(label, time.perf_counter() - start, result.regularization_strength))
+    try:
+        from sklearn.linear_model import LassoCV
+    except ImportError:
+        return
+    start = time.perf_counter()
+    lasso = LassoCV(cv=n_folds, alphas=cross_validation.to_sklearn_alpha(l_path, A.shape[0])).fit(A, y)
+    print("{:<36}{:>10.3f}{:>14.4f}".format("sklearn LassoCV", time.perf_counter() - start,
+                                            cross_validation.from_sklearn_alpha(lasso.alpha_, A.shape[0])))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,75 @@
+# coding=utf-8
+"""denoisers of utils.denoisers on a Bernoulli-Gaussian signal
+
+each solver solves one problem of the notebooks with the soft thresholding at a regularization parameter
+of 1/50 of max |A.T y|, with the elastic net, MCP and SCAD at the same regularization parameter,
+and with the Bernoulli-Gaussian posterior mean of the true prior on A / noise and y / noise,
+from the same initial state, and reports the number of iterations, the wall-clock time,
+whether the tolerance was reached and the MSE.
+the nonconvex MCP and SCAD are run with a stronger dumping, without which AMP diverges at this regularization.
+
+usage:
+    python benchmarks/denoiser_benchmark.py [max_iteration] [tolerance]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ampy.AMPSolver import AMPSolver  # noqa: E402
+from ampy.SelfAveragingLMMSEVAMPSolver import SelfAveragingLMMSEVAMPSolver  # noqa: E402
+from ampy.utils import denoisers  # noqa: E402
+from ampy.utils import utils  # noqa: E402
+
+N, ALPHA, RHO, NOISE = 2000, 0.6, 0.1, 1e-2
+LAMBDA_RATIO = 50.0  # max |A.T y| / regularization parameter
+
+# name, solver, dumping
+SCENARIOS = [
+    ("AMP", AMPSolver, 0.9),
+    ("self averaging VAMP", SelfAveragingLMMSEVAMPSolver, 0.95),
+]
+
+# label, denoiser, scale of A and y, dumping (that of the scenario if None)
+DENOISERS = [
+    ("soft_threshold", None, 1.0, None),
+    ("elastic_net", denoisers.get("elastic_net", ridge=0.01), 1.0, None),
+    ("mcp", denoisers.get("mcp", gamma=5.0), 1.0, 0.5),
+    ("scad", denoisers.get("scad", a=5.0), 1.0, 0.5),
+    ("bernoulli_gauss", denoisers.get("bernoulli_gauss", rho=RHO, sigma2=1.0), NOISE, None),
+]
+
+
+def make_problem(seed=0):
+    """Gaussian observation matrix, true parameter and observation"""
+    np.random.seed(seed)
+    M = int(N * ALPHA)
+    A = utils.make_gauss_matrix(M, N)
+    x_0 = utils.make_true_parameter(N, RHO)
+    y = A @ x_0 + np.random.normal(0.0, NOISE, M)
+    return A, x_0, y
+
+
+def main(max_iteration=300, tolerance=1e-6):
+    A, x_0, y = make_problem()
+    l = np.max(np.abs(A.T @ y)) / LAMBDA_RATIO
+    print("{:<24}{:>17}{:>8}{:>10}{:>7}{:>11}".format("scenario", "denoiser", "iter", "time[s]", "conv", "mse"))
+    for name, solver_class, dumping in SCENARIOS:
+        for label, denoiser, scale, denoiser_dumping in DENOISERS:
+            np.random.seed(1)
+            solver = solver_class(A / scale, y / scale, l, dumping if denoiser_dumping is None else denoiser_dumping,
+                                  denoiser=denoiser)
+            start = time.perf_counter()
+            with np.errstate(all="ignore"):
+                x_hat = solver.solve(max_iteration=max_iteration, tolerance=tolerance)
+            elapsed = time.perf_counter() - start
+            print("{:<24}{:>17}{:>8}{:>10.3f}{:>7}{:>11.2e}".format(
+                name, label, solver.result.n_iterations, elapsed, str(bool(np.all(solver.converged))),
+                np.mean(np.square(x_hat - x_0))))
+
+
+if __name__ == '__main__':
+    main(*[cast(arg) for cast, arg in zip((int, float), sys.argv[1:])])
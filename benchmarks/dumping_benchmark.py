@@ -0,0 +1,97 @@
+# coding=utf-8
+"""adaptive against fixed dumping on the scenarios of the notebooks
+
+each scenario solves a warm-started path of regularization parameters from max |A.T y| down to 1/300 of it
+as the notebooks do (to the default tolerance of the solvers, the notebooks stop earlier),
+once with the fixed dumping coefficient of the notebook and once with utils.adaptive_dumping.AdaptiveDumping,
+and reports the total number of iterations and matrix-vector products, the number of points which did not
+converge and the MSE of the last point. AMP on a random DCT matrix, which diverges without dumping, is added.
+
+usage:
+    python benchmarks/dumping_benchmark.py [n_points] [tolerance]
+"""
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ampy.AMPSolver import AMPSolver  # noqa: E402
+from ampy.SelfAveragingAMPSolver import SelfAveragingAMPSolver  # noqa: E402
+from ampy.SelfAveragingLMMSEVAMPSolver import SelfAveragingLMMSEVAMPSolver  # noqa: E402
+from ampy.NaiveSelfAveragingLMMSEVAMPSolver import NaiveSelfAveragingLMMSEVAMPSolver  # noqa: E402
+from ampy.NaiveLMMSEVAMPSolver import NaiveLMMSEVAMPSolver  # noqa: E402
+from ampy.utils import adaptive_dumping  # noqa: E402
+from ampy.utils import utils  # noqa: E402
+
+# matrix-vector products of A (or of the decomposition of A) per iteration
+PRODUCTS_PER_ITERATION = {
+    AMPSolver: 4,  # A, A2, A.T and A2.T
+    SelfAveragingAMPSolver: 2,  # A and A.T
+    SelfAveragingLMMSEVAMPSolver: 2,  # VT and V
+    NaiveSelfAveragingLMMSEVAMPSolver: 1,  # (gamma_2 I + A.T A)^-1
+    NaiveLMMSEVAMPSolver: 1,  # (diag(q2_hat) + A.T A)^-1
+}
+
+# name, solver, ensemble, N, alpha, noise, column scale, fixed dumping
+SCENARIOS = [
+    ("[0] self averaging AMP", SelfAveragingAMPSolver, "gauss", 4096, 0.8, 1e-2, "N", 0.9),
+    ("[1] AMP", AMPSolver, "gauss", 4096, 0.8, 1e-2, "N", 0.9),
+    ("[1] AMP, random DCT", AMPSolver, "dct", 4096, 0.8, 1e-2, "N", 0.9),
+    ("[2] naive self averaging VAMP", NaiveSelfAveragingLMMSEVAMPSolver, "gauss", 1024, 0.8, 1e-2, "N", 0.95),
+    ("[3] self averaging VAMP", SelfAveragingLMMSEVAMPSolver, "gauss", 4096, 0.8, 1e-2, "N", 0.95),
+    ("[3-1] self averaging VAMP, random DCT", SelfAveragingLMMSEVAMPSolver, "dct", 4096, 0.8, 1e-2, "N", 0.95),
+    ("[4] naive VAMP", NaiveLMMSEVAMPSolver, "gauss", 1024, 0.5, 2e-1, "M", 1.0),
+]
+
+
+def make_problem(ensemble, N, alpha, noise, scale, seed=0):
+    """observation matrix, true parameter and observation of a notebook"""
+    np.random.seed(seed)
+    M = int(N * alpha)
+    if ensemble == "dct":
+        A = utils.make_random_dct_matrix(M, N)
+    else:
+        A = np.random.normal(0.0, 1.0 / np.sqrt(N if scale == "N" else M), (M, N))
+    x_0 = utils.make_true_parameter(N, 0.1)
+    y = A @ x_0 + np.random.normal(0.0, noise, M)
+    return A, x_0, y
+
+
+def solve_path(solver, l_path, tolerance, max_iteration=200):
+    """the warm-started path of the notebooks
+
+    Returns:
+        total number of iterations, number of points which did not converge and the last estimate
+    """
+    iterations, failures, x_hat = 0, 0, None
+    for l in l_path:
+        solver.l = l
+        with np.errstate(all="ignore"):
+            x_hat = solver.solve(max_iteration=max_iteration, tolerance=tolerance)
+        iterations += solver.result.n_iterations
+        failures += int(not np.all(solver.result.converged))
+    return iterations, failures, x_hat
+
+
+def main(n_points=15, tolerance=1e-5):
+    print("{:<40}{:<24}{:>8}{:>10}{:>8}{:>11}".format("scenario", "dumping", "iter", "products", "failed", "mse"))
+    totals = {}
+    for name, solver_class, ensemble, N, alpha, noise, scale, fixed in SCENARIOS:
+        A, x_0, y = make_problem(ensemble, N, alpha, noise, scale)
+        l_max = np.max(np.abs(A.T @ y))
+        l_path = np.geomspace(l_max, l_max / 300.0, n_points)
+        for label, dumping in (("fixed {}".format(fixed), fixed), ("adaptive", adaptive_dumping.AdaptiveDumping())):
+            np.random.seed(1)
+            solver = solver_class(A, y, l_path[0], dumping)
+            iterations, failures, x_hat = solve_path(solver, l_path, tolerance)
+            products = iterations * PRODUCTS_PER_ITERATION[solver_class]
+            totals[label.split()[0]] = totals.get(label.split()[0], 0) + products
+            print("{:<40}{:<24}{:>8}{:>10}{:>8}{:>11.2e}".format(name, label, iterations, products, failures,
+                                                                 np.mean(np.square(x_hat - x_0))))
+    print("\ntotal products: fixed {fixed}, adaptive {adaptive}".format(**totals))
+
+
+if __name__ == '__main__':
+    main(*[cast(arg) for cast, arg in zip((int, float), sys.argv[1:])])
@@ -0,0 +1,69 @@
+# coding=utf-8
+"""generation of the random observation matrices of utils.ensembles
+
+the previous make_random_dct_matrix, which built the whole DCT matrix from a list of python floats and copied
+the selected rows one by one, is timed against utils.make_random_dct_matrix and the DCT ensemble at a small size,
+and each ensemble generates a number of rows of a (N / 2, N) matrix, from which the time of the whole matrix
+is extrapolated (the whole matrix takes N^2 / 2 * 8 bytes, e.g. 16 GiB for N = 65536,
+which utils.ensembles.Ensemble.save writes into a .npy file block by block).
+
+usage:
+    python benchmarks/ensemble_benchmark.py [N] [rows]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ampy.utils import ensembles  # noqa: E402
+from ampy.utils import utils  # noqa: E402
+
+SMALL_N = 2048
+
+
+def previous_random_dct_matrix(m, n):
+    """make_random_dct_matrix before the vectorization"""
+    n_inv = 1.0 / n
+    pi = np.pi
+    B = np.cos([[pi * i * (2.0 * j + 1) * 0.5 * n_inv for j in range(n)] if i != 0 else [0] * n for i in range(n)])
+    B *= np.sqrt(2.0 / n)
+    B[0] *= 1.0 / np.sqrt(2)
+    return np.array([B[num] for num in np.random.permutation(n)[:m]])
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main(N=65536, rows=2048):
+    m = SMALL_N // 2
+    ensembles.DCTEnsemble(8, 8, seed=0).block(0, 8)  # compilation
+    print("(M, N) = ({}, {})".format(m, SMALL_N))
+    np.random.seed(0)
+    previous, elapsed = timed(previous_random_dct_matrix, m, SMALL_N)
+    print("{:<36}{:>10.3f} s".format("previous make_random_dct_matrix", elapsed))
+    np.random.seed(0)
+    current, elapsed = timed(utils.make_random_dct_matrix, m, SMALL_N)
+    print("{:<36}{:>10.3f} s   max difference {:.1e}".format("utils.make_random_dct_matrix", elapsed,
+                                                              np.max(np.abs(current - previous))))
+    _, elapsed = timed(ensembles.DCTEnsemble(m, SMALL_N, seed=0).toarray)
+    print("{:<36}{:>10.3f} s".format("DCTEnsemble.toarray", elapsed))
+
+    print("\n(M, N) = ({}, {}), {} rows".format(N // 2, N, rows))
+    print("{:<36}{:>10}{:>14}{:>16}".format("ensemble", "time[s]", "rows/s", "whole A[s]"))
+    for name, ensemble_class in [("GaussEnsemble", ensembles.GaussEnsemble),
+                                 ("DCTEnsemble", ensembles.DCTEnsemble),
+                                 ("HadamardEnsemble", ensembles.HadamardEnsemble)]:
+        ensemble = ensemble_class(N // 2, N, seed=0)
+        ensemble.block(0, 1)  # compilation
+        _, elapsed = timed(ensemble.block, 0, rows)
+        print("{:<36}{:>10.3f}{:>14.0f}{:>16.1f}".format(name, elapsed, rows / elapsed, N // 2 / rows * elapsed))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,129 @@
+# coding=utf-8
+"""time per iteration of the fused kernels against the previous numpy implementation
+
+the previous implementation is reproduced by the reference_* functions below,
+which evaluate the same element-wise expressions as the former __update_* methods
+(including the second product A2.T @ (1 / (1 + V)) of AMPSolver).
+
+usage:
+    python benchmarks/iteration_benchmark.py [N] [n_iterations]
+"""
+import contextlib
+import io
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ampy.AMPSolver import AMPSolver  # noqa: E402
+from ampy.SelfAveragingAMPSolver import SelfAveragingAMPSolver  # noqa: E402
+from ampy.SelfAveragingLMMSEVAMPSolver import SelfAveragingLMMSEVAMPSolver  # noqa: E402
+from ampy.utils import utils  # noqa: E402
+
+
+def reference_amp(A, A2, y, l, d, z, V, r, chi):
+    V_new = A2 @ chi
+    z = y - A @ r + (V / (1.0 + V)) * z
+    V = V_new
+    R = r + (A.T @ (z / (1.0 + V))) / (A2.T @ (1.0 / (1.0 + V)))
+    T = 1.0 / (A2.T @ (1.0 / (1.0 + V)))
+    new_r = (R - l * T * np.sign(R)) * np.heaviside(np.abs(R) - l * T, 0.5)
+    new_chi = T * np.heaviside(np.abs(R) - l * T, 0.5)
+    old_r = r.copy()
+    r = utils.update_dumping(r, new_r, d)
+    chi = utils.update_dumping(chi, new_chi, d)
+    np.linalg.norm(old_r - r)
+    return z, V, r, chi
+
+
+def reference_sa_amp(A, alpha, y, l, d, z, V, r, chi):
+    V_new = chi.mean()
+    z = y - A @ r + z * (V / (1.0 + V))
+    V = V_new
+    R = r + A.T @ z / alpha
+    T = (1.0 + V) / alpha
+    new_r = (R - l * T * np.sign(R)) * np.heaviside(np.abs(R) - l * T, 0.5)
+    new_chi = T * np.heaviside(np.abs(R) - l * T, 0.5)
+    old_r = r.copy()
+    r = utils.update_dumping(r, new_r, d)
+    chi = utils.update_dumping(chi, new_chi, d)
+    np.linalg.norm(old_r - r)
+    return z, V, r, chi
+
+
+def reference_sa_vamp(V_matrix, VT, s2, y_tilde, l, d, x_hat_1, r_1, gamma_1, eta_1):
+    old_x_hat_1 = x_hat_1.copy()
+    threshold = l / gamma_1
+    new_x_hat_1 = (r_1 - threshold * np.sign(r_1)) * np.heaviside(np.abs(r_1) - threshold, 0.5)
+    alpha_1 = np.mean(np.heaviside(np.abs(r_1) - threshold, 0.5))
+    x_hat_1 = utils.update_dumping(x_hat_1, new_x_hat_1, d)
+    eta_1 = np.clip(utils.update_dumping(eta_1, gamma_1 / alpha_1, d), 1e-9, 1e9)
+    gamma_2 = np.clip(eta_1 - gamma_1, 1e-9, 1e9)
+    r_2 = eta_1 / gamma_2 * x_hat_1 - gamma_1 / gamma_2 * r_1
+    d_2 = s2 / (s2 + gamma_2)
+    x_hat_2 = r_2 + V_matrix @ (d_2 * y_tilde) - V_matrix @ (d_2 * (VT @ r_2))
+    alpha_2 = 1.0 - d_2.mean()
+    eta_2 = gamma_2 / alpha_2
+    gamma_1 = np.clip(eta_2 - gamma_2, 1e-9, 1e9)
+    r_1 = eta_2 / gamma_1 * x_hat_2 - gamma_2 / gamma_1 * r_2
+    np.linalg.norm(old_x_hat_1 - x_hat_1)
+    return x_hat_1, r_1, gamma_1, eta_1
+
+
+def time_per_iteration(step, n_iterations):
+    step(1)  # compilation and warm-up
+    start = time.perf_counter()
+    step(n_iterations)
+    return (time.perf_counter() - start) / n_iterations
+
+
+def main(N=4000, n_iterations=50, alpha=0.5, rho=0.1, l=0.05, d=0.8):
+    M = int(alpha * N)
+    np.random.seed(0)
+    A = utils.make_gauss_matrix(M, N)
+    x_0 = utils.make_true_parameter(N, rho)
+    y = A @ x_0 + np.random.normal(0.0, 0.01, M)
+
+    def run(solver):
+        def step(n):
+            with contextlib.redirect_stdout(io.StringIO()):
+                solver.solve(max_iteration=n, tolerance=0.0)
+        return step
+
+    amp = AMPSolver(A, y, l, d)
+    sa_amp = SelfAveragingAMPSolver(A, y, l, d)
+    sa_vamp = SelfAveragingLMMSEVAMPSolver(A, y, l, d)
+
+    def reference(function, *args):
+        def step(n):
+            state = args[-4:]
+            for _ in range(n):
+                state = function(*args[:-4], *state)
+        return step
+
+    A2 = A * A
+    rows = [
+        ("AMPSolver",
+         time_per_iteration(reference(reference_amp, A, A2, y, l, d, amp.z, amp.V, amp.r, amp.chi), n_iterations),
+         time_per_iteration(run(amp), n_iterations)),
+        ("SelfAveragingAMPSolver",
+         time_per_iteration(reference(reference_sa_amp, A, M / N, y, l, d, sa_amp.z, 1.0, sa_amp.r, sa_amp.chi),
+                            n_iterations),
+         time_per_iteration(run(sa_amp), n_iterations)),
+        ("SelfAveragingLMMSEVAMPSolver",
+         time_per_iteration(reference(reference_sa_vamp, sa_vamp.V, sa_vamp.VT, sa_vamp.s2, sa_vamp.y_tilde, l, d,
+                                      sa_vamp.x_hat_1, sa_vamp.r_1, 1.0, 1.0), n_iterations),
+         time_per_iteration(run(sa_vamp), n_iterations)),
+    ]
+
+    print("N =", N, ", M =", M, ", iterations =", n_iterations)
+    print("{:<32}{:>16}{:>16}{:>10}".format("solver", "previous [ms]", "kernels [ms]", "speedup"))
+    for name, previous, current in rows:
+        print("{:<32}{:>16.3f}{:>16.3f}{:>10.2f}".format(name, previous * 1e3, current * 1e3, previous / current))
+
+
+if __name__ == '__main__':
+    main(*[int(v) for v in sys.argv[1:3]])
@@ -0,0 +1,302 @@
+# coding=utf-8
+"""benchmark suite of the solvers over problem sizes, measurement ratios, sparsities and matrix ensembles
+
+for each run the construction time, the time per iteration, the number of iterations to tolerance,
+the peak memory allocated during the construction and the solve (tracemalloc) and the MSE are reported.
+the results are written to a JSON file and compared against a stored baseline,
+and a run whose time exceeds the baseline by more than the threshold is reported as a regression
+(the exit status is 1 if there is any).
+
+ensembles:
+    gauss: utils.make_gauss_matrix
+    dct: utils.make_random_dct_matrix
+    hadamard: utils.ensembles.HadamardEnsemble (N a power of two)
+    orthogonal: utils.ensembles.OrthogonallyInvariantEnsemble with geometric singular values
+                of condition number CONDITION_NUMBER (on which AMP diverges and VAMP does not)
+    dct-operator: the same ensemble as dct, applied by utils.operators.SubsampledDCTOperator without being stored
+    hadamard-operator: the same ensemble as hadamard, applied by utils.operators.RandomizedHadamardOperator
+
+the default grid runs every solver on every ensemble for N = 1024, 4096, 16384 and 65536.
+a run whose stored matrices exceed --max-dense-bytes (A, and the decomposition of the VAMP solvers)
+or whose N x N matrices exceed --max-dense-n is skipped and recorded as such,
+so that with the default limits N = 16384 and 65536 are run on the matrix-free ensembles only
+(the solvers hold a few copies of a dense A, e.g. A2 and the columns of the active set,
+which exceed the memory of the reference machine from N = 16384 on).
+
+usage:
+    python benchmarks/solver_benchmark.py --N 1024 2048 4096 --alpha 0.5 --rho 0.1 --output results.json
+    python benchmarks/solver_benchmark.py --baseline benchmarks/baseline.json
+    python benchmarks/solver_benchmark.py --save-baseline benchmarks/baseline.json
+    python benchmarks/solver_benchmark.py --N 65536 --ensemble dct-operator hadamard-operator --alpha 0.3 0.5 0.7
+
+benchmarks/baseline.json stores the default grid recorded on the reference machine (see its "environment")
+at the current solvers, the timings are comparable only on the same machine.
+it is to be recorded again (--save-baseline) whenever the solvers change.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import scipy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numba  # noqa: E402
+
+from ampy.AMPSolver import AMPSolver  # noqa: E402
+from ampy.SelfAveragingAMPSolver import SelfAveragingAMPSolver  # noqa: E402
+from ampy.SelfAveragingLMMSEVAMPSolver import SelfAveragingLMMSEVAMPSolver  # noqa: E402
+from ampy.NaiveSelfAveragingLMMSEVAMPSolver import NaiveSelfAveragingLMMSEVAMPSolver  # noqa: E402
+from ampy.NaiveLMMSEVAMPSolver import NaiveLMMSEVAMPSolver  # noqa: E402
+from ampy.CGSelfAveragingLMMSEVAMPSolver import CGSelfAveragingLMMSEVAMPSolver  # noqa: E402
+from ampy.utils import ensembles  # noqa: E402
+from ampy.utils import operators  # noqa: E402
+from ampy.utils import utils  # noqa: E402
+
+SOLVERS = {
+    solver.__name__: solver for solver in (
+        AMPSolver, SelfAveragingAMPSolver, SelfAveragingLMMSEVAMPSolver, NaiveSelfAveragingLMMSEVAMPSolver,
+        NaiveLMMSEVAMPSolver, CGSelfAveragingLMMSEVAMPSolver,
+    )
+}
+
+# solvers which form N x N matrices
+DENSE_N_SOLVERS = ("NaiveSelfAveragingLMMSEVAMPSolver", "NaiveLMMSEVAMPSolver")
+
+# solvers which need a dense observation matrix
+DENSE_SOLVERS = ("SelfAveragingLMMSEVAMPSolver",) + DENSE_N_SOLVERS
+
+# solvers which need neither the decomposition nor N x N matrices for a row orthogonal operator
+ROW_ORTHOGONAL_SOLVERS = ("SelfAveragingLMMSEVAMPSolver", "NaiveSelfAveragingLMMSEVAMPSolver")
+
+# ensembles stored as dense matrices and applied without being stored
+DENSE_ENSEMBLES = ("gauss", "dct", "hadamard", "orthogonal")
+OPERATOR_ENSEMBLES = ("dct-operator", "hadamard-operator")
+
+# ratio of the largest to the smallest singular value of the orthogonal ensemble
+CONDITION_NUMBER = 10.0
+
+# timings compared against the baseline
+TIMINGS = ("construction_time", "time_per_iteration")
+
+
+def make_problem(ensemble, N, alpha, rho, sigma, seed):
+    """draw an observation matrix, a true parameter and an observation
+
+    Args:
+        ensemble: one of DENSE_ENSEMBLES or OPERATOR_ENSEMBLES
+        N: dimension of the parameter
+        alpha: measurement ratio M / N
+        rho: fraction of the non-zero components of the true parameter
+        sigma: standard deviation of the observation noise
+        seed: seed of np.random
+
+    Returns:
+        A, x_0 and y
+    """
+    M = int(alpha * N)
+    np.random.seed(seed)
+    if ensemble == "gauss":
+        A = utils.make_gauss_matrix(M, N)
+    elif ensemble == "dct":
+        A = utils.make_random_dct_matrix(M, N)
+    elif ensemble == "hadamard":
+        A = ensembles.HadamardEnsemble(M, N, seed=seed).toarray()
+    elif ensemble == "orthogonal":
+        singular_values = ensembles.geometric_singular_values(M, CONDITION_NUMBER, M)
+        A = ensembles.OrthogonallyInvariantEnsemble(M, N, singular_values, seed=seed).toarray()
+    elif ensemble == "dct-operator":
+        A = operators.SubsampledDCTOperator(M, N)
+    elif ensemble == "hadamard-operator":
+        A = ensembles.HadamardEnsemble(M, N, seed=seed).operator()
+    else:
+        raise ValueError("unknown ensemble: {}".format(ensemble))
+    x_0 = utils.make_true_parameter(N, rho)
+    y = A @ x_0 + np.random.normal(0.0, sigma, M)
+    return A, x_0, y
+
+
+def skip_reason(solver_name, ensemble, N, M, max_dense_bytes, max_dense_n):
+    """reason why a run is not executed
+
+    Returns:
+        reason, or None if the run is executed
+    """
+    if ensemble.startswith("hadamard") and N & (N - 1) != 0:
+        return "N of a Hadamard matrix must be a power of two"
+    closed_form = ensemble in OPERATOR_ENSEMBLES and solver_name in ROW_ORTHOGONAL_SOLVERS
+    # A, and U and VT of the decomposition (or the dense copy of NaiveLMMSEVAMPSolver)
+    stored = (ensemble in DENSE_ENSEMBLES) + (0 if closed_form else 2 * (solver_name in DENSE_SOLVERS))
+    if M * N * 8 * stored > max_dense_bytes:
+        return "dense observation matrix or decomposition exceeds --max-dense-bytes"
+    if solver_name in DENSE_N_SOLVERS and N > max_dense_n and not closed_form:
+        return "N x N matrices exceed --max-dense-n"
+    return None
+
+
+def run(solver_class, A, x_0, y, l, d, max_iteration, tolerance):
+    """construct and solve once
+
+    Returns:
+        dict of the measurements
+    """
+    tracemalloc.start()
+    try:
+        with np.errstate(all="ignore"), contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            solver = solver_class(A, y, l, d)
+            construction_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            x_hat = solver.solve(max_iteration=max_iteration, tolerance=tolerance)
+            solve_time = time.perf_counter() - start
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    n_iterations = solver.result.n_iterations
+    return {
+        "construction_time": construction_time,
+        "time_per_iteration": solve_time / max(n_iterations, 1),
+        "n_iterations": n_iterations,
+        "converged": bool(np.all(solver.result.converged)),
+        "peak_memory_bytes": peak_memory,
+        "mse": float(np.mean(np.square(x_hat - x_0))),
+    }
+
+
+def warm_up(solver_names, l, d):
+    """compile the kernels of the solvers on a small problem, so that the first run is not charged for it"""
+    A, x_0, y = make_problem("gauss", 64, 0.5, 0.1, 0.01, 0)
+    for name in solver_names:
+        run(SOLVERS[name], A, x_0, y, l, d, 2, 0.0)
+
+
+def environment():
+    """versions and machine of the run"""
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "numba": numba.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def run_key(result):
+    return result["solver"], result["ensemble"], result["N"], result["alpha"], result["rho"]
+
+
+def compare(results, baseline, threshold, min_difference):
+    """compare the timings against the baseline
+
+    Args:
+        results: results of this run
+        baseline: stored results
+        threshold: ratio of the time to the baseline time above which a run is a regression
+        min_difference: difference of the times in seconds below which a run is not a regression (timer noise)
+
+    Returns:
+        list of (run key, timing name, baseline time, time)
+    """
+    baseline_runs = {run_key(result): result for result in baseline["runs"] if "skipped" not in result}
+    regressions = []
+    for result in results["runs"]:
+        reference = baseline_runs.get(run_key(result))
+        if reference is None or "skipped" in result:
+            continue
+        for name in TIMINGS:
+            if result[name] > threshold * reference[name] and result[name] - reference[name] > min_difference:
+                regressions.append((run_key(result), name, reference[name], result[name]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--solver", nargs="+", default=list(SOLVERS), choices=list(SOLVERS))
+    parser.add_argument("--ensemble", nargs="+", default=list(DENSE_ENSEMBLES + OPERATOR_ENSEMBLES),
+                        choices=list(DENSE_ENSEMBLES + OPERATOR_ENSEMBLES))
+    parser.add_argument("--N", nargs="+", type=int, default=[1024, 4096, 16384, 65536])
+    parser.add_argument("--alpha", nargs="+", type=float, default=[0.5])
+    parser.add_argument("--rho", nargs="+", type=float, default=[0.1])
+    parser.add_argument("--sigma", type=float, default=0.01, help="standard deviation of the observation noise")
+    parser.add_argument("--l", type=float, default=0.05, help="regularization parameter")
+    parser.add_argument("--d", type=float, default=0.8, help="dumping coefficient")
+    parser.add_argument("--max-iteration", type=int, default=100)
+    parser.add_argument("--tolerance", type=float, default=1e-5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-dense-bytes", type=float, default=5e8,
+                        help="runs whose dense observation matrix or decomposition exceeds this size are skipped")
+    parser.add_argument("--max-dense-n", type=int, default=2000,
+                        help="solvers with N x N matrices are skipped above this N")
+    parser.add_argument("--output", default=None, help="JSON file of the results")
+    parser.add_argument("--baseline", default=None, help="JSON file of the stored results to compare against")
+    parser.add_argument("--save-baseline", default=None, help="store the results as a baseline")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="time ratio to the baseline above which a run is a regression")
+    parser.add_argument("--min-difference", type=float, default=1e-4,
+                        help="time difference to the baseline in seconds below which a run is not a regression")
+    args = parser.parse_args(argv)
+
+    warm_up(args.solver, args.l, args.d)
+
+    results = {"environment": environment(), "settings": vars(args), "runs": []}
+    print("{:<36}{:<19}{:>7}{:>6}{:>6}{:>12}{:>12}{:>6}{:>11}{:>11}".format(
+        "solver", "ensemble", "N", "alpha", "rho", "build [s]", "iter [ms]", "iter", "peak [MB]", "mse"))
+    for ensemble in args.ensemble:
+        for N in args.N:
+            for alpha in args.alpha:
+                for rho in args.rho:
+                    M = int(alpha * N)
+                    problem = None
+                    for name in args.solver:
+                        result = {"solver": name, "ensemble": ensemble, "N": N, "M": M, "alpha": alpha, "rho": rho}
+                        reason = skip_reason(name, ensemble, N, M, args.max_dense_bytes, args.max_dense_n)
+                        if reason is not None:
+                            result["skipped"] = reason
+                            results["runs"].append(result)
+                            print("{:<36}{:<19}{:>7}{:>6}{:>6}  skipped: {}".format(
+                                name, ensemble, N, alpha, rho, reason))
+                            continue
+                        if problem is None:
+                            problem = make_problem(ensemble, N, alpha, rho, args.sigma, args.seed)
+                        A, x_0, y = problem
+                        np.random.seed(args.seed)
+                        result.update(run(SOLVERS[name], A, x_0, y, args.l, args.d, args.max_iteration,
+                                          args.tolerance))
+                        results["runs"].append(result)
+                        print("{:<36}{:<19}{:>7}{:>6}{:>6}{:>12.3f}{:>12.3f}{:>6}{:>11.1f}{:>11.2e}".format(
+                            name, ensemble, N, alpha, rho, result["construction_time"],
+                            result["time_per_iteration"] * 1e3, result["n_iterations"],
+                            result["peak_memory_bytes"] / 2 ** 20, result["mse"]))
+
+    for path in (args.output, args.save_baseline):
+        if path is not None:
+            with open(path, "w") as f:
+                json.dump(results, f, indent=1)
+
+    if args.baseline is None:
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("environment") != results["environment"]:
+        print("\nwarning: the baseline was recorded in another environment", baseline.get("environment"))
+    regressions = compare(results, baseline, args.threshold, args.min_difference)
+    print("\n{} regression(s) against {} (threshold {:.2f}x)".format(len(regressions), args.baseline,
+                                                                      args.threshold))
+    for key, name, reference, current in regressions:
+        print("  {} {}: {:.4g} -> {:.4g} ({:.2f}x)".format(key, name, reference, current, current / reference))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
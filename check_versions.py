@@ -1,5 +1,6 @@
 import sys
 import numpy
+import scipy
 import matplotlib
 import sklearn
 import numba
@@ -7,6 +8,7 @@ import tqdm
 
 print("Python version= {0}.{1}.{2}".format(*sys.version_info[:3]))
 print("numpy version=", numpy.__version__)
+print("scipy version=", scipy.__version__)
 print("matplotlib version=", matplotlib.__version__)
 print("sklearn version=", sklearn.__version__)
 print("numba version=", numba.__version__)